@@ -1,6 +1,5 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, session, flash, send_file
 import mysql.connector
-from flask_mail import Mail, Message
 import bcrypt
 import secrets
 from datetime import datetime, timedelta
@@ -8,7 +7,24 @@ from functools import wraps
 import math
 import json
 import os
+import base64
 import pytz
+import threading
+import time
+import sys
+import click
+import report_events
+import incidents
+import report_analytics
+import report_latency
+import report_counters
+import report_search
+import feedback_stats
+import report_exports
+import export_jobs
+import change_feed
+import mail_outbox
+import status_digest
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
@@ -110,18 +126,63 @@ def get_db_connection():
         print(f"Database connection error: {e}")
         return None
 
-def send_admin_credentials_email(email, username, password, role_name, full_name):
-    """Send admin credentials to email"""
+# Supporting tables already created by this process
+_ensured_tables = set()
+
+def ensure_table(name, ddl):
+    """Create a supporting table (CREATE TABLE IF NOT EXISTS ddl) once per process.
+    
+    Runs on its own connection because DDL would implicitly commit an open
+    transaction.
+    """
+    if name in _ensured_tables:
+        return True
+    
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
     try:
-        from app import mail
-        
-        msg = Message(
-            subject='1TERA - Admin Account Created',
-            sender='onetigbauanemergencyresponse@gmail.com',
-            recipients=[email]
-        )
-        
-        msg.body = f'''
+        cur = conn.cursor()
+        cur.execute(ddl)
+        conn.commit()
+        cur.close()
+        conn.close()
+        _ensured_tables.add(name)
+        return True
+    except Exception as e:
+        print(f"Ensure table {name} error: {e}")
+        conn.close()
+        return False
+
+def ensure_index(table, name, columns, fulltext=False):
+    """Add an index to an existing table once per process (nothing happens if it exists)"""
+    key = f"{table}.{name}"
+    if key in _ensured_tables:
+        return True
+    
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", (name,))
+        if not cur.fetchall():
+            cur.execute(f"CREATE {'FULLTEXT ' if fulltext else ''}INDEX {name} ON {table} ({columns})")
+        conn.commit()
+        cur.close()
+        conn.close()
+        _ensured_tables.add(key)
+        return True
+    except Exception as e:
+        print(f"Ensure index {name} error: {e}")
+        conn.close()
+        return False
+
+def send_admin_credentials_email(email, username, password, role_name, full_name):
+    """Queue the admin credentials email"""
+    body = f'''
 Your 1TERA Admin Account Has Been Created
 
 Account Details:
@@ -142,12 +203,9 @@ If you didn't request this account, please contact the system administrator imme
 Stay safe,
 1TERA Admin Team
 '''
-        
-        mail.send(msg)
-        return True
-    except Exception as e:
-        print(f"Error sending admin credentials email: {e}")
-        return False
+    
+    return mail_outbox.enqueue_mail('1TERA - Admin Account Created', [email], body,
+                                    sender='onetigbauanemergencyresponse@gmail.com', category='admin_credentials')
 
 def calculate_estimated_time(user_lat, user_lng):
     """Calculate estimated arrival time from Tigbauan Plaza to user location"""
@@ -191,6 +249,15 @@ def calculate_estimated_time(user_lat, user_lng):
     except:
         return "Calculating..."
 
+# calculate_estimated_time's answers, soonest first
+ARRIVAL_ESTIMATES = ["Less than 5 minutes", "5-10 minutes", "10-20 minutes", "20-30 minutes", "30+ minutes"]
+
+def soonest_arrival(estimates):
+    """The earliest of several arrival estimates (unknown ones last), or None"""
+    rank = lambda estimate: (ARRIVAL_ESTIMATES.index(estimate) if estimate in ARRIVAL_ESTIMATES
+                             else len(ARRIVAL_ESTIMATES))
+    return min(estimates, key=rank, default=None)
+
 @admin_bp.route('/login', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
@@ -299,65 +366,18 @@ def get_brgy_reports_distribution():
         conn.close()
         return []
 
-def get_monthly_dispatch_stats():
-    """Get monthly dispatch statistics for the current year"""
-    conn = get_db_connection()
-    if not conn:
-        return []
+def get_monthly_dispatch_stats(year=None):
+    """Get monthly dispatch statistics for a year (the current year by default)"""
+    if not year:
+        year = datetime.now(MANILA_TZ).year
     
-    try:
-        cur = conn.cursor(dictionary=True)
-        
-        # Get dispatch counts by month for current year
-        cur.execute("""
-            SELECT 
-                MONTH(dispatched_at) as month,
-                COUNT(*) as dispatch_count,
-                emergency_type
-            FROM emergency_reports 
-            WHERE dispatched_at IS NOT NULL 
-            AND YEAR(dispatched_at) = YEAR(CURDATE())
-            GROUP BY MONTH(dispatched_at), emergency_type
-            ORDER BY month ASC
-        """)
-        
-        monthly_data = cur.fetchall()
-        
-        # Initialize monthly structure
-        months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
-                 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-        
-        # Group by emergency type
-        emergency_types = ['fire', 'medical', 'natural', 'accident', 'other']
-        monthly_stats = {etype: [0] * 12 for etype in emergency_types}
-        total_dispatches = [0] * 12
-        
-        # Fill the data
-        for record in monthly_data:
-            month_idx = record['month'] - 1
-            etype = record['emergency_type']
-            count = record['dispatch_count']
-            
-            if etype in monthly_stats:
-                monthly_stats[etype][month_idx] = count
-                total_dispatches[month_idx] += count
-        
-        cur.close()
-        conn.close()
-        
-        return {
-            'months': months,
-            'emergency_types': monthly_stats,
-            'total_dispatches': total_dispatches,
-            'current_year': datetime.now(MANILA_TZ).year
-        }
-        
-    except Exception as e:
-        print(f"Get monthly dispatch stats error: {e}")
-        conn.close()
-        return {'months': [], 'emergency_types': {}, 'total_dispatches': [], 'current_year': datetime.now(MANILA_TZ).year}
+    analytics = report_analytics.get_year_analytics(year)
+    if not analytics:
+        return {'months': [], 'emergency_types': {}, 'total_dispatches': [], 'year': year, 'current_year': year}
+    
+    return dict(analytics['monthly_dispatch'], current_year=year)
 
-def process_chart_data(reports_data):
+def process_chart_data(reports_data, year=None):
     """Process reports data for chart visualization"""
     import datetime
     from collections import defaultdict
@@ -393,10 +413,10 @@ def process_chart_data(reports_data):
     brgy_counts = [item['count'] for item in brgy_data[:15]]
     
     # Get monthly dispatch stats
-    monthly_stats = get_monthly_dispatch_stats()
+    monthly_stats = get_monthly_dispatch_stats(year)
     
     # Get monthly barangay stats
-    monthly_brgy_stats = get_monthly_brgy_stats()
+    monthly_brgy_stats = get_monthly_brgy_stats(year)
     
     # Get available years
     available_years = get_available_years()
@@ -503,6 +523,81 @@ def get_status_color(status, alpha=1):
     }
     return colors.get(status, f'rgba(107, 114, 128, {alpha})')
 
+# Date range of each chart period
+CHART_PERIODS = {
+    '7days': 'INTERVAL 7 DAY',
+    '30days': 'INTERVAL 30 DAY',
+    '90days': 'INTERVAL 90 DAY',
+    '1year': 'INTERVAL 1 YEAR'
+}
+
+# Chart data is the same for every admin, so it is computed at most once
+# per CHART_DATA_TTL seconds for each (period, year) and dropped on report events
+CHART_DATA_TTL = 60
+_chart_data_cache = {}
+_chart_data_version = {'version': 0}
+_chart_data_locks = {period: threading.Lock() for period in CHART_PERIODS}
+
+@report_events.subscribe
+def invalidate_chart_data(event):
+    if event['kind'] == 'status_changed' and event['old_status'] == event['new_status']:
+        return
+    _chart_data_version['version'] += 1
+    _chart_data_cache.clear()
+
+def compute_chart_data(period, year):
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        reports_data = fetch_chart_rows(cur, CHART_PERIODS[period])
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Compute chart data error: {e}")
+        conn.close()
+        return None
+    
+    return process_chart_data(reports_data, year)
+
+def get_cached_chart_data(period):
+    """Chart data for a period of the current year, or None if it could not be computed"""
+    if period not in CHART_PERIODS:
+        period = '7days'
+    key = (period, datetime.now(MANILA_TZ).year)
+    
+    cached = _chart_data_cache.get(key)
+    if cached and time.monotonic() < cached['expires']:
+        return cached['chart_data']
+    
+    # Only one request recomputes a period; the others wait for its result
+    with _chart_data_locks[period]:
+        cached = _chart_data_cache.get(key)
+        if cached and time.monotonic() < cached['expires']:
+            return cached['chart_data']
+        
+        version = _chart_data_version['version']
+        chart_data = compute_chart_data(*key)
+        
+        # A report event during the computation makes this result stale already
+        if chart_data is not None and version == _chart_data_version['version']:
+            _chart_data_cache[key] = {
+                'chart_data': chart_data,
+                'expires': time.monotonic() + CHART_DATA_TTL
+            }
+        return chart_data
+
+@admin_bp.cli.command('reconcile-status-counters')
+def reconcile_status_counters_command():
+    """Recount the live status counters from emergency_reports"""
+    rows = report_counters.reconcile_status_counters()
+    if rows is None:
+        print("Status counter reconcile failed")
+    else:
+        print(f"Status counters reconciled: {rows} rows")
+
 @admin_bp.route('/dashboard')
 @admin_login_required
 def admin_dashboard():
@@ -521,16 +616,8 @@ def admin_dashboard():
     try:
         cur = conn.cursor(dictionary=True)
         
-        # Get emergency reports statistics
-        cur.execute("""
-            SELECT 
-                COUNT(*) as total_reports,
-                SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending_reports,
-                SUM(CASE WHEN status = 'in_progress' THEN 1 ELSE 0 END) as in_progress_reports,
-                SUM(CASE WHEN status = 'resolved' THEN 1 ELSE 0 END) as resolved_reports
-            FROM emergency_reports
-        """)
-        stats = cur.fetchone()
+        # Get emergency reports statistics from the live counters
+        stats = report_counters.status_counts(cur)
         
         # Get recent emergency reports (limited to 5)
         cur.execute("""
@@ -543,13 +630,10 @@ def admin_dashboard():
         recent_reports = cur.fetchall()
         
         # Get emergency types distribution for bar chart
-        cur.execute("""
-            SELECT emergency_type, COUNT(*) as count
-            FROM emergency_reports
-            GROUP BY emergency_type
-            ORDER BY count DESC
-        """)
-        emergency_types = cur.fetchall()
+        emergency_types = sorted(
+            ({'emergency_type': etype, 'count': count} for etype, count in stats['by_type'].items() if count),
+            key=lambda item: item['count'], reverse=True
+        )
         
         # Get today's reports count
         cur.execute("""
@@ -559,35 +643,14 @@ def admin_dashboard():
         """)
         today_stats = cur.fetchone()
         
-        # Get reports data for charts
-        cur.execute("""
-            SELECT 
-                DATE(created_at) as date,
-                COUNT(*) as count,
-                emergency_type,
-                status
-            FROM emergency_reports 
-            WHERE created_at >= DATE_SUB(NOW(), INTERVAL 1 YEAR)
-            GROUP BY DATE(created_at), emergency_type, status
-            ORDER BY date ASC
-        """)
-        reports_data = cur.fetchall()
-        
-        # Get feedbacks for dashboard
-        cur.execute("""
-            SELECT f.*, u.fname, u.lname, u.email
-            FROM feedback f
-            JOIN users u ON f.user_id = u.id
-            ORDER BY f.created_at DESC
-            LIMIT 10
-        """)
-        feedbacks = cur.fetchall()
-        
         cur.close()
         conn.close()
         
-        # Process data for charts
-        chart_data = process_chart_data(reports_data)
+        # Latest feedbacks are shared between admins and cached until new feedback arrives
+        feedbacks = feedback_stats.latest_feedbacks(10)
+        
+        # Chart data is shared between admins and usually cached
+        chart_data = get_cached_chart_data('1year') or {}
         
         return render_template('admin_dashboard.html',
                              stats=stats,
@@ -608,40 +671,10 @@ def get_chart_data():
     """API endpoint for chart data with filters"""
     period = request.args.get('period', '7days')
     
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'success': False, 'message': 'Database connection error'})
-    
     try:
-        cur = conn.cursor(dictionary=True)
-        
-        # Define date ranges based on period
-        date_ranges = {
-            '7days': 'INTERVAL 7 DAY',
-            '30days': 'INTERVAL 30 DAY',
-            '90days': 'INTERVAL 90 DAY',
-            '1year': 'INTERVAL 1 YEAR'
-        }
-        
-        date_range = date_ranges.get(period, 'INTERVAL 7 DAY')
-        
-        cur.execute(f"""
-            SELECT 
-                DATE(created_at) as date,
-                COUNT(*) as count,
-                emergency_type,
-                status
-            FROM emergency_reports 
-            WHERE created_at >= DATE_SUB(NOW(), {date_range})
-            GROUP BY DATE(created_at), emergency_type, status
-            ORDER BY date ASC
-        """)
-        reports_data = cur.fetchall()
-        
-        cur.close()
-        conn.close()
-        
-        chart_data = process_chart_data(reports_data)
+        chart_data = get_cached_chart_data(period)
+        if chart_data is None:
+            return jsonify({'success': False, 'message': 'Database connection error'})
         
         return jsonify({
             'success': True,
@@ -651,7 +684,6 @@ def get_chart_data():
         
     except Exception as e:
         print(f"Get chart data error: {e}")
-        conn.close()
         return jsonify({'success': False, 'message': 'Error fetching chart data'})
 
 @admin_bp.route('/get_brgy_data')
@@ -675,9 +707,8 @@ def admin_reports():
     if session.get('admin_role') == 'radio_operator':
         return redirect(url_for('admin.radio_operator_dashboard'))
     
-    page = request.args.get('page', 1, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
     per_page = 10
-    offset = (page - 1) * per_page
     
     conn = get_db_connection()
     if not conn:
@@ -687,38 +718,29 @@ def admin_reports():
     try:
         cur = conn.cursor(dictionary=True)
         
-        # Get total count for pagination
-        cur.execute("SELECT COUNT(*) as total FROM emergency_reports")
-        total = cur.fetchone()['total']
-        
-        # Get paginated emergency reports with user info
-        cur.execute("""
-            SELECT er.*, u.fname, u.lname, u.phone_num, u.email
-            FROM emergency_reports er
-            LEFT JOIN users u ON er.user_id = u.id
-            ORDER BY er.created_at DESC
-            LIMIT %s OFFSET %s
-        """, (per_page, offset))
-        reports = cur.fetchall()
+        # Get total count for pagination (and the badge) from the live counters
+        stats = report_counters.status_counts(cur)
+        total = stats['total_reports']
         
-        # Get statistics for the badge
-        cur.execute("""
-            SELECT 
-                SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending_reports
-            FROM emergency_reports
-        """)
-        stats = cur.fetchone()
+        # Get the page of emergency reports after/before the cursor
+        reports, next_cursor, prev_cursor = fetch_reports_page(
+            cur, per_page,
+            after=decode_report_cursor(request.args.get('after')),
+            before=decode_report_cursor(request.args.get('before'))
+        )
         
-        # Calculate pagination
-        total_pages = (total + per_page - 1) // per_page
+        # Calculate pagination (page numbers are carried along in the links)
+        total_pages = max((total + per_page - 1) // per_page, 1)
         
         pagination = {
             'page': page,
             'per_page': per_page,
             'total': total,
             'total_pages': total_pages,
-            'has_prev': page > 1,
-            'has_next': page < total_pages
+            'has_prev': prev_cursor is not None,
+            'has_next': next_cursor is not None,
+            'prev_cursor': prev_cursor,
+            'next_cursor': next_cursor
         }
         
         cur.close()
@@ -734,6 +756,163 @@ def admin_reports():
         conn.close()
         return render_template('admin_reports.html', reports=[], pagination=None, stats={})
 
+@admin_bp.route('/get_reports_page')
+@admin_login_required
+def get_reports_page():
+    """JSON page of reports after a cursor, with the rendered table rows for scrolling"""
+    per_page = min(max(request.args.get('per_page', 25, type=int), 1), 100)
+    after = decode_report_cursor(request.args.get('after'))
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'Database connection error'})
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        reports, next_cursor, _ = fetch_reports_page(cur, per_page, after=after)
+        total = report_counters.status_counts(cur)['total_reports']
+        cur.close()
+        conn.close()
+        
+        return jsonify({
+            'success': True,
+            'reports': [{
+                'id': report['id'],
+                'emergency_type': report['emergency_type'],
+                'status': report['status'],
+                'location': report['location'],
+                'created_at': report['created_at'].isoformat() if report['created_at'] else None
+            } for report in reports],
+            'rows_html': ''.join(render_template('admin_report_row.html', report=report) for report in reports),
+            'next_cursor': next_cursor,
+            'total': total
+        })
+        
+    except Exception as e:
+        print(f"Get reports page error: {e}")
+        conn.close()
+        return jsonify({'success': False, 'message': 'Error loading reports'})
+
+@admin_bp.route('/search_reports')
+@admin_login_required
+def search_reports():
+    """Search reports by text, type, status, barangay and date, with facet counts"""
+    try:
+        filters = report_filters(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD'}), 400
+    per_page = min(max(request.args.get('per_page', report_search.SEARCH_PAGE_SIZE, type=int), 1), 100)
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'Database connection error'})
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        reports, next_cursor, facets, total = report_search.search_reports(
+            cur, filters, after=decode_report_cursor(request.args.get('after')), per_page=per_page)
+        cur.close()
+        conn.close()
+        
+        return jsonify({
+            'success': True,
+            'reports': [{
+                'id': report['id'],
+                'emergency_type': report['emergency_type'],
+                'status': report['status'],
+                'location': report['location'],
+                'created_at': report['created_at'].isoformat() if report['created_at'] else None
+            } for report in reports],
+            'rows_html': ''.join(render_template('admin_report_row.html', report=report) for report in reports),
+            'next_cursor': next_cursor,
+            'facets': facets,
+            'total': total
+        })
+        
+    except Exception as e:
+        print(f"Search reports error: {e}")
+        conn.close()
+        return jsonify({'success': False, 'message': 'Error searching reports'})
+
+def report_filters(args):
+    """Report search filters (q, type, status, barangay, since, until) from request args.
+    
+    Raises ValueError for dates that are not YYYY-MM-DD.
+    """
+    filters = {
+        'q': args.get('q', '').strip(),
+        'emergency_type': args.get('type') or None,
+        'status': args.get('status') or None,
+        'barangay': args.get('barangay') or None
+    }
+    for field in ('since', 'until'):
+        value = args.get(field)
+        filters[field] = datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    return filters
+
+def encode_report_cursor(report):
+    """Opaque page cursor for a row's (created_at, id) position (reports, map points, feedback)"""
+    position = f"{report['created_at'].isoformat()}|{report['id']}"
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+def decode_report_cursor(cursor):
+    """(created_at, id) from a cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        position = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, report_id = position.split('|')
+        return datetime.fromisoformat(created_at), int(report_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def fetch_reports_page(cur, per_page, after=None, before=None):
+    """One page of reports, newest first, ordered by (created_at, id).
+    
+    after/before are (created_at, id) positions from decode_report_cursor:
+    the page holds the reports right after (older than) or right before
+    (newer than) that position. Reports arriving meanwhile never shift a
+    page. Returns (reports, next_cursor, prev_cursor); a cursor is None at
+    that end of the list.
+    """
+    ensure_index('emergency_reports', 'idx_reports_created', 'created_at, id')
+    
+    conditions = "er.created_at IS NOT NULL"
+    params = []
+    order = "DESC"
+    if after:
+        conditions += " AND (er.created_at < %s OR (er.created_at = %s AND er.id < %s))"
+        params = [after[0], after[0], after[1]]
+    elif before:
+        conditions += " AND (er.created_at > %s OR (er.created_at = %s AND er.id > %s))"
+        params = [before[0], before[0], before[1]]
+        order = "ASC"
+    
+    cur.execute(f"""
+        SELECT er.*, u.fname, u.lname, u.phone_num, u.email
+        FROM emergency_reports er
+        LEFT JOIN users u ON er.user_id = u.id
+        WHERE {conditions}
+        ORDER BY er.created_at {order}, er.id {order}
+        LIMIT %s
+    """, params + [per_page + 1])
+    reports = cur.fetchall()
+    
+    more = len(reports) > per_page
+    reports = reports[:per_page]
+    if before:
+        reports.reverse()
+    
+    if not reports:
+        return reports, None, None
+    
+    # Walking backwards, "more" means there are newer pages; otherwise older ones
+    has_older = (before is not None) or more
+    has_newer = more if before else after is not None
+    next_cursor = encode_report_cursor(reports[-1]) if has_older else None
+    prev_cursor = encode_report_cursor(reports[0]) if has_newer else None
+    return reports, next_cursor, prev_cursor
+
 @admin_bp.route('/update_report_status', methods=['POST'])
 @admin_login_required
 def update_report_status():
@@ -752,7 +931,10 @@ def update_report_status():
         cur = conn.cursor(dictionary=True)
         
         # Get current status for comparison
-        cur.execute("SELECT status, user_id FROM emergency_reports WHERE id = %s", (report_id,))
+        cur.execute("""
+            SELECT id, status, user_id, emergency_type, latitude, longitude 
+            FROM emergency_reports WHERE id = %s
+        """, (report_id,))
         report = cur.fetchone()
         
         if not report:
@@ -821,11 +1003,19 @@ def update_report_status():
                 VALUES (%s, %s, %s, %s, %s, %s, %s)
             """, (user_id, report_id, "1TERA - Status Update", message, 
                   new_status, datetime.now(MANILA_TZ), False))
+            
+            status_digest.buffer_status_message(cur, user_id, report_id, "Report Status Updated", message)
+        
+        event = report_events.report_event(
+            'status_changed', dict(report, status=new_status), old_status=current_status)
+        report_events.record(cur, event)
         
         conn.commit()
         cur.close()
         conn.close()
         
+        report_events.publish(event)
+        
         return jsonify({'success': True, 'message': 'Status updated successfully'})
         
     except Exception as e:
@@ -1037,11 +1227,13 @@ def send_alert():
 @admin_bp.route('/dispatch_response', methods=['POST'])
 @admin_login_required
 def dispatch_response():
+    """Dispatch a response to a report, or to every open report of an incident"""
     report_id = request.form.get('report_id')
+    incident_id = request.form.get('incident_id')
     response_type = request.form.get('response_type')
     notes = request.form.get('notes', '')
     
-    if not report_id or not response_type:
+    if not (report_id or incident_id) or not response_type:
         return jsonify({'success': False, 'message': 'Missing required fields'})
     
     conn = get_db_connection()
@@ -1051,78 +1243,120 @@ def dispatch_response():
     try:
         cur = conn.cursor(dictionary=True)
         
-        # Get report location for ETA calculation and user_id
-        cur.execute("SELECT latitude, longitude, user_id FROM emergency_reports WHERE id = %s", (report_id,))
-        report = cur.fetchone()
-        
-        if not report:
-            return jsonify({'success': False, 'message': 'Report not found'})
-        
-        estimated_arrival = "Calculating..."
-        if report and report['latitude'] and report['longitude']:
-            estimated_arrival = calculate_estimated_time(report['latitude'], report['longitude'])
+        if incident_id and incidents.ensure_incident_tables():
+            # Reports already dispatched keep their dispatch time, ETA and notification
+            report_ids = incidents.pending_incident_report_ids(cur, incident_id)
         else:
-            estimated_arrival = "Location data unavailable"
-        
-        # Update the report with dispatch information and automatically set status to in_progress
-        update_query = """
-            UPDATE emergency_reports 
-            SET status = 'in_progress', 
-                response_type = %s, 
-                estimated_arrival = %s,
-                dispatched_at = %s,
-                updated_at = %s
-        """
-        update_params = [response_type, estimated_arrival, datetime.now(), datetime.now()]
-        
-        # admin_notes if provided
-        if notes:
-            cur.execute("SHOW COLUMNS FROM emergency_reports LIKE 'admin_notes'")
-            if cur.fetchone():
-                update_query += ", admin_notes = %s"
-                update_params.append(notes)
-        
-        update_query += " WHERE id = %s"
-        update_params.append(report_id)
+            report_ids = [report_id] if report_id else []
         
-        cur.execute(update_query, update_params)
-        
-        # Send notification to user if user_id exists
-        if report['user_id']:
-            response_types = {
-                'fire': 'Fire truck',
-                'medical': 'Ambulance', 
-                'police': 'Police unit',
-                'rescue': 'Rescue team'
-            }
+        events = []
+        # Estimates of the reports actually dispatched (skipped ones are left out)
+        arrivals = []
+        for report_id in report_ids:
+            # Get report location for ETA calculation and user_id
+            cur.execute("""
+                SELECT id, status, latitude, longitude, user_id, emergency_type 
+                FROM emergency_reports WHERE id = %s
+            """, (report_id,))
+            report = cur.fetchone()
+            
+            if not report:
+                continue
+            
+            estimated_arrival = "Calculating..."
+            if report and report['latitude'] and report['longitude']:
+                estimated_arrival = calculate_estimated_time(report['latitude'], report['longitude'])
+            else:
+                estimated_arrival = "Location data unavailable"
+            
+            # Update the report with dispatch information and automatically set status to in_progress
+            update_query = """
+                UPDATE emergency_reports 
+                SET status = 'in_progress', 
+                    response_type = %s, 
+                    estimated_arrival = %s,
+                    dispatched_at = %s,
+                    updated_at = %s
+            """
+            update_params = [response_type, estimated_arrival, datetime.now(), datetime.now()]
             
-            message = f"{response_types.get(response_type, 'Emergency response')} has been dispatched! Estimated arrival: {estimated_arrival}"
+            # admin_notes if provided
             if notes:
-                message += f". Notes: {notes}"
+                cur.execute("SHOW COLUMNS FROM emergency_reports LIKE 'admin_notes'")
+                if cur.fetchone():
+                    update_query += ", admin_notes = %s"
+                    update_params.append(notes)
             
-            # Create notification in database
-            cur.execute("""
-                INSERT INTO user_notifications 
-                (user_id, report_id, notification_type, title, message, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (report['user_id'], report_id, 'dispatched', 
-                  "Response Dispatched", message, datetime.now()))
+            update_query += " WHERE id = %s"
+            update_params.append(report_id)
+            if incident_id:
+                # Another dispatch may have taken the report since it was listed
+                update_query += " AND status = 'pending'"
             
-            # Also store in push notifications table
-            cur.execute("""
-                INSERT INTO push_notifications 
-                (user_id, report_id, title, body, notification_type, created_at, is_sent)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (report['user_id'], report_id, "1TERA - Response Dispatched", message, 
-                  'dispatched', datetime.now(), False))
+            cur.execute(update_query, update_params)
+            if incident_id and cur.rowcount == 0:
+                continue
+            arrivals.append(estimated_arrival)
+            
+            # Send notification to user if user_id exists
+            if report['user_id']:
+                response_types = {
+                    'fire': 'Fire truck',
+                    'medical': 'Ambulance', 
+                    'police': 'Police unit',
+                    'rescue': 'Rescue team'
+                }
+                
+                message = f"{response_types.get(response_type, 'Emergency response')} has been dispatched! Estimated arrival: {estimated_arrival}"
+                if notes:
+                    message += f". Notes: {notes}"
+                
+                # Create notification in database
+                cur.execute("""
+                    INSERT INTO user_notifications 
+                    (user_id, report_id, notification_type, title, message, created_at)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, (report['user_id'], report_id, 'dispatched', 
+                      "Response Dispatched", message, datetime.now()))
+                
+                # Also store in push notifications table
+                cur.execute("""
+                    INSERT INTO push_notifications 
+                    (user_id, report_id, title, body, notification_type, created_at, is_sent)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, (report['user_id'], report_id, "1TERA - Response Dispatched", message, 
+                      'dispatched', datetime.now(), False))
+                
+                status_digest.buffer_status_message(cur, report['user_id'], report_id, "Response Dispatched", message)
+            
+            event = report_events.report_event(
+                'status_changed', dict(report, status='in_progress'), old_status=report['status'])
+            report_events.record(cur, event)
+            events.append(event)
+        
+        if not events:
+            cur.close()
+            conn.close()
+            if incident_id:
+                return jsonify({'success': False, 'message': 'No pending reports left in this incident'})
+            return jsonify({'success': False, 'message': 'Report not found'})
         
         conn.commit()
         cur.close()
         conn.close()
         
+        for event in events:
+            report_events.publish(event)
+        
+        estimated_arrival = soonest_arrival(arrivals)
+        message = f'Response dispatched successfully! Estimated arrival: {estimated_arrival}'
+        if len(events) > 1:
+            message = f'Response dispatched to {len(events)} reports of this incident! First arrival: {estimated_arrival}'
+        
         return jsonify({
             'success': True, 
-            'message': f'Response dispatched successfully! Estimated arrival: {estimated_arrival}'
+            'message': message,
+            'report_ids': [event['report_id'] for event in events]
         })
         
     except Exception as e:
@@ -1202,7 +1436,13 @@ def mark_notification_read_for_report(report_id):
         return jsonify({'success': False, 'message': 'Database connection error'})
     
     try:
-        cur = conn.cursor()
+        cur = conn.cursor(dictionary=True)
+        
+        cur.execute("""
+            SELECT id, status, user_id, emergency_type, latitude, longitude 
+            FROM emergency_reports WHERE id = %s
+        """, (report_id,))
+        report = cur.fetchone()
         
         # Update emergency_reports table to mark as viewed or update status
         # This is a simplified implementation - you might need to adjust based on your notification system
@@ -1211,11 +1451,19 @@ def mark_notification_read_for_report(report_id):
             SET status = 'in_progress', updated_at = %s 
             WHERE id = %s AND status = 'pending'
         """, (datetime.now(), report_id))
+        event = None
+        if report and cur.rowcount > 0:
+            event = report_events.report_event(
+                'status_changed', dict(report, status='in_progress'), old_status='pending')
+            report_events.record(cur, event)
         
         conn.commit()
         cur.close()
         conn.close()
         
+        if event:
+            report_events.publish(event)
+        
         return jsonify({'success': True, 'message': 'Notifications marked as read for report'})
         
     except Exception as e:
@@ -1227,37 +1475,117 @@ def mark_notification_read_for_report(report_id):
 @admin_login_required
 def admin_users_feedback():
     """User Feedbacks Management Page"""
+    filters = feedback_filters()
     conn = get_db_connection()
     if not conn:
         flash('Database connection error', 'error')
-        return render_template('admin_users_feedback.html', feedbacks=[])
+        return render_template('admin_users_feedback.html', feedbacks=[], overview=feedback_stats.summarize_ratings({}),
+                               next_cursor=None, filters=filters)
     
     try:
         cur = conn.cursor(dictionary=True)
         
-        # Get all feedbacks with user info
-        cur.execute("""
-            SELECT f.*, u.fname, u.lname, u.email
-            FROM feedback f
-            JOIN users u ON f.user_id = u.id
-            ORDER BY f.created_at DESC
-        """)
-        feedbacks = cur.fetchall()
+        # First page of feedbacks; the rest is loaded while scrolling
+        feedbacks, next_cursor = feedback_stats.fetch_feedback_page(cur, **filters)
+        overview = feedback_stats.feedback_overview(cur)
         
         cur.close()
         conn.close()
         
-        return render_template('admin_users_feedback.html', feedbacks=feedbacks)
+        return render_template('admin_users_feedback.html', feedbacks=feedbacks, overview=overview,
+                               next_cursor=next_cursor, filters=filters)
         
     except Exception as e:
         print(f"Admin users feedback error: {e}")
         conn.close()
-        return render_template('admin_users_feedback.html', feedbacks=[])
+        return render_template('admin_users_feedback.html', feedbacks=[], overview=feedback_stats.summarize_ratings({}),
+                               next_cursor=None, filters=filters)
 
-@admin_bp.route('/mayor_dashboard')
-@admin_login_required
-def mayor_dashboard():
-    return render_template('mayor_dashboard.html')
+def feedback_filters():
+    """feedback_type/rating filters of a feedback request (invalid ratings are ignored)"""
+    rating = request.args.get('rating', type=int)
+    return {
+        'feedback_type': request.args.get('type') or None,
+        'rating': rating if rating in feedback_stats.FEEDBACK_RATINGS else None
+    }
+
+@admin_bp.route('/get_feedback_page')
+@admin_login_required
+def get_feedback_page():
+    """JSON page of feedbacks after a cursor, with the rendered items for scrolling"""
+    per_page = min(max(request.args.get('per_page', feedback_stats.FEEDBACK_PAGE_SIZE, type=int), 1), 100)
+    after = decode_report_cursor(request.args.get('after'))
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'Database connection error'})
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        feedbacks, next_cursor = feedback_stats.fetch_feedback_page(cur, per_page, after=after, **feedback_filters())
+        cur.close()
+        conn.close()
+        
+        return jsonify({
+            'success': True,
+            'feedbacks': [{
+                'id': feedback['id'],
+                'rating': feedback['rating'],
+                'feedback_type': feedback['feedback_type'],
+                'created_at': feedback['created_at'].isoformat() if feedback['created_at'] else None
+            } for feedback in feedbacks],
+            'items_html': ''.join(render_template('admin_feedback_item.html', feedback=feedback) for feedback in feedbacks),
+            'next_cursor': next_cursor
+        })
+        
+    except Exception as e:
+        print(f"Get feedback page error: {e}")
+        conn.close()
+        return jsonify({'success': False, 'message': 'Error loading feedbacks'})
+
+@admin_bp.route('/get_feedback_overview')
+@admin_login_required
+def get_feedback_overview():
+    """Rating histogram and averages overall, per feedback type and per month"""
+    try:
+        since = request.args.get('since')
+        until = request.args.get('until')
+        since = datetime.strptime(since, '%Y-%m').date() if since else None
+        until = datetime.strptime(until, '%Y-%m').date() if until else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Months must be YYYY-MM'}), 400
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'Database connection error'})
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        overview = feedback_stats.feedback_overview(cur, feedback_type=request.args.get('type') or None,
+                                                    since=since, until=until)
+        cur.close()
+        conn.close()
+        
+        return jsonify({'success': True, 'overview': overview})
+        
+    except Exception as e:
+        print(f"Get feedback overview error: {e}")
+        conn.close()
+        return jsonify({'success': False, 'message': 'Error loading feedback overview'})
+
+@admin_bp.cli.command('rebuild-feedback-rollup')
+def rebuild_feedback_rollup_command():
+    """Recount the feedback rating rollup from feedback"""
+    rows = feedback_stats.rebuild_feedback_rollup()
+    if rows is None:
+        print("Feedback rollup rebuild failed")
+    else:
+        print(f"Feedback rollup rebuilt: {rows} rows")
+
+@admin_bp.route('/mayor_dashboard')
+@admin_login_required
+def mayor_dashboard():
+    return render_template('mayor_dashboard.html')
 
 @admin_bp.route('/engr_dashboard')
 @admin_login_required
@@ -1287,35 +1615,10 @@ def admin_logout():
 @admin_login_required
 def get_feedbacks():
     """Get user feedbacks for dashboard"""
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'success': False, 'message': 'Database connection error'})
-    
-    try:
-        cur = conn.cursor(dictionary=True)
-        
-        # Get recent feedbacks
-        cur.execute("""
-            SELECT f.*, u.fname, u.lname, u.email
-            FROM feedback f
-            JOIN users u ON f.user_id = u.id
-            ORDER BY f.created_at DESC
-            LIMIT 5
-        """)
-        feedbacks = cur.fetchall()
-        
-        cur.close()
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'feedbacks': feedbacks
-        })
-        
-    except Exception as e:
-        print(f"Get feedbacks error: {e}")
-        conn.close()
-        return jsonify({'success': False, 'message': 'Error fetching feedbacks'})
+    return jsonify({
+        'success': True,
+        'feedbacks': feedback_stats.latest_feedbacks(5)
+    })
 
 @admin_bp.route('/get_notifications')
 @admin_login_required
@@ -1511,28 +1814,32 @@ def radio_operator_dashboard():
     try:
         cur = conn.cursor(dictionary=True)
         
-        # Get active emergency reports (pending and in progress)
-        cur.execute("""
-            SELECT er.*, u.fname, u.lname, u.phone_num, u.email
-            FROM emergency_reports er
-            LEFT JOIN users u ON er.user_id = u.id
-            WHERE er.status IN ('pending', 'in_progress')
-            ORDER BY 
-                CASE WHEN er.status = 'pending' THEN 1 ELSE 2 END,
-                er.created_at DESC
-        """)
-        active_reports = cur.fetchall()
+        # Get active emergency reports (pending and in progress), one entry per incident
+        if incidents.ensure_incident_tables():
+            cur.execute("""
+                SELECT er.*, u.fname, u.lname, u.phone_num, u.email, ir.incident_id
+                FROM emergency_reports er
+                LEFT JOIN users u ON er.user_id = u.id
+                LEFT JOIN incident_reports ir ON ir.report_id = er.id
+                WHERE er.status IN ('pending', 'in_progress')
+                ORDER BY 
+                    CASE WHEN er.status = 'pending' THEN 1 ELSE 2 END,
+                    er.created_at DESC
+            """)
+        else:
+            cur.execute("""
+                SELECT er.*, u.fname, u.lname, u.phone_num, u.email, NULL as incident_id
+                FROM emergency_reports er
+                LEFT JOIN users u ON er.user_id = u.id
+                WHERE er.status IN ('pending', 'in_progress')
+                ORDER BY 
+                    CASE WHEN er.status = 'pending' THEN 1 ELSE 2 END,
+                    er.created_at DESC
+            """)
+        active_reports = incidents.group_reports_by_incident(cur.fetchall())
         
-        # Get statistics for the dashboard
-        cur.execute("""
-            SELECT 
-                COUNT(*) as total_reports,
-                SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending_reports,
-                SUM(CASE WHEN status = 'in_progress' THEN 1 ELSE 0 END) as in_progress_reports,
-                SUM(CASE WHEN status = 'resolved' THEN 1 ELSE 0 END) as resolved_reports
-            FROM emergency_reports
-        """)
-        stats = cur.fetchone()
+        # Get statistics for the dashboard from the live counters
+        stats = report_counters.status_counts(cur)
         
         # Get today's reports count
         cur.execute("""
@@ -1718,10 +2025,135 @@ def mark_report_viewed(report_id):
         conn.close()
         return jsonify({'success': False, 'message': 'Error updating report'})
     
+# Tigbauan area bounds, used when a map request does not send a bbox
+TIGBAUAN_BOUNDS = {'west': 122.30, 'south': 10.60, 'east': 122.50, 'north': 10.80}
+MAP_DEFAULT_LIMIT = 500
+MAP_MAX_LIMIT = 2000
+
+def _parse_map_time(value):
+    """Parse an ISO date/datetime query value into a naive Manila datetime"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(MANILA_TZ).replace(tzinfo=None)
+    return parsed
+
+def parse_map_window(args):
+    """Read bbox, since/until and limit/cursor parameters for map endpoints.
+    
+    bbox follows Leaflet's toBBoxString() order: west,south,east,north.
+    Raises ValueError for malformed parameters.
+    """
+    window = dict(TIGBAUAN_BOUNDS)
+    
+    bbox = args.get('bbox')
+    if bbox:
+        parts = [float(part) for part in bbox.split(',')]
+        if len(parts) != 4:
+            raise ValueError('bbox must be west,south,east,north')
+        window.update(zip(('west', 'south', 'east', 'north'), parts))
+    
+    window['since'] = _parse_map_time(args.get('since'))
+    window['until'] = _parse_map_time(args.get('until'))
+    
+    limit = args.get('limit', MAP_DEFAULT_LIMIT, type=int)
+    window['limit'] = max(1, min(limit, MAP_MAX_LIMIT))
+    window['cursor'] = decode_report_cursor(args.get('cursor'))
+    if args.get('cursor') and window['cursor'] is None:
+        raise ValueError('Malformed cursor')
+    return window
+
+def fetch_map_reports(cur, window, emergency_type=None, compact=False):
+    """Fetch one keyset page of map points inside a window.
+    
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    Only the columns the map markers and popups use are selected, and with
+    compact=True only the point columns (no popup text, no users join).
+    """
+    conditions = [
+        "er.latitude BETWEEN %s AND %s",
+        "er.longitude BETWEEN %s AND %s",
+        "er.latitude != 0",
+        "er.longitude != 0"
+    ]
+    params = [window['south'], window['north'], window['west'], window['east']]
+    
+    if window.get('since'):
+        conditions.append("er.created_at >= %s")
+        params.append(window['since'])
+    if window.get('until'):
+        conditions.append("er.created_at < %s")
+        params.append(window['until'])
+    if emergency_type and emergency_type != 'all':
+        conditions.append("er.emergency_type = %s")
+        params.append(emergency_type)
+    if window.get('cursor'):
+        cursor_created_at, cursor_id = window['cursor']
+        conditions.append("(er.created_at < %s OR (er.created_at = %s AND er.id < %s))")
+        params.extend([cursor_created_at, cursor_created_at, cursor_id])
+    
+    # Fetch one extra row to know whether another page exists
+    params.append(window['limit'] + 1)
+    
+    if compact:
+        columns = "er.id, er.user_id, er.emergency_type, er.status, er.latitude, er.longitude, er.created_at"
+        joins = ""
+    else:
+        columns = """
+            er.id,
+            er.user_id,
+            er.emergency_type,
+            er.status,
+            er.latitude,
+            er.longitude,
+            er.location,
+            er.description,
+            er.created_at,
+            er.e_img,
+            CONCAT(COALESCE(u.fname, ''), ' ', COALESCE(u.lname, '')) as user_name"""
+        joins = "LEFT JOIN users u ON er.user_id = u.id"
+    
+    cur.execute(f"""
+        SELECT {columns}
+        FROM emergency_reports er
+        {joins}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY er.created_at DESC, er.id DESC
+        LIMIT %s
+    """, params)
+    rows = cur.fetchall()
+    
+    next_cursor = None
+    if len(rows) > window['limit']:
+        rows = rows[:window['limit']]
+        last = rows[-1]
+        next_cursor = encode_report_cursor(last)
+    
+    return rows, next_cursor
+
+def cacheable_json(payload, max_age=30):
+    """Build a JSON response that browsers may cache and revalidate by ETag"""
+    response = jsonify(payload)
+    response.cache_control.private = True
+    response.cache_control.max_age = max_age
+    response.add_etag()
+    return response.make_conditional(request)
+
 @admin_bp.route('/get_heatmap_data')
 @admin_login_required
 def get_heatmap_data():
-    """Get heatmap data for all emergency reports with coordinates"""
+    """Get heatmap data for emergency reports inside a map window"""
+    try:
+        window = parse_map_window(request.args)
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid map parameters'}), 400
+    
+    # Optional compact encodings (popup details are then loaded by id)
+    if request.args.get('format') in ('columns', 'binary'):
+        from maps import columnar_map_response
+        return columnar_map_response(window, request.args['format'])
+    
     conn = get_db_connection()
     if not conn:
         return jsonify({'success': False, 'message': 'Database connection error'})
@@ -1729,30 +2161,7 @@ def get_heatmap_data():
     try:
         cur = conn.cursor(dictionary=True)
         
-        # Get all emergency reports with coordinates
-        cur.execute("""
-            SELECT 
-                er.id,
-                er.emergency_type,
-                er.status,
-                er.latitude,
-                er.longitude,
-                er.location,
-                er.description,
-                er.created_at,
-                er.e_img,
-                CONCAT(COALESCE(u.fname, ''), ' ', COALESCE(u.lname, '')) as user_name,
-                u.phone_num
-            FROM emergency_reports er
-            LEFT JOIN users u ON er.user_id = u.id
-            WHERE er.latitude IS NOT NULL 
-            AND er.longitude IS NOT NULL
-            AND er.latitude != 0 
-            AND er.longitude != 0
-            ORDER BY er.created_at DESC
-        """)
-        
-        reports = cur.fetchall()
+        reports, next_cursor = fetch_map_reports(cur, window)
         
         report_data = []
         for report in reports:
@@ -1775,17 +2184,17 @@ def get_heatmap_data():
                     'description': report['description'],
                     'created_at': report['created_at'].isoformat() if report['created_at'] else None,
                     'user_name': report['user_name'].strip() or 'Anonymous',
-                    'phone_num': report['phone_num'],
                     'image': report['e_img']
                 })
         
         cur.close()
         conn.close()
         
-        return jsonify({
+        return cacheable_json({
             'success': True,
             'reports': report_data,
-            'total': len(report_data)
+            'total': len(report_data),
+            'next_cursor': next_cursor
         })
         
     except Exception as e:
@@ -1797,131 +2206,131 @@ def get_heatmap_data():
             'message': 'Error loading heatmap data'
         })
 
+# Heatmap stats are shared by every admin viewing the map, so they are
+# computed at most once per HEATMAP_STATS_TTL seconds and dropped on report events
+HEATMAP_STATS_TTL = 5
+_heatmap_stats_cache = {'payload': None, 'expires': 0.0, 'version': 0}
+_heatmap_stats_lock = threading.Lock()
+
+@report_events.subscribe
+def invalidate_heatmap_stats(event):
+    _heatmap_stats_cache['version'] += 1
+    _heatmap_stats_cache['payload'] = None
+
+def compute_heatmap_stats(cur):
+    """Counters, type histogram and recent reports for the heatmap dashboard"""
+    # One pass over the mapped reports gives every counter per type
+    cur.execute("""
+        SELECT 
+            emergency_type,
+            COUNT(*) as count,
+            SUM(status IN ('pending', 'in_progress')) as active,
+            SUM(status = 'resolved') as resolved,
+            SUM(created_at >= CURDATE() AND created_at < CURDATE() + INTERVAL 1 DAY) as today
+        FROM emergency_reports 
+        WHERE latitude IS NOT NULL 
+        AND longitude IS NOT NULL
+        AND latitude != 0 
+        AND longitude != 0
+        GROUP BY emergency_type
+        ORDER BY count DESC
+    """)
+    rows = cur.fetchall()
+    
+    stats = {
+        'total': sum(int(row['count']) for row in rows),
+        'active': sum(int(row['active'] or 0) for row in rows),
+        'resolved': sum(int(row['resolved'] or 0) for row in rows),
+        'today': sum(int(row['today'] or 0) for row in rows)
+    }
+    type_distribution = [
+        {'emergency_type': row['emergency_type'], 'count': int(row['count'])}
+        for row in rows
+    ]
+    
+    # Recent emergencies (last 24 hours)
+    cur.execute("""
+        SELECT 
+            er.id,
+            er.emergency_type,
+            er.status,
+            er.location,
+            er.description,
+            er.created_at,
+            CONCAT(COALESCE(u.fname, ''), ' ', COALESCE(u.lname, '')) as user_name
+        FROM emergency_reports er
+        LEFT JOIN users u ON er.user_id = u.id
+        WHERE er.latitude IS NOT NULL 
+        AND er.longitude IS NOT NULL
+        AND er.latitude != 0 
+        AND er.longitude != 0
+        AND er.created_at >= DATE_SUB(NOW(), INTERVAL 24 HOUR)
+        ORDER BY er.created_at DESC
+        LIMIT 10
+    """)
+    recent_emergencies = cur.fetchall()
+    
+    return {
+        'success': True,
+        'stats': stats,
+        'type_distribution': type_distribution,
+        'recent_emergencies': recent_emergencies
+    }
+
 @admin_bp.route('/get_heatmap_stats')
 @admin_login_required
 def get_heatmap_stats():
     """Get statistics for heatmap dashboard"""
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'success': False, 'message': 'Database connection error'})
+    payload = _heatmap_stats_cache['payload']
+    if payload is not None and time.monotonic() < _heatmap_stats_cache['expires']:
+        return jsonify(payload)
     
-    try:
-        cur = conn.cursor(dictionary=True)
-        
-        # Total emergencies with coordinates
-        cur.execute("""
-            SELECT COUNT(*) as total 
-            FROM emergency_reports 
-            WHERE latitude IS NOT NULL 
-            AND longitude IS NOT NULL
-            AND latitude != 0 
-            AND longitude != 0
-        """)
-        total_result = cur.fetchone()
-        total = total_result['total'] if total_result else 0
+    # Only one request recomputes; the others wait for its result
+    with _heatmap_stats_lock:
+        payload = _heatmap_stats_cache['payload']
+        if payload is not None and time.monotonic() < _heatmap_stats_cache['expires']:
+            return jsonify(payload)
         
-        # Active emergencies (pending + in_progress)
-        cur.execute("""
-            SELECT COUNT(*) as active 
-            FROM emergency_reports 
-            WHERE latitude IS NOT NULL 
-            AND longitude IS NOT NULL
-            AND latitude != 0 
-            AND longitude != 0
-            AND status IN ('pending', 'in_progress')
-        """)
-        active_result = cur.fetchone()
-        active = active_result['active'] if active_result else 0
-        
-        # Resolved emergencies
-        cur.execute("""
-            SELECT COUNT(*) as resolved 
-            FROM emergency_reports 
-            WHERE latitude IS NOT NULL 
-            AND longitude IS NOT NULL
-            AND latitude != 0 
-            AND longitude != 0
-            AND status = 'resolved'
-        """)
-        resolved_result = cur.fetchone()
-        resolved = resolved_result['resolved'] if resolved_result else 0
-        
-        # Today's emergencies
-        cur.execute("""
-            SELECT COUNT(*) as today 
-            FROM emergency_reports 
-            WHERE latitude IS NOT NULL 
-            AND longitude IS NOT NULL
-            AND latitude != 0 
-            AND longitude != 0
-            AND DATE(created_at) = CURDATE()
-        """)
-        today_result = cur.fetchone()
-        today = today_result['today'] if today_result else 0
-        
-        # Emergency type distribution
-        cur.execute("""
-            SELECT emergency_type, COUNT(*) as count
-            FROM emergency_reports 
-            WHERE latitude IS NOT NULL 
-            AND longitude IS NOT NULL
-            AND latitude != 0 
-            AND longitude != 0
-            GROUP BY emergency_type
-            ORDER BY count DESC
-        """)
-        type_distribution = cur.fetchall()
-        
-        # Recent emergencies (last 24 hours)
-        cur.execute("""
-            SELECT 
-                er.id,
-                er.emergency_type,
-                er.status,
-                er.location,
-                er.description,
-                er.created_at,
-                CONCAT(COALESCE(u.fname, ''), ' ', COALESCE(u.lname, '')) as user_name
-            FROM emergency_reports er
-            LEFT JOIN users u ON er.user_id = u.id
-            WHERE er.latitude IS NOT NULL 
-            AND er.longitude IS NOT NULL
-            AND er.latitude != 0 
-            AND er.longitude != 0
-            AND er.created_at >= DATE_SUB(NOW(), INTERVAL 24 HOUR)
-            ORDER BY er.created_at DESC
-            LIMIT 10
-        """)
-        recent_emergencies = cur.fetchall()
-        
-        cur.close()
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'stats': {
-                'total': total,
-                'active': active,
-                'resolved': resolved,
-                'today': today
-            },
-            'type_distribution': type_distribution,
-            'recent_emergencies': recent_emergencies
-        })
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'message': 'Database connection error'})
         
-    except Exception as e:
-        print(f"Error getting heatmap stats: {e}")
-        if conn:
+        try:
+            version = _heatmap_stats_cache['version']
+            cur = conn.cursor(dictionary=True)
+            payload = compute_heatmap_stats(cur)
+            cur.close()
             conn.close()
-        return jsonify({
-            'success': False,
-            'message': 'Error loading heatmap statistics'
-        })
+            
+            # A report event during the computation makes this result stale already
+            if version == _heatmap_stats_cache['version']:
+                _heatmap_stats_cache['payload'] = payload
+                _heatmap_stats_cache['expires'] = time.monotonic() + HEATMAP_STATS_TTL
+            
+            return jsonify(payload)
+            
+        except Exception as e:
+            print(f"Error getting heatmap stats: {e}")
+            if conn:
+                conn.close()
+            return jsonify({
+                'success': False,
+                'message': 'Error loading heatmap statistics'
+            })
 
 @admin_bp.route('/get_emergencies_by_type/<emergency_type>')
 @admin_login_required
 def get_emergencies_by_type(emergency_type):
-    """Get emergencies filtered by type"""
+    """Get emergencies filtered by type inside a map window"""
+    try:
+        window = parse_map_window(request.args)
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid map parameters'}), 400
+    
+    if request.args.get('format') in ('columns', 'binary'):
+        from maps import columnar_map_response
+        return columnar_map_response(window, request.args['format'], emergency_type=emergency_type)
+    
     conn = get_db_connection()
     if not conn:
         return jsonify({'success': False, 'message': 'Database connection error'})
@@ -1929,49 +2338,7 @@ def get_emergencies_by_type(emergency_type):
     try:
         cur = conn.cursor(dictionary=True)
         
-        if emergency_type == 'all':
-            cur.execute("""
-                SELECT 
-                    er.id,
-                    er.emergency_type,
-                    er.status,
-                    er.latitude,
-                    er.longitude,
-                    er.location,
-                    er.description,
-                    er.created_at,
-                    CONCAT(COALESCE(u.fname, ''), ' ', COALESCE(u.lname, '')) as user_name
-                FROM emergency_reports er
-                LEFT JOIN users u ON er.user_id = u.id
-                WHERE er.latitude IS NOT NULL 
-                AND er.longitude IS NOT NULL
-                AND er.latitude != 0 
-                AND er.longitude != 0
-                ORDER BY er.created_at DESC
-            """)
-        else:
-            cur.execute("""
-                SELECT 
-                    er.id,
-                    er.emergency_type,
-                    er.status,
-                    er.latitude,
-                    er.longitude,
-                    er.location,
-                    er.description,
-                    er.created_at,
-                    CONCAT(COALESCE(u.fname, ''), ' ', COALESCE(u.lname, '')) as user_name
-                FROM emergency_reports er
-                LEFT JOIN users u ON er.user_id = u.id
-                WHERE er.emergency_type = %s
-                AND er.latitude IS NOT NULL 
-                AND er.longitude IS NOT NULL
-                AND er.latitude != 0 
-                AND er.longitude != 0
-                ORDER BY er.created_at DESC
-            """, (emergency_type,))
-        
-        reports = cur.fetchall()
+        reports, next_cursor = fetch_map_reports(cur, window, emergency_type)
         
         report_data = []
         for report in reports:
@@ -1998,11 +2365,12 @@ def get_emergencies_by_type(emergency_type):
         cur.close()
         conn.close()
         
-        return jsonify({
+        return cacheable_json({
             'success': True,
             'reports': report_data,
             'count': len(report_data),
-            'type': emergency_type
+            'type': emergency_type,
+            'next_cursor': next_cursor
         })
         
     except Exception as e:
@@ -2102,7 +2470,10 @@ def update_emergency_status():
         cur = conn.cursor(dictionary=True)
         
         # Get current status and user_id for notification
-        cur.execute("SELECT status, user_id FROM emergency_reports WHERE id = %s", (report_id,))
+        cur.execute("""
+            SELECT id, status, user_id, emergency_type, latitude, longitude 
+            FROM emergency_reports WHERE id = %s
+        """, (report_id,))
         report = cur.fetchone()
         
         if not report:
@@ -2143,11 +2514,19 @@ def update_emergency_status():
                 (user_id, report_id, title, body, notification_type, created_at, is_sent)
                 VALUES (%s, %s, %s, %s, %s, %s, %s)
             """, (user_id, report_id, "1TERA - Status Update", message, new_status, datetime.now(MANILA_TZ), False))
+            
+            status_digest.buffer_status_message(cur, user_id, report_id, "Report Status Updated", message)
+        
+        event = report_events.report_event(
+            'status_changed', dict(report, status=new_status), old_status=current_status)
+        report_events.record(cur, event)
         
         conn.commit()
         cur.close()
         conn.close()
         
+        report_events.publish(event)
+        
         return jsonify({
             'success': True, 
             'message': 'Status updated successfully'
@@ -2250,82 +2629,253 @@ def get_barangay_coordinates(barangay_name):
 @admin_bp.route('/export_heatmap_data')
 @admin_login_required
 def export_heatmap_data():
-    """Export heatmap data as CSV"""
+    """Export heatmap data, streamed as it is read.
+    
+    ?format= csv (default), ndjson, parquet or arrow; CSV and NDJSON are
+    gzipped with ?compress=gzip.
+    """
+    fmt = request.args.get('format', 'csv')
+    if not report_exports.format_available(fmt):
+        return jsonify({'success': False, 'message': 'Export format not available'}), 400
+    
     conn = get_db_connection()
     if not conn:
         return jsonify({'success': False, 'message': 'Database connection error'})
     
     try:
-        cur = conn.cursor(dictionary=True)
+        # Unbuffered: rows stay on the server until the export reaches them
+        cur = conn.cursor(dictionary=True, buffered=False)
+        cur.execute(report_exports.HEATMAP_EXPORT_SQL)
         
-        cur.execute("""
-            SELECT 
-                er.id,
-                er.emergency_type,
-                er.status,
-                er.latitude,
-                er.longitude,
-                er.location,
-                er.description,
-                er.created_at,
-                CONCAT(COALESCE(u.fname, ''), ' ', COALESCE(u.lname, '')) as user_name,
-                u.phone_num
-            FROM emergency_reports er
-            LEFT JOIN users u ON er.user_id = u.id
-            WHERE er.latitude IS NOT NULL 
-            AND er.longitude IS NOT NULL
-            AND er.latitude != 0 
-            AND er.longitude != 0
-            ORDER BY er.created_at DESC
+    except Exception as e:
+        print(f"Error exporting heatmap data: {e}")
+        conn.close()
+        return jsonify({'success': False, 'message': 'Error exporting data'})
+    
+    return report_exports.stream_download(
+        report_exports.encode_report_export(fmt, report_exports.cursor_rows(conn, cur)),
+        report_exports.export_filename('emergency_heatmap_data.csv', fmt),
+        mimetype=report_exports.EXPORT_FORMATS[fmt][0],
+        compress=request.args.get('compress') == 'gzip' and fmt not in report_exports.COLUMNAR_FORMATS
+    )
+
+# Barangay of a report, matched from its free-text location (first match wins)
+BARANGAY_CASE_SQL = """
+    CASE 
+        WHEN location LIKE '%Alupidian%' THEN 'Alupidian'
+        WHEN location LIKE '%Atabayan%' THEN 'Atabayan'
+        WHEN location LIKE '%Bagacay%' THEN 'Bagacay'
+        WHEN location LIKE '%Baguingin%' THEN 'Baguingin'
+        WHEN location LIKE '%Bagumbayan%' THEN 'Bagumbayan'
+        WHEN location LIKE '%Bangkal%' THEN 'Bangkal'
+        WHEN location LIKE '%Bantud%' THEN 'Bantud'
+        WHEN location LIKE '%Barangay 1%' OR location LIKE '%Poblacion%' THEN 'Barangay 1 (Poblacion)'
+        WHEN location LIKE '%Barangay 2%' THEN 'Barangay 2 (Poblacion)'
+        WHEN location LIKE '%Barangay 3%' THEN 'Barangay 3 (Poblacion)'
+        WHEN location LIKE '%Barangay 4%' THEN 'Barangay 4 (Poblacion)'
+        WHEN location LIKE '%Barangay 5%' THEN 'Barangay 5 (Poblacion)'
+        WHEN location LIKE '%Barangay 6%' THEN 'Barangay 6 (Poblacion)'
+        WHEN location LIKE '%Barangay 7%' THEN 'Barangay 7 (Poblacion)'
+        WHEN location LIKE '%Barangay 8%' THEN 'Barangay 8 (Poblacion)'
+        WHEN location LIKE '%Barangay 9%' THEN 'Barangay 9 (Poblacion)'
+        WHEN location LIKE '%Barosong%' THEN 'Barosong'
+        WHEN location LIKE '%Barroc%' THEN 'Barroc'
+        WHEN location LIKE '%Bitas%' THEN 'Bitas'
+        WHEN location LIKE '%Bayuco%' THEN 'Bayuco'
+        WHEN location LIKE '%Binaliuan Mayor%' THEN 'Binaliuan Mayor'
+        WHEN location LIKE '%Binaliuan Menor%' THEN 'Binaliuan Menor'
+        WHEN location LIKE '%Buenavista%' THEN 'Buenavista'
+        WHEN location LIKE '%Bugasongan%' THEN 'Bugasongan'
+        WHEN location LIKE '%Buyu-an%' THEN 'Buyu-an'
+        WHEN location LIKE '%Canabuan%' THEN 'Canabuan'
+        WHEN location LIKE '%Cansilayan%' THEN 'Cansilayan'
+        WHEN location LIKE '%Cordova Norte%' THEN 'Cordova Norte'
+        WHEN location LIKE '%Cordova Sur%' THEN 'Cordova Sur'
+        WHEN location LIKE '%Danao%' THEN 'Danao'
+        WHEN location LIKE '%Dapdap%' THEN 'Dapdap'
+        WHEN location LIKE '%Dorong-an%' THEN 'Dorong-an'
+        WHEN location LIKE '%Guisian%' THEN 'Guisian'
+        WHEN location LIKE '%Isawan%' THEN 'Isawan'
+        WHEN location LIKE '%Isian%' THEN 'Isian'
+        WHEN location LIKE '%Jamog%' THEN 'Jamog'
+        WHEN location LIKE '%Lanag%' THEN 'Lanag'
+        WHEN location LIKE '%Linobayan%' THEN 'Linobayan'
+        WHEN location LIKE '%Lubog%' THEN 'Lubog'
+        WHEN location LIKE '%Nagba%' THEN 'Nagba'
+        WHEN location LIKE '%Namocon%' THEN 'Namocon'
+        WHEN location LIKE '%Napnapan Norte%' THEN 'Napnapan Norte'
+        WHEN location LIKE '%Napnapan Sur%' THEN 'Napnapan Sur'
+        WHEN location LIKE '%Olo Barroc%' THEN 'Olo Barroc'
+        WHEN location LIKE '%Parara Norte%' THEN 'Parara Norte'
+        WHEN location LIKE '%Parara Sur%' THEN 'Parara Sur'
+        WHEN location LIKE '%San Rafael%' THEN 'San Rafael'
+        WHEN location LIKE '%Sermon%' THEN 'Sermon'
+        WHEN location LIKE '%Sipitan%' THEN 'Sipitan'
+        WHEN location LIKE '%Supa%' THEN 'Supa'
+        WHEN location LIKE '%Tan Pael%' THEN 'Tan Pael'
+        WHEN location LIKE '%Taro%' THEN 'Taro'
+        ELSE 'Other Areas'
+    END
+"""
+
+REPORT_DAILY_ROLLUP_DDL = """
+    CREATE TABLE IF NOT EXISTS report_daily_rollup (
+        date DATE NOT NULL,
+        barangay VARCHAR(50) NOT NULL,
+        emergency_type VARCHAR(50) NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (date, barangay, emergency_type, status)
+    )
+"""
+
+_daily_rollup_ready = False
+
+def rebuild_daily_rollup():
+    """Recount report_daily_rollup from emergency_reports. Returns the number of rows.
+    
+    The reports are read with shared locks held until the new rows commit:
+    a report created or updated meanwhile waits for the rebuild and then
+    applies its increment to the rebuilt rollup, instead of being counted
+    by neither. Report transactions lock the report before the rollup too,
+    so the two cannot deadlock.
+    """
+    if not ensure_table('report_daily_rollup', REPORT_DAILY_ROLLUP_DDL):
+        return None
+    
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT DATE(created_at) as date, {BARANGAY_CASE_SQL} as barangay, emergency_type, status, COUNT(*)
+            FROM emergency_reports
+            WHERE created_at IS NOT NULL
+            GROUP BY date, barangay, emergency_type, status
+            LOCK IN SHARE MODE
         """)
+        rows = cur.fetchall()
         
-        reports = cur.fetchall()
-        
-        # Generate CSV content
-        import csv
-        import io
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow([
-            'ID', 'Emergency Type', 'Status', 'Latitude', 'Longitude', 
-            'Location', 'Description', 'Created At', 'User Name', 'Phone Number'
-        ])
-        
-        # Write data
-        for report in reports:
-            writer.writerow([
-                report['id'],
-                report['emergency_type'],
-                report['status'],
-                report['latitude'],
-                report['longitude'],
-                report['location'] or '',
-                report['description'] or '',
-                report['created_at'].strftime('%Y-%m-%d %H:%M:%S') if report['created_at'] else '',
-                report['user_name'].strip() if report['user_name'] else 'Anonymous',
-                report['phone_num'] or ''
-            ])
-        
+        cur.execute("DELETE FROM report_daily_rollup")
+        for start in range(0, len(rows), 1000):
+            cur.executemany("""
+                INSERT INTO report_daily_rollup (date, barangay, emergency_type, status, count)
+                VALUES (%s, %s, %s, %s, %s)
+            """, rows[start:start + 1000])
+        conn.commit()
         cur.close()
         conn.close()
-        
-        from flask import Response
-        
-        return Response(
-            output.getvalue(),
-            mimetype="text/csv",
-            headers={"Content-disposition": "attachment; filename=emergency_heatmap_data.csv"}
-        )
-        
+        return len(rows)
     except Exception as e:
-        print(f"Error exporting heatmap data: {e}")
-        if conn:
-            conn.close()
-        return jsonify({'success': False, 'message': 'Error exporting data'})
+        print(f"Rebuild daily rollup error: {e}")
+        conn.close()
+        return None
+
+def ensure_daily_rollup(build=False):
+    """Return True once report_daily_rollup exists and covers every report.
+    
+    An empty rollup while reports exist has never been built; with
+    build=True it is filled now. Report listeners pass build=False since
+    they run inside a report's transaction.
+    """
+    global _daily_rollup_ready
+    if not ensure_table('report_daily_rollup', REPORT_DAILY_ROLLUP_DDL):
+        return False
+    if _daily_rollup_ready:
+        return True
+    
+    conn = get_db_connection()
+    if not conn:
+        return False
     
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM report_daily_rollup LIMIT 1")
+        empty = cur.fetchone() is None
+        cur.execute("SELECT 1 FROM emergency_reports LIMIT 1")
+        has_reports = cur.fetchone() is not None
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Check daily rollup error: {e}")
+        conn.close()
+        return False
+    
+    if empty and has_reports:
+        if not build or rebuild_daily_rollup() is None:
+            return False
+    _daily_rollup_ready = True
+    return True
+
+def add_to_daily_rollup(cur, report_id, status, delta):
+    cur.execute(f"""
+        INSERT INTO report_daily_rollup (date, barangay, emergency_type, status, count)
+        SELECT DATE(created_at), {BARANGAY_CASE_SQL}, emergency_type, %s, %s
+        FROM emergency_reports
+        WHERE id = %s AND created_at IS NOT NULL
+        ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+    """, (status, delta, report_id))
+
+@report_events.subscribe(transactional=True)
+def update_daily_rollup(cur, event):
+    """Keep the rollup in step with report creation and status changes"""
+    if not ensure_daily_rollup():
+        return
+    
+    if event['kind'] == 'created':
+        add_to_daily_rollup(cur, event['report_id'], event['new_status'], 1)
+    elif event['old_status'] != event['new_status']:
+        add_to_daily_rollup(cur, event['report_id'], event['old_status'], -1)
+        add_to_daily_rollup(cur, event['report_id'], event['new_status'], 1)
+
+@admin_bp.cli.command('rebuild-daily-rollup')
+def rebuild_daily_rollup_command():
+    """Recount the chart rollup from emergency_reports"""
+    rows = rebuild_daily_rollup()
+    if rows is None:
+        print("Daily rollup rebuild failed")
+    else:
+        print(f"Daily rollup rebuilt: {rows} rows")
+
+def fetch_chart_rows(cur, date_range):
+    """Per-day counts by type and status for process_chart_data.
+    
+    date_range is one of the whitelisted 'INTERVAL n UNIT' strings. Reads
+    the daily rollup, falling back to the raw reports if it is unavailable.
+    """
+    if ensure_daily_rollup(build=True):
+        cur.execute(f"""
+            SELECT 
+                date,
+                SUM(count) as count,
+                emergency_type,
+                status
+            FROM report_daily_rollup 
+            WHERE date >= DATE(DATE_SUB(NOW(), {date_range}))
+            GROUP BY date, emergency_type, status
+            HAVING SUM(count) > 0
+            ORDER BY date ASC
+        """)
+    else:
+        cur.execute(f"""
+            SELECT 
+                DATE(created_at) as date,
+                COUNT(*) as count,
+                emergency_type,
+                status
+            FROM emergency_reports 
+            WHERE created_at >= DATE_SUB(NOW(), {date_range})
+            GROUP BY DATE(created_at), emergency_type, status
+            ORDER BY date ASC
+        """)
+    
+    rows = cur.fetchall()
+    for row in rows:
+        row['count'] = int(row['count'])
+    return rows
+
 def get_brgy_reports_distribution():
     """Get emergency reports distribution by barangay from actual database data"""
     conn = get_db_connection()
@@ -2335,73 +2885,30 @@ def get_brgy_reports_distribution():
     try:
         cur = conn.cursor(dictionary=True)
         
-        # Get actual barangays from reports in the database
-        cur.execute("""
-            SELECT 
-                CASE 
-                    WHEN location LIKE '%Alupidian%' THEN 'Alupidian'
-                    WHEN location LIKE '%Atabayan%' THEN 'Atabayan'
-                    WHEN location LIKE '%Bagacay%' THEN 'Bagacay'
-                    WHEN location LIKE '%Baguingin%' THEN 'Baguingin'
-                    WHEN location LIKE '%Bagumbayan%' THEN 'Bagumbayan'
-                    WHEN location LIKE '%Bangkal%' THEN 'Bangkal'
-                    WHEN location LIKE '%Bantud%' THEN 'Bantud'
-                    WHEN location LIKE '%Barangay 1%' OR location LIKE '%Poblacion%' THEN 'Barangay 1 (Poblacion)'
-                    WHEN location LIKE '%Barangay 2%' THEN 'Barangay 2 (Poblacion)'
-                    WHEN location LIKE '%Barangay 3%' THEN 'Barangay 3 (Poblacion)'
-                    WHEN location LIKE '%Barangay 4%' THEN 'Barangay 4 (Poblacion)'
-                    WHEN location LIKE '%Barangay 5%' THEN 'Barangay 5 (Poblacion)'
-                    WHEN location LIKE '%Barangay 6%' THEN 'Barangay 6 (Poblacion)'
-                    WHEN location LIKE '%Barangay 7%' THEN 'Barangay 7 (Poblacion)'
-                    WHEN location LIKE '%Barangay 8%' THEN 'Barangay 8 (Poblacion)'
-                    WHEN location LIKE '%Barangay 9%' THEN 'Barangay 9 (Poblacion)'
-                    WHEN location LIKE '%Barosong%' THEN 'Barosong'
-                    WHEN location LIKE '%Barroc%' THEN 'Barroc'
-                    WHEN location LIKE '%Bitas%' THEN 'Bitas'
-                    WHEN location LIKE '%Bayuco%' THEN 'Bayuco'
-                    WHEN location LIKE '%Binaliuan Mayor%' THEN 'Binaliuan Mayor'
-                    WHEN location LIKE '%Binaliuan Menor%' THEN 'Binaliuan Menor'
-                    WHEN location LIKE '%Buenavista%' THEN 'Buenavista'
-                    WHEN location LIKE '%Bugasongan%' THEN 'Bugasongan'
-                    WHEN location LIKE '%Buyu-an%' THEN 'Buyu-an'
-                    WHEN location LIKE '%Canabuan%' THEN 'Canabuan'
-                    WHEN location LIKE '%Cansilayan%' THEN 'Cansilayan'
-                    WHEN location LIKE '%Cordova Norte%' THEN 'Cordova Norte'
-                    WHEN location LIKE '%Cordova Sur%' THEN 'Cordova Sur'
-                    WHEN location LIKE '%Danao%' THEN 'Danao'
-                    WHEN location LIKE '%Dapdap%' THEN 'Dapdap'
-                    WHEN location LIKE '%Dorong-an%' THEN 'Dorong-an'
-                    WHEN location LIKE '%Guisian%' THEN 'Guisian'
-                    WHEN location LIKE '%Isawan%' THEN 'Isawan'
-                    WHEN location LIKE '%Isian%' THEN 'Isian'
-                    WHEN location LIKE '%Jamog%' THEN 'Jamog'
-                    WHEN location LIKE '%Lanag%' THEN 'Lanag'
-                    WHEN location LIKE '%Linobayan%' THEN 'Linobayan'
-                    WHEN location LIKE '%Lubog%' THEN 'Lubog'
-                    WHEN location LIKE '%Nagba%' THEN 'Nagba'
-                    WHEN location LIKE '%Namocon%' THEN 'Namocon'
-                    WHEN location LIKE '%Napnapan Norte%' THEN 'Napnapan Norte'
-                    WHEN location LIKE '%Napnapan Sur%' THEN 'Napnapan Sur'
-                    WHEN location LIKE '%Olo Barroc%' THEN 'Olo Barroc'
-                    WHEN location LIKE '%Parara Norte%' THEN 'Parara Norte'
-                    WHEN location LIKE '%Parara Sur%' THEN 'Parara Sur'
-                    WHEN location LIKE '%San Rafael%' THEN 'San Rafael'
-                    WHEN location LIKE '%Sermon%' THEN 'Sermon'
-                    WHEN location LIKE '%Sipitan%' THEN 'Sipitan'
-                    WHEN location LIKE '%Supa%' THEN 'Supa'
-                    WHEN location LIKE '%Tan Pael%' THEN 'Tan Pael'
-                    WHEN location LIKE '%Taro%' THEN 'Taro'
-                    ELSE 'Other Areas'
-                END as barangay,
-                COUNT(*) as count
-            FROM emergency_reports 
-            WHERE location IS NOT NULL AND location != ''
-            GROUP BY barangay
-            HAVING barangay != 'Other Areas'
-            ORDER BY count DESC
-        """)
+        if ensure_daily_rollup(build=True):
+            cur.execute("""
+                SELECT barangay, SUM(count) as count
+                FROM report_daily_rollup
+                WHERE barangay != 'Other Areas'
+                GROUP BY barangay
+                HAVING SUM(count) > 0
+                ORDER BY count DESC
+            """)
+        else:
+            cur.execute(f"""
+                SELECT 
+                    {BARANGAY_CASE_SQL} as barangay,
+                    COUNT(*) as count
+                FROM emergency_reports 
+                WHERE location IS NOT NULL AND location != ''
+                GROUP BY barangay
+                HAVING barangay != 'Other Areas'
+                ORDER BY count DESC
+            """)
         
         brgy_data = cur.fetchall()
+        for item in brgy_data:
+            item['count'] = int(item['count'])
         
         cur.close()
         conn.close()
@@ -2418,204 +2925,27 @@ def get_monthly_brgy_stats(year=None):
     if not year:
         year = datetime.now(MANILA_TZ).year
     
-    conn = get_db_connection()
-    if not conn:
-        return {}
-    
-    try:
-        cur = conn.cursor(dictionary=True)
-        
-        # Get monthly counts by barangay for the specified year
-        cur.execute("""
-            SELECT 
-                MONTH(created_at) as month,
-                CASE 
-                    WHEN location LIKE '%Alupidian%' THEN 'Alupidian'
-                    WHEN location LIKE '%Atabayan%' THEN 'Atabayan'
-                    WHEN location LIKE '%Bagacay%' THEN 'Bagacay'
-                    WHEN location LIKE '%Baguingin%' THEN 'Baguingin'
-                    WHEN location LIKE '%Bagumbayan%' THEN 'Bagumbayan'
-                    WHEN location LIKE '%Bangkal%' THEN 'Bangkal'
-                    WHEN location LIKE '%Bantud%' THEN 'Bantud'
-                    WHEN location LIKE '%Barangay 1%' OR location LIKE '%Poblacion%' THEN 'Barangay 1 (Poblacion)'
-                    WHEN location LIKE '%Barangay 2%' THEN 'Barangay 2 (Poblacion)'
-                    WHEN location LIKE '%Barangay 3%' THEN 'Barangay 3 (Poblacion)'
-                    WHEN location LIKE '%Barangay 4%' THEN 'Barangay 4 (Poblacion)'
-                    WHEN location LIKE '%Barangay 5%' THEN 'Barangay 5 (Poblacion)'
-                    WHEN location LIKE '%Barangay 6%' THEN 'Barangay 6 (Poblacion)'
-                    WHEN location LIKE '%Barangay 7%' THEN 'Barangay 7 (Poblacion)'
-                    WHEN location LIKE '%Barangay 8%' THEN 'Barangay 8 (Poblacion)'
-                    WHEN location LIKE '%Barangay 9%' THEN 'Barangay 9 (Poblacion)'
-                    WHEN location LIKE '%Barosong%' THEN 'Barosong'
-                    WHEN location LIKE '%Barroc%' THEN 'Barroc'
-                    WHEN location LIKE '%Bitas%' THEN 'Bitas'
-                    WHEN location LIKE '%Bayuco%' THEN 'Bayuco'
-                    WHEN location LIKE '%Binaliuan Mayor%' THEN 'Binaliuan Mayor'
-                    WHEN location LIKE '%Binaliuan Menor%' THEN 'Binaliuan Menor'
-                    WHEN location LIKE '%Buenavista%' THEN 'Buenavista'
-                    WHEN location LIKE '%Bugasongan%' THEN 'Bugasongan'
-                    WHEN location LIKE '%Buyu-an%' THEN 'Buyu-an'
-                    WHEN location LIKE '%Canabuan%' THEN 'Canabuan'
-                    WHEN location LIKE '%Cansilayan%' THEN 'Cansilayan'
-                    WHEN location LIKE '%Cordova Norte%' THEN 'Cordova Norte'
-                    WHEN location LIKE '%Cordova Sur%' THEN 'Cordova Sur'
-                    WHEN location LIKE '%Danao%' THEN 'Danao'
-                    WHEN location LIKE '%Dapdap%' THEN 'Dapdap'
-                    WHEN location LIKE '%Dorong-an%' THEN 'Dorong-an'
-                    WHEN location LIKE '%Guisian%' THEN 'Guisian'
-                    WHEN location LIKE '%Isawan%' THEN 'Isawan'
-                    WHEN location LIKE '%Isian%' THEN 'Isian'
-                    WHEN location LIKE '%Jamog%' THEN 'Jamog'
-                    WHEN location LIKE '%Lanag%' THEN 'Lanag'
-                    WHEN location LIKE '%Linobayan%' THEN 'Linobayan'
-                    WHEN location LIKE '%Lubog%' THEN 'Lubog'
-                    WHEN location LIKE '%Nagba%' THEN 'Nagba'
-                    WHEN location LIKE '%Namocon%' THEN 'Namocon'
-                    WHEN location LIKE '%Napnapan Norte%' THEN 'Napnapan Norte'
-                    WHEN location LIKE '%Napnapan Sur%' THEN 'Napnapan Sur'
-                    WHEN location LIKE '%Olo Barroc%' THEN 'Olo Barroc'
-                    WHEN location LIKE '%Parara Norte%' THEN 'Parara Norte'
-                    WHEN location LIKE '%Parara Sur%' THEN 'Parara Sur'
-                    WHEN location LIKE '%San Rafael%' THEN 'San Rafael'
-                    WHEN location LIKE '%Sermon%' THEN 'Sermon'
-                    WHEN location LIKE '%Sipitan%' THEN 'Sipitan'
-                    WHEN location LIKE '%Supa%' THEN 'Supa'
-                    WHEN location LIKE '%Tan Pael%' THEN 'Tan Pael'
-                    WHEN location LIKE '%Taro%' THEN 'Taro'
-                    ELSE 'Other Areas'
-                END as barangay,
-                COUNT(*) as count
-            FROM emergency_reports 
-            WHERE YEAR(created_at) = %s
-                AND location IS NOT NULL 
-                AND location != ''
-            GROUP BY MONTH(created_at), barangay
-            HAVING barangay != 'Other Areas'
-            ORDER BY month ASC, count DESC
-        """, (year,))
-        
-        monthly_data = cur.fetchall()
-        
-        # Initialize monthly structure
-        months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
-                 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-        
-        # Get unique barangays
-        cur.execute("""
-            SELECT DISTINCT
-                CASE 
-                    WHEN location LIKE '%Alupidian%' THEN 'Alupidian'
-                    WHEN location LIKE '%Atabayan%' THEN 'Atabayan'
-                    WHEN location LIKE '%Bagacay%' THEN 'Bagacay'
-                    WHEN location LIKE '%Baguingin%' THEN 'Baguingin'
-                    WHEN location LIKE '%Bagumbayan%' THEN 'Bagumbayan'
-                    WHEN location LIKE '%Bangkal%' THEN 'Bangkal'
-                    WHEN location LIKE '%Bantud%' THEN 'Bantud'
-                    WHEN location LIKE '%Barangay 1%' OR location LIKE '%Poblacion%' THEN 'Barangay 1 (Poblacion)'
-                    WHEN location LIKE '%Barangay 2%' THEN 'Barangay 2 (Poblacion)'
-                    WHEN location LIKE '%Barangay 3%' THEN 'Barangay 3 (Poblacion)'
-                    WHEN location LIKE '%Barangay 4%' THEN 'Barangay 4 (Poblacion)'
-                    WHEN location LIKE '%Barangay 5%' THEN 'Barangay 5 (Poblacion)'
-                    WHEN location LIKE '%Barangay 6%' THEN 'Barangay 6 (Poblacion)'
-                    WHEN location LIKE '%Barangay 7%' THEN 'Barangay 7 (Poblacion)'
-                    WHEN location LIKE '%Barangay 8%' THEN 'Barangay 8 (Poblacion)'
-                    WHEN location LIKE '%Barangay 9%' THEN 'Barangay 9 (Poblacion)'
-                    WHEN location LIKE '%Barosong%' THEN 'Barosong'
-                    WHEN location LIKE '%Barroc%' THEN 'Barroc'
-                    WHEN location LIKE '%Bitas%' THEN 'Bitas'
-                    WHEN location LIKE '%Bayuco%' THEN 'Bayuco'
-                    WHEN location LIKE '%Binaliuan Mayor%' THEN 'Binaliuan Mayor'
-                    WHEN location LIKE '%Binaliuan Menor%' THEN 'Binaliuan Menor'
-                    WHEN location LIKE '%Buenavista%' THEN 'Buenavista'
-                    WHEN location LIKE '%Bugasongan%' THEN 'Bugasongan'
-                    WHEN location LIKE '%Buyu-an%' THEN 'Buyu-an'
-                    WHEN location LIKE '%Canabuan%' THEN 'Canabuan'
-                    WHEN location LIKE '%Cansilayan%' THEN 'Cansilayan'
-                    WHEN location LIKE '%Cordova Norte%' THEN 'Cordova Norte'
-                    WHEN location LIKE '%Cordova Sur%' THEN 'Cordova Sur'
-                    WHEN location LIKE '%Danao%' THEN 'Danao'
-                    WHEN location LIKE '%Dapdap%' THEN 'Dapdap'
-                    WHEN location LIKE '%Dorong-an%' THEN 'Dorong-an'
-                    WHEN location LIKE '%Guisian%' THEN 'Guisian'
-                    WHEN location LIKE '%Isawan%' THEN 'Isawan'
-                    WHEN location LIKE '%Isian%' THEN 'Isian'
-                    WHEN location LIKE '%Jamog%' THEN 'Jamog'
-                    WHEN location LIKE '%Lanag%' THEN 'Lanag'
-                    WHEN location LIKE '%Linobayan%' THEN 'Linobayan'
-                    WHEN location LIKE '%Lubog%' THEN 'Lubog'
-                    WHEN location LIKE '%Nagba%' THEN 'Nagba'
-                    WHEN location LIKE '%Namocon%' THEN 'Namocon'
-                    WHEN location LIKE '%Napnapan Norte%' THEN 'Napnapan Norte'
-                    WHEN location LIKE '%Napnapan Sur%' THEN 'Napnapan Sur'
-                    WHEN location LIKE '%Olo Barroc%' THEN 'Olo Barroc'
-                    WHEN location LIKE '%Parara Norte%' THEN 'Parara Norte'
-                    WHEN location LIKE '%Parara Sur%' THEN 'Parara Sur'
-                    WHEN location LIKE '%San Rafael%' THEN 'San Rafael'
-                    WHEN location LIKE '%Sermon%' THEN 'Sermon'
-                    WHEN location LIKE '%Sipitan%' THEN 'Sipitan'
-                    WHEN location LIKE '%Supa%' THEN 'Supa'
-                    WHEN location LIKE '%Tan Pael%' THEN 'Tan Pael'
-                    WHEN location LIKE '%Taro%' THEN 'Taro'
-                    ELSE 'Other Areas'
-                END as barangay
-            FROM emergency_reports 
-            WHERE YEAR(created_at) = %s
-                AND location IS NOT NULL 
-                AND location != ''
-            HAVING barangay != 'Other Areas'
-            ORDER BY barangay
-        """, (year,))
-        
-        barangays = [row['barangay'] for row in cur.fetchall()]
-        
-        # Initialize data structure
-        monthly_stats = {brgy: [0] * 12 for brgy in barangays}
-        total_reports = [0] * 12
-        
-        # Fill the data
-        for record in monthly_data:
-            month_idx = record['month'] - 1
-            brgy = record['barangay']
-            count = record['count']
-            
-            if brgy in monthly_stats:
-                monthly_stats[brgy][month_idx] = count
-                total_reports[month_idx] += count
-        
-        cur.close()
-        conn.close()
-        
-        return {
-            'months': months,
-            'barangays': barangays,
-            'monthly_stats': monthly_stats,
-            'total_reports': total_reports,
-            'year': year
-        }
-        
-    except Exception as e:
-        print(f"Get monthly barangay stats error: {e}")
-        conn.close()
+    analytics = report_analytics.get_year_analytics(year)
+    if not analytics:
         return {'months': [], 'barangays': [], 'monthly_stats': {}, 'total_reports': [], 'year': year}
+    
+    return analytics['monthly_barangay']
 
 def get_available_years():
-    """Get available years from emergency reports"""
-    conn = get_db_connection()
-    if not conn:
-        return []
-    
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT YEAR(created_at) as year FROM emergency_reports ORDER BY year DESC")
-        years = [row[0] for row in cur.fetchall()]
-        cur.close()
-        conn.close()
-        return years
-    except Exception as e:
-        print(f"Get available years error: {e}")
-        conn.close()
+    """Get available years from the analytics year index"""
+    years = report_analytics.available_years()
+    if years is None:
         return [datetime.now(MANILA_TZ).year]
-    
+    return years
+
+@admin_bp.cli.command('rebuild-analytics')
+def rebuild_analytics_command():
+    """Forget the stored matrices of closed years so they are computed again"""
+    if report_analytics.clear_materialized_years():
+        print("Stored yearly analytics cleared")
+    else:
+        print("Clearing stored yearly analytics failed")
+
 @admin_bp.route('/get_monthly_brgy_data')
 @admin_login_required
 def get_monthly_brgy_data():
@@ -2641,138 +2971,269 @@ def get_monthly_dispatch_data():
     """API endpoint for monthly dispatch data with year filter"""
     year = request.args.get('year', datetime.now(MANILA_TZ).year, type=int)
     
+    try:
+        analytics = report_analytics.get_year_analytics(year)
+        if not analytics:
+            return jsonify({'success': False, 'message': 'Database connection error'})
+        
+        available_years = get_available_years()
+        
+        return jsonify({
+            'success': True,
+            'monthly_data': analytics['monthly_dispatch'],
+            'available_years': available_years
+        })
+        
+    except Exception as e:
+        print(f"Get monthly dispatch data error: {e}")
+        return jsonify({'success': False, 'message': 'Error fetching monthly dispatch data'})
+
+@admin_bp.route('/get_response_percentiles')
+@admin_login_required
+def get_response_percentiles():
+    """p50/p90/p99 minutes to dispatch or response, grouped by type, barangay or month"""
+    metric = request.args.get('metric', 'dispatch')
+    group = request.args.get('group', 'emergency_type')
+    year = request.args.get('year', datetime.now(MANILA_TZ).year, type=int)
+    
+    if metric not in report_latency.LATENCY_METRICS or group not in report_latency.LATENCY_GROUPS:
+        return jsonify({'success': False, 'message': 'Invalid metric or group'}), 400
+    
+    if not report_latency.ensure_latency_sketches(build=True):
+        return jsonify({'success': False, 'message': 'Response time data unavailable'})
+    
     conn = get_db_connection()
     if not conn:
         return jsonify({'success': False, 'message': 'Database connection error'})
     
     try:
         cur = conn.cursor(dictionary=True)
-        
-        # Get dispatch counts by month for specified year
-        cur.execute("""
-            SELECT 
-                MONTH(dispatched_at) as month,
-                COUNT(*) as dispatch_count,
-                emergency_type
-            FROM emergency_reports 
-            WHERE dispatched_at IS NOT NULL 
-            AND YEAR(dispatched_at) = %s
-            GROUP BY MONTH(dispatched_at), emergency_type
-            ORDER BY month ASC
-        """, (year,))
-        
-        monthly_data = cur.fetchall()
-        
-        # Initialize monthly structure
-        months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
-                 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-        
-        # Group by emergency type
-        emergency_types = ['fire', 'medical', 'natural', 'accident', 'other']
-        monthly_stats = {etype: [0] * 12 for etype in emergency_types}
-        total_dispatches = [0] * 12
-        
-        # Fill the data
-        for record in monthly_data:
-            month_idx = record['month'] - 1
-            etype = record['emergency_type']
-            count = record['dispatch_count']
-            
-            if etype in monthly_stats:
-                monthly_stats[etype][month_idx] = count
-                total_dispatches[month_idx] += count
-        
+        percentiles = report_latency.latency_percentiles(
+            cur, metric, group,
+            f"{year}-01-01", f"{year + 1}-01-01",
+            emergency_type=request.args.get('type') or None,
+            barangay=request.args.get('barangay') or None
+        )
         cur.close()
         conn.close()
         
-        available_years = get_available_years()
-        
         return jsonify({
             'success': True,
-            'monthly_data': {
-                'months': months,
-                'emergency_types': monthly_stats,
-                'total_dispatches': total_dispatches,
-                'year': year
-            },
-            'available_years': available_years
+            'metric': metric,
+            'group': group,
+            'year': year,
+            'percentiles': percentiles
         })
         
     except Exception as e:
-        print(f"Get monthly dispatch data error: {e}")
+        print(f"Get response percentiles error: {e}")
         conn.close()
-        return jsonify({'success': False, 'message': 'Error fetching monthly dispatch data'})
+        return jsonify({'success': False, 'message': 'Error fetching response times'})
+
+@admin_bp.cli.command('rebuild-latency-sketches')
+def rebuild_latency_sketches_command():
+    """Recount the response time sketches from emergency_reports"""
+    samples = report_latency.rebuild_latency_sketches()
+    if samples is None:
+        print("Latency sketch rebuild failed")
+    else:
+        print(f"Latency sketches rebuilt: {samples} samples")
 
 @admin_bp.route('/download_chart_data')
 @admin_login_required
 def download_chart_data():
-    """Download chart data as CSV"""
+    """Download chart data as CSV, or ?format= ndjson, parquet or arrow (CSV/NDJSON gzipped with ?compress=gzip)"""
     chart_type = request.args.get('type', '')
     year = request.args.get('year', datetime.now(MANILA_TZ).year, type=int)
+    fmt = request.args.get('format', 'csv')
     
     if not chart_type:
         return jsonify({'success': False, 'message': 'Chart type required'})
+    if not report_exports.format_available(fmt):
+        return jsonify({'success': False, 'message': 'Export format not available'}), 400
     
     try:
-        import csv
-        import io
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        if chart_type == 'monthly_dispatch':
-            monthly_data = get_monthly_dispatch_stats(year)
-            writer.writerow(['Month', 'Total Dispatches', 'Fire', 'Medical', 'Natural Disaster', 'Accident', 'Other'])
-            
-            for i, month in enumerate(monthly_data['months']):
-                writer.writerow([
-                    month,
-                    monthly_data['total_dispatches'][i],
-                    monthly_data['emergency_types'].get('fire', [0]*12)[i],
-                    monthly_data['emergency_types'].get('medical', [0]*12)[i],
-                    monthly_data['emergency_types'].get('natural', [0]*12)[i],
-                    monthly_data['emergency_types'].get('accident', [0]*12)[i],
-                    monthly_data['emergency_types'].get('other', [0]*12)[i]
-                ])
-                
-            filename = f'emergency_dispatch_report_{year}.csv'
-            
-        elif chart_type == 'monthly_barangay':
-            monthly_brgy_data = get_monthly_brgy_stats(year)
-            # Write header
-            header = ['Month'] + monthly_brgy_data['barangays'] + ['Total']
-            writer.writerow(header)
-            
-            # Write data
-            for i, month in enumerate(monthly_brgy_data['months']):
-                row = [month]
-                for brgy in monthly_brgy_data['barangays']:
-                    row.append(monthly_brgy_data['monthly_stats'].get(brgy, [0]*12)[i])
-                row.append(monthly_brgy_data['total_reports'][i])
-                writer.writerow(row)
-                
-            filename = f'barangay_reports_{year}.csv'
-            
-        elif chart_type == 'barangay_distribution':
-            brgy_data = get_brgy_reports_distribution()
-            writer.writerow(['Barangay', 'Number of Reports'])
-            
-            for item in brgy_data:
-                writer.writerow([item['barangay'], item['count']])
-                
-            filename = 'barangay_distribution.csv'
-            
-        else:
+        export = chart_export(chart_type, year)
+        if export is None:
             return jsonify({'success': False, 'message': 'Invalid chart type'})
         
-        from flask import Response
-        
-        return Response(
-            output.getvalue(),
-            mimetype="text/csv",
-            headers={"Content-disposition": f"attachment; filename={filename}"}
+        header, rows, filename = export
+        return report_exports.stream_download(
+            report_exports.encode_chart_export(fmt, header, rows),
+            report_exports.export_filename(filename, fmt),
+            mimetype=report_exports.EXPORT_FORMATS[fmt][0],
+            compress=request.args.get('compress') == 'gzip' and fmt not in report_exports.COLUMNAR_FORMATS
         )
         
     except Exception as e:
         print(f"Download chart data error: {e}")
-        return jsonify({'success': False, 'message': 'Error downloading data'})
\ No newline at end of file
+        return jsonify({'success': False, 'message': 'Error downloading data'})
+
+@admin_bp.route('/mail_outbox_stats')
+@admin_login_required
+def mail_outbox_stats():
+    """Outbox backlog per status and this process's send metrics"""
+    conn = get_db_connection()
+    if not conn or not mail_outbox.ensure_outbox_table():
+        if conn:
+            conn.close()
+        return jsonify({'success': False, 'message': 'Database connection error'})
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        counts = mail_outbox.outbox_counts(cur)
+        cur.close()
+        conn.close()
+        
+        return jsonify({'success': True, 'outbox': counts, 'metrics': mail_outbox.mail_metrics()})
+        
+    except Exception as e:
+        print(f"Mail outbox stats error: {e}")
+        conn.close()
+        return jsonify({'success': False, 'message': 'Error loading mail stats'})
+
+@admin_bp.route('/export_jobs', methods=['POST'])
+@admin_login_required
+def submit_export_job():
+    """Start a background export (or reuse an identical one) and return its job"""
+    kind = request.form.get('kind', '')
+    fmt = request.form.get('format', 'csv')
+    if kind not in export_jobs.EXPORT_JOB_KINDS:
+        return jsonify({'success': False, 'message': 'Invalid export type'}), 400
+    if not report_exports.format_available(fmt):
+        return jsonify({'success': False, 'message': 'Export format not available'}), 400
+    
+    if kind in ('monthly_barangay', 'monthly_dispatch'):
+        params = {'year': request.form.get('year', datetime.now(MANILA_TZ).year, type=int)}
+    elif kind == 'reports':
+        try:
+            filters = report_filters(request.form)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD'}), 400
+        params = {field: value.isoformat() if hasattr(value, 'isoformat') else value
+                  for field, value in filters.items() if value}
+    else:
+        params = {}
+    params['format'] = fmt
+    
+    job, reused = export_jobs.submit_export(kind, params, requested_by=session.get('admin_id'))
+    if job is None:
+        return jsonify({'success': False, 'message': 'Error starting export'})
+    
+    return jsonify({
+        'success': True,
+        'job': job,
+        'reused': reused,
+        'status_url': url_for('admin.export_job_status', job_id=job['id']),
+        'download_url': url_for('admin.download_export_job', job_id=job['id'])
+    })
+
+@admin_bp.route('/export_jobs/<job_id>')
+@admin_login_required
+def export_job_status(job_id):
+    """Progress of an export job"""
+    job = export_jobs.get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Export not found'}), 404
+    
+    return jsonify({'success': True, 'job': export_jobs.job_info(job)})
+
+@admin_bp.route('/export_jobs/<job_id>/download')
+@admin_login_required
+def download_export_job(job_id):
+    """Download the compressed file of a finished export job"""
+    job = export_jobs.get_job(job_id)
+    path = export_jobs.artifact_path(job_id) if job else None
+    if not job or job['status'] != 'done' or not os.path.exists(path):
+        return jsonify({'success': False, 'message': 'Export not ready'}), 404
+    
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=job['filename'])
+
+@admin_bp.route('/export_changes')
+@admin_login_required
+def export_changes():
+    """Reports changed since a high-water mark, as NDJSON (default) or CSV.
+    
+    ?since=<mark> from the previous sync (omit for a full snapshot). The new
+    mark is sent in X-Feed-Next-Since before the rows; X-Feed-Has-More
+    says whether to call again with it right away. Store the mark only once
+    the rows are applied.
+    """
+    since = request.args.get('since', type=int)
+    fmt = request.args.get('format', 'ndjson')
+    limit = min(max(request.args.get('limit', change_feed.CHANGE_FEED_LIMIT, type=int), 1), change_feed.CHANGE_FEED_LIMIT)
+    if fmt not in change_feed.CHANGE_FEED_FORMATS:
+        return jsonify({'success': False, 'message': 'Format must be ndjson or csv'}), 400
+    
+    feed = change_feed.open_feed(since, limit)
+    if feed is None:
+        return jsonify({'success': False, 'message': 'Error reading changes'})
+    
+    reports, until, has_more = feed
+    response = report_exports.stream_download(
+        change_feed.encode_feed(fmt, reports),
+        f"report_changes_{since or 0}_{until}.{report_exports.EXPORT_FORMATS[fmt][1]}",
+        mimetype=report_exports.EXPORT_FORMATS[fmt][0],
+        compress=request.args.get('compress') == 'gzip'
+    )
+    response.headers['X-Feed-Since'] = str(since or 0)
+    response.headers['X-Feed-Next-Since'] = str(until)
+    response.headers['X-Feed-Has-More'] = 'true' if has_more else 'false'
+    return response
+
+@admin_bp.cli.command('export-changes')
+@click.option('--since', type=int, default=None, help='High-water mark of the previous sync (omit for a snapshot)')
+@click.option('--format', 'fmt', type=click.Choice(change_feed.CHANGE_FEED_FORMATS), default='ndjson')
+@click.option('--output', type=click.File('wb'), default='-', help='File to write (default stdout)')
+def export_changes_command(since, fmt, output):
+    """Write the reports changed since a mark; the next mark is printed to stderr"""
+    while True:
+        feed = change_feed.open_feed(since)
+        if feed is None:
+            print("Change feed export failed", file=sys.stderr)
+            sys.exit(1)
+        
+        reports, until, has_more = feed
+        for chunk in change_feed.encode_feed(fmt, reports):
+            output.write(chunk)
+        since = until
+        # CSV repeats its header per batch, so a CSV export stops after one
+        if not has_more or fmt == 'csv':
+            break
+    
+    output.flush()
+    print(f"Next since: {since}" + (" (more changes left)" if has_more else ""), file=sys.stderr)
+
+def chart_export(chart_type, year):
+    """(header, rows, filename) of a chart's CSV export, or None for an unknown chart"""
+    if chart_type == 'monthly_dispatch':
+        monthly_data = get_monthly_dispatch_stats(year)
+        header = ['Month', 'Total Dispatches', 'Fire', 'Medical', 'Natural Disaster', 'Accident', 'Other']
+        rows = [[
+            month,
+            monthly_data['total_dispatches'][i],
+            monthly_data['emergency_types'].get('fire', [0]*12)[i],
+            monthly_data['emergency_types'].get('medical', [0]*12)[i],
+            monthly_data['emergency_types'].get('natural', [0]*12)[i],
+            monthly_data['emergency_types'].get('accident', [0]*12)[i],
+            monthly_data['emergency_types'].get('other', [0]*12)[i]
+        ] for i, month in enumerate(monthly_data['months'])]
+        return header, rows, f'emergency_dispatch_report_{year}.csv'
+    
+    if chart_type == 'monthly_barangay':
+        monthly_brgy_data = get_monthly_brgy_stats(year)
+        header = ['Month'] + monthly_brgy_data['barangays'] + ['Total']
+        rows = [
+            [month]
+            + [monthly_brgy_data['monthly_stats'].get(brgy, [0]*12)[i] for brgy in monthly_brgy_data['barangays']]
+            + [monthly_brgy_data['total_reports'][i]]
+            for i, month in enumerate(monthly_brgy_data['months'])
+        ]
+        return header, rows, f'barangay_reports_{year}.csv'
+    
+    if chart_type == 'barangay_distribution':
+        brgy_data = get_brgy_reports_distribution()
+        rows = [[item['barangay'], item['count']] for item in brgy_data]
+        return ['Barangay', 'Number of Reports'], rows, 'barangay_distribution.csv'
+    
+    return None
\ No newline at end of file
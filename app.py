@@ -1,6 +1,5 @@
 from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
 import mysql.connector
-from flask_mail import Mail, Message
 import bcrypt
 import os
 from datetime import datetime, timedelta
@@ -8,7 +7,13 @@ import json
 import random
 import secrets
 from werkzeug.utils import secure_filename
-from admin import admin_bp
+from admin import admin_bp, parse_map_window, fetch_map_reports, cacheable_json, ensure_index, encode_report_cursor, decode_report_cursor
+from maps import maps_bp, columnar_map_response
+import report_events
+import user_report_stats
+import mail_outbox
+import status_digest
+import feedback_stats
 import pytz
 import hashlib
 
@@ -21,8 +26,9 @@ MANILA_TZ = pytz.timezone('Asia/Manila')
 
 app = Flask(__name__)
 
-# Register admin blueprint
+# Register admin and map blueprints
 app.register_blueprint(admin_bp)
+app.register_blueprint(maps_bp)
 # Basic configuration
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'fallback_secret_key')
 
@@ -38,16 +44,22 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 # Mail Configuration
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
 app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', 'default@example.com')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', '')
 app.config['ADMIN_EMAIL'] = os.environ.get('MAIL_USERNAME', 'default@example.com')
 app.config['MAIL_SUPPRESS_SEND'] = False  
 
-# Initialize mail
-mail = Mail(app)
+# Mail is sent from the outbox by background workers
+mail_outbox.configure(app.config)
+
+@app.before_request
+def start_mail_workers():
+    # Started on the first request so that a backlog left by a restart is sent
+    mail_outbox.start_workers()
+    status_digest.start_flusher()
 
 # Deployment configuration
 HOST = os.environ.get('HOST', '0.0.0.0')
@@ -89,13 +101,7 @@ def generate_otp():
 
 def send_otp_email(email, otp):
     """Send OTP to user's email"""
-    try:
-        msg = Message(
-            subject='1TERA - OTP Verification',
-            sender=app.config['MAIL_USERNAME'],
-            recipients=[email]
-        )
-        msg.body = f'''
+    body = f'''
         Your OTP for 1TERA verification is: {otp}
         
         This OTP will expire in 10 minutes.
@@ -105,11 +111,8 @@ def send_otp_email(email, otp):
         Stay safe,
         1TERA Team
         '''
-        mail.send(msg)
-        return True
-    except Exception as e:
-        print(f"Error sending OTP email: {e}")
-        return False
+    return mail_outbox.enqueue_mail('1TERA - OTP Verification', [email], body,
+                                    sender=app.config['MAIL_USERNAME'], category='otp')
 
 def get_device_fingerprint():
     """Generate a persistent device fingerprint based on user agent and IP"""
@@ -156,37 +159,18 @@ def index():
     if session.get('otp_verified') != True:
         return redirect(url_for('verify_otp'))
     
-    conn = get_db_connection()
-    if not conn:
-        flash('Database connection error', 'error')
-        return render_template('index.html', recent_reports=[], alerts=[])
-    
     try:
-        cur = conn.cursor(dictionary=True)
-        
-        # Get user's recent reports
-        cur.execute("""
-            SELECT er.*, u.fname, u.lname 
-            FROM emergency_reports er 
-            LEFT JOIN users u ON er.user_id = u.id 
-            WHERE er.user_id = %s
-            ORDER BY er.created_at DESC 
-            LIMIT 5
-        """, (session['user_id'],))
-        recent_reports = cur.fetchall()
-        
-        cur.close()
-        conn.close()
+        # The user's report counts (one lookup, usually cached)
+        report_stats = user_report_stats.get_user_report_stats(session['user_id'])
         
         # Get recent alerts (only from last 24 hours)
         alerts = get_recent_alerts()
         
-        return render_template('index.html', recent_reports=recent_reports, alerts=alerts)
+        return render_template('index.html', report_stats=report_stats, alerts=alerts)
         
     except Exception as e:
         print(f"Error fetching data for index: {e}")
-        conn.close()
-        return render_template('index.html', recent_reports=[], alerts=[])
+        return render_template('index.html', report_stats=None, alerts=[])
 
 def get_recent_alerts(limit=5):
     """Get recent alerts from admin_alerts table that are within 24 hours"""
@@ -597,10 +581,22 @@ def emergency_report():
                 VALUES (%s, %s, %s, %s, %s, %s, 'pending', %s)
             """, (session['user_id'], emergency_type, description, location, latitude, longitude, image_filename))
             
+            event = report_events.report_event('created', {
+                'id': cur.lastrowid,
+                'user_id': session['user_id'],
+                'emergency_type': emergency_type,
+                'latitude': latitude,
+                'longitude': longitude,
+                'status': 'pending'
+            })
+            report_events.record(cur, event)
+            
             conn.commit()
             cur.close()
             conn.close()
             
+            report_events.publish(event)
+            
             flash('Emergency report submitted successfully! Help is on the way.', 'success')
             return redirect(url_for('index'))
         
@@ -619,32 +615,33 @@ def heatmaps():
     if session.get('otp_verified') != True:
         return redirect(url_for('verify_otp'))
     
+    # Map points are loaded by heatmaps.js from heatmaps_data for the visible area
+    return render_template('heatmaps.html')
+
+@app.route('/heatmaps/data')
+def heatmaps_data():
+    """Map points for the citizen heatmap, scoped by bbox, since/until and cursor"""
+    if 'user_id' not in session or session.get('otp_verified') != True:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    
+    try:
+        window = parse_map_window(request.args)
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid map parameters'}), 400
+    
+    # Optional compact encodings (popup details are then loaded by id)
+    if request.args.get('format') in ('columns', 'binary'):
+        return columnar_map_response(window, request.args['format'],
+                                     emergency_type=request.args.get('type'),
+                                     viewer_id=session['user_id'])
+    
     conn = get_db_connection()
     if not conn:
-        flash('Database connection error', 'error')
-        return render_template('heatmaps.html', heatmap_data=[])
+        return jsonify({'success': False, 'message': 'Database connection error'})
     
     try:
         cur = conn.cursor(dictionary=True)
-        # Show ALL reports from ALL users within Tigbauan area
-        cur.execute("""
-            SELECT 
-                er.*, 
-                u.fname, 
-                u.lname,
-                CASE 
-                    WHEN er.user_id = %s THEN 'my_report'
-                    ELSE 'other_report'
-                END as report_ownership
-            FROM emergency_reports er 
-            LEFT JOIN users u ON er.user_id = u.id 
-            WHERE latitude IS NOT NULL 
-            AND longitude IS NOT NULL
-            AND latitude BETWEEN 10.60 AND 10.80  -- Tigbauan area latitude range
-            AND longitude BETWEEN 122.30 AND 122.50  -- Tigbauan area longitude range
-            ORDER BY er.created_at DESC
-        """, (session['user_id'],))
-        reports = cur.fetchall()
+        reports, next_cursor = fetch_map_reports(cur, window, request.args.get('type'))
         cur.close()
         conn.close()
         
@@ -652,24 +649,28 @@ def heatmaps():
         for report in reports:
             heatmap_data.append({
                 'id': report['id'],
-                'type': report.get('emergency_type', 'unknown'),
-                'lat': float(report.get('latitude', 0)),
-                'lng': float(report.get('longitude', 0)),
-                'description': report.get('description', ''),
-                'status': report.get('status', 'pending'),
-                'location': report.get('location', 'Unknown location'),
-                'user_name': f"{report.get('fname', '')} {report.get('lname', '')}".strip(),
-                'image': report.get('e_img', None),
-                'ownership': report.get('report_ownership', 'other_report'),
-                'time': report.get('created_at', datetime.now(MANILA_TZ)).strftime('%Y-%m-%d %H:%M') if isinstance(report.get('created_at'), datetime) else 'Unknown'
+                'type': report.get('emergency_type') or 'unknown',
+                'lat': float(report['latitude']),
+                'lng': float(report['longitude']),
+                'description': report.get('description') or '',
+                'status': report.get('status') or 'pending',
+                'location': report.get('location') or 'Unknown location',
+                'user_name': (report.get('user_name') or '').strip(),
+                'image': report.get('e_img'),
+                'ownership': 'my_report' if report['user_id'] == session['user_id'] else 'other_report',
+                'time': report['created_at'].strftime('%Y-%m-%d %H:%M') if isinstance(report.get('created_at'), datetime) else 'Unknown'
             })
         
-        return render_template('heatmaps.html', heatmap_data=json.dumps(heatmap_data))
+        return cacheable_json({
+            'success': True,
+            'reports': heatmap_data,
+            'next_cursor': next_cursor
+        })
     
     except Exception as e:
-        print(f"Heatmaps error: {e}")
+        print(f"Heatmaps data error: {e}")
         conn.close()
-        return render_template('heatmaps.html', heatmap_data=[])
+        return jsonify({'success': False, 'message': 'Error loading map data'})
     
 @app.route('/hotlines')
 def hotlines():
@@ -726,10 +727,12 @@ def feedback():
                 INSERT INTO feedback (user_id, rating, feedback_type, message)
                 VALUES (%s, %s, %s, %s)
             """, (session['user_id'], rating, feedback_type, message))
+            feedback_stats.add_feedback_to_rollup(cur, cur.lastrowid)
             
             conn.commit()
             cur.close()
             conn.close()
+            feedback_stats.feedback_added()
             
             flash('Thank you for your feedback!', 'success')
             return redirect(url_for('index'))
@@ -767,24 +770,17 @@ def profile():
             conn.close()
             return redirect(url_for('logout'))
         
-        # Get report stats - ONLY FOR CURRENT USER
-        cur.execute("SELECT COUNT(*) as count FROM emergency_reports WHERE user_id = %s", (session['user_id'],))
-        total_reports = cur.fetchone()['count']
-        
-        cur.execute("SELECT COUNT(*) as count FROM emergency_reports WHERE user_id = %s AND status = 'resolved'", (session['user_id'],))
-        resolved_reports = cur.fetchone()['count']
-        
-        cur.execute("SELECT COUNT(*) as count FROM emergency_reports WHERE user_id = %s AND status = 'pending'", (session['user_id'],))
-        pending_reports = cur.fetchone()['count']
-        
         cur.close()
         conn.close()
         
+        # Get report stats - ONLY FOR CURRENT USER
+        report_stats = user_report_stats.get_user_report_stats(session['user_id'])
+        
         return render_template('profile.html', 
                              user=user,
-                             total_reports=total_reports,
-                             resolved_reports=resolved_reports,
-                             pending_reports=pending_reports)
+                             total_reports=report_stats['total'],
+                             resolved_reports=report_stats['resolved'],
+                             pending_reports=report_stats['pending'])
     
     except Exception as e:
         print(f"Profile error: {e}")
@@ -807,26 +803,84 @@ def view_status():
     
     try:
         cur = conn.cursor(dictionary=True)
-        # Only show reports from the current user with all fields including estimated_arrival
-        cur.execute("""
-            SELECT er.*, 
-                   COALESCE(er.estimated_arrival, 'Not available') as estimated_arrival,
-                   COALESCE(er.response_type, 'Not dispatched') as response_type
-            FROM emergency_reports er 
-            WHERE user_id = %s 
-            ORDER BY created_at DESC
-        """, (session['user_id'],))
-        reports = cur.fetchall()
+        # Only show reports from the current user, newest page first
+        reports, next_cursor = fetch_status_history(cur, session['user_id'])
         cur.close()
         conn.close()
         
-        return render_template('view_status.html', reports=reports)
+        return render_template('view_status.html', reports=reports, next_cursor=next_cursor)
     
     except Exception as e:
         print(f"View status error: {e}")
         conn.close()
         flash('Error loading report history.', 'error')
         return redirect(url_for('index'))
+
+@app.route('/view_status/history')
+def view_status_history():
+    """JSON page of the user's older reports for the scrolling history"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+    
+    if session.get('otp_verified') != True:
+        return jsonify({'success': False, 'message': 'Verification required'})
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'Database connection error'})
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        reports, next_cursor = fetch_status_history(
+            cur, session['user_id'],
+            after=decode_report_cursor(request.args.get('after'))
+        )
+        cur.close()
+        conn.close()
+        
+        return jsonify({
+            'success': True,
+            'reports': [dict(report, created_at=report['created_at'].isoformat()) for report in reports],
+            'items_html': ''.join(render_template('status_report_item.html', report=report) for report in reports),
+            'next_cursor': next_cursor
+        })
+    
+    except Exception as e:
+        print(f"View status history error: {e}")
+        conn.close()
+        return jsonify({'success': False, 'message': 'Error loading report history'})
+
+STATUS_HISTORY_PAGE_SIZE = 20
+
+def fetch_status_history(cur, user_id, after=None):
+    """A page of a user's reports (list columns only), newest first.
+    
+    Pages by (created_at, id) like the admin reports list; returns
+    (reports, next_cursor) with next_cursor None on the last page.
+    """
+    ensure_index('emergency_reports', 'idx_reports_user_created', 'user_id, created_at, id')
+    
+    conditions = "user_id = %s AND created_at IS NOT NULL"
+    params = [user_id]
+    if after:
+        conditions += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+        params += [after[0], after[0], after[1]]
+    
+    cur.execute(f"""
+        SELECT id, emergency_type, location, status, created_at,
+               COALESCE(estimated_arrival, 'Not available') as estimated_arrival,
+               COALESCE(response_type, 'Not dispatched') as response_type
+        FROM emergency_reports 
+        WHERE {conditions}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """, params + [STATUS_HISTORY_PAGE_SIZE + 1])
+    reports = cur.fetchall()
+    
+    if len(reports) > STATUS_HISTORY_PAGE_SIZE:
+        reports = reports[:STATUS_HISTORY_PAGE_SIZE]
+        return reports, encode_report_cursor(reports[-1])
+    return reports, None
     
 
 # notitfications
@@ -1372,13 +1426,7 @@ def resend_forgot_password_otp():
 
 def send_password_reset_email(email, otp, user_name=""):
     """Send password reset OTP to user's email"""
-    try:
-        msg = Message(
-            subject='1TERA - Password Reset OTP',
-            sender=app.config['MAIL_USERNAME'],
-            recipients=[email]
-        )
-        msg.body = f'''
+    body = f'''
         Hello {user_name},
         
         Your OTP for password reset is: {otp}
@@ -1390,11 +1438,8 @@ def send_password_reset_email(email, otp, user_name=""):
         Stay safe,
         1TERA Team
         '''
-        mail.send(msg)
-        return True
-    except Exception as e:
-        print(f"Error sending password reset email: {e}")
-        return False
+    return mail_outbox.enqueue_mail('1TERA - Password Reset OTP', [email], body,
+                                    sender=app.config['MAIL_USERNAME'], category='password_reset')
     
 #error handlers 
 @app.errorhandler(404)
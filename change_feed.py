@@ -0,0 +1,141 @@
+"""Incremental report export for downstream systems.
+
+The feed is read from the report_changes log: a sync passes the high-water
+mark (a report_changes sequence number) it got from its previous run and
+receives the current state of every report changed after it, one row per
+report, ordered by its last change. It then stores the new mark it was
+handed. Rows are full report states keyed by id, so applying a range twice
+(a retried or interrupted sync) is harmless.
+
+Sequence numbers are taken when a report transaction writes its change,
+before its listeners run and before it commits, so a lower one can commit
+after a higher one. The mark therefore never passes a missing sequence
+number: it stops below the first gap until that gap is older than
+CHANGE_FEED_GAP_TIMEOUT, after which the number is taken to belong to a
+transaction that rolled back. The timeout must exceed the longest a report
+transaction can stay open; it is set well past innodb_lock_wait_timeout
+(50 s by default), which bounds how long any of its statements waits for a
+lock. Raise it with that setting. A sync without a mark starts with a
+snapshot of every report.
+"""
+from datetime import datetime, timedelta
+
+import report_events
+import report_exports
+
+CHANGE_FEED_GAP_TIMEOUT = timedelta(minutes=5)
+# Changes per call; a sync calls again with the new mark while more are left
+CHANGE_FEED_LIMIT = 50000
+CHANGE_FEED_FORMATS = ('ndjson', 'csv')
+
+def committed_seq(cur, since):
+    """Highest seq up to which every change from since on has committed or timed out"""
+    # Every gap below a change older than the timeout is older still; walks
+    # back from the newest change, so only the recent ones are read
+    cur.execute("""
+        SELECT seq
+        FROM report_changes
+        WHERE changed_at < %s
+        ORDER BY seq DESC
+        LIMIT 1
+    """, (datetime.now() - CHANGE_FEED_GAP_TIMEOUT,))
+    row = cur.fetchone()
+    committed = max(int(row['seq']) if row else 0, since or 0)
+    
+    # Past it, follow the sequence while it has no holes
+    cur.execute("SELECT seq FROM report_changes WHERE seq > %s ORDER BY seq", (committed,))
+    for row in cur.fetchall():
+        if int(row['seq']) != committed + 1:
+            break
+        committed += 1
+    return committed
+
+def feed_range(cur, since, limit=CHANGE_FEED_LIMIT):
+    """(until, has_more): the new high-water mark of a feed read from since"""
+    settled = committed_seq(cur, since)
+    if since is None:
+        return settled, False
+    if settled <= since:
+        return since, False
+    
+    cur.execute("""
+        SELECT seq
+        FROM report_changes
+        WHERE seq > %s AND seq <= %s
+        ORDER BY seq
+        LIMIT 1 OFFSET %s
+    """, (since, settled, limit - 1))
+    row = cur.fetchone()
+    if row and int(row['seq']) < settled:
+        return int(row['seq']), True
+    return settled, False
+
+def feed_query(since, until):
+    """(sql, params) of the reports changed in (since, until], by last change; all reports if since is None"""
+    if since is None:
+        # Snapshot: every report, tagged with the mark it is current as of
+        return report_exports.REPORT_EXPORT_SELECT.replace(
+            "SELECT",
+            "SELECT %s as seq,",
+            1
+        ) + """
+    ORDER BY er.id
+""", [until]
+
+    return report_exports.REPORT_EXPORT_SELECT.replace(
+        "SELECT",
+        "SELECT c.seq,",
+        1
+    ).replace(
+        "FROM emergency_reports er",
+        """FROM (
+        SELECT report_id, MAX(seq) as seq
+        FROM report_changes
+        WHERE seq > %s AND seq <= %s
+        GROUP BY report_id
+    ) c
+    JOIN emergency_reports er ON er.id = c.report_id"""
+    ) + """
+    ORDER BY c.seq
+""", [since, until]
+
+def encode_feed(fmt, reports):
+    """Byte chunks of feed rows: report export columns plus the seq of their last change"""
+    return report_exports.encode_export(
+        fmt,
+        report_exports.HEATMAP_EXPORT_HEADER + ['Seq'],
+        reports,
+        csv_row=lambda report: report_exports.heatmap_export_row(report) + [report['seq']],
+        typed_record=lambda report: dict(report_exports.report_export_record(report), seq=int(report['seq']))
+    )
+
+def open_feed(since, limit=CHANGE_FEED_LIMIT):
+    """Start reading the feed after since (None for a snapshot).
+    
+    Returns (reports, until, has_more), reports being a lazy iterator over
+    an unbuffered cursor, or None if the database or change log is
+    unavailable.
+    """
+    from admin import get_db_connection, ensure_table
+    
+    if not ensure_table('report_changes', report_events.REPORT_CHANGES_DDL):
+        return None
+    
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        until, has_more = feed_range(cur, since, limit)
+        cur.close()
+        
+        cur = conn.cursor(dictionary=True, buffered=False)
+        sql, params = feed_query(since, until)
+        cur.execute(sql, params)
+    except Exception as e:
+        print(f"Change feed error: {e}")
+        conn.close()
+        return None
+    
+    return report_exports.cursor_rows(conn, cur), until, has_more
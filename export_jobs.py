@@ -0,0 +1,342 @@
+"""Background export jobs.
+
+Large exports run outside the request: submitting one records a job in
+export_jobs and hands it to a pool of EXPORT_WORKERS threads, so at most
+that many exports read the database at once whatever the number of
+requests. The worker streams the rows through the encoders of
+report_exports into a file under EXPORT_JOB_FOLDER (gzipped for CSV and
+NDJSON), reporting how many rows it has written; clients poll the job and
+download the file when done.
+
+Every job carries the data version it was built from (the last report_changes
+sequence number; closed years of the monthly exports never change). A
+request for the same export and the same data version reuses the job that
+is already running or finished instead of exporting again. The process
+holding a job touches it every EXPORT_JOB_HEARTBEAT_SECONDS while it waits
+for a worker or runs, so only jobs whose process died go stale.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import report_events
+import report_exports
+
+EXPORT_JOB_FOLDER = os.environ.get('EXPORT_JOB_FOLDER', 'cache/exports')
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 2))
+EXPORT_JOB_KINDS = ('heatmap', 'monthly_barangay', 'monthly_dispatch', 'reports')
+EXPORT_PROGRESS_ROWS = 5000
+# Unfinished jobs not heard from for this long died with their process
+EXPORT_JOB_STALE = timedelta(minutes=10)
+# How often a process touches the unfinished jobs it holds, queued or running
+EXPORT_JOB_HEARTBEAT_SECONDS = 60
+EXPORT_JOB_RETENTION = timedelta(days=7)
+
+EXPORT_JOBS_DDL = """
+    CREATE TABLE IF NOT EXISTS export_jobs (
+        id CHAR(32) PRIMARY KEY,
+        kind VARCHAR(30) NOT NULL,
+        params TEXT NOT NULL,
+        params_key CHAR(64) NOT NULL,
+        data_version BIGINT UNSIGNED NOT NULL,
+        status VARCHAR(10) NOT NULL DEFAULT 'queued',
+        rows_done INT NOT NULL DEFAULT 0,
+        rows_total INT NULL,
+        filename VARCHAR(255) NULL,
+        artifact_size BIGINT NULL,
+        error VARCHAR(255) NULL,
+        requested_by INT NULL,
+        created_at DATETIME NOT NULL,
+        updated_at DATETIME NOT NULL,
+        finished_at DATETIME NULL,
+        INDEX idx_export_jobs_params (params_key, data_version)
+    )
+"""
+
+_executor = None
+_executor_lock = threading.Lock()
+# Ids of this process's unfinished jobs
+_live_jobs = set()
+_live_jobs_lock = threading.Lock()
+
+def ensure_export_jobs_table():
+    from admin import ensure_table
+    
+    return ensure_table('export_jobs', EXPORT_JOBS_DDL)
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='export')
+            threading.Thread(target=heartbeat_loop, name='export-heartbeat', daemon=True).start()
+        return _executor
+
+def heartbeat_loop():
+    """Keep the live jobs of this process fresh, including those still waiting for a worker"""
+    from admin import get_db_connection
+    
+    while True:
+        time.sleep(EXPORT_JOB_HEARTBEAT_SECONDS)
+        with _live_jobs_lock:
+            job_ids = list(_live_jobs)
+        if not job_ids:
+            continue
+        
+        conn = get_db_connection()
+        if not conn:
+            continue
+        try:
+            cur = conn.cursor()
+            cur.execute(f"""
+                UPDATE export_jobs
+                SET updated_at = %s
+                WHERE id IN ({', '.join(['%s'] * len(job_ids))})
+            """, [datetime.now()] + job_ids)
+            conn.commit()
+            cur.close()
+            conn.close()
+        except Exception as e:
+            print(f"Export job heartbeat error: {e}")
+            conn.close()
+
+def artifact_path(job_id):
+    return os.path.join(EXPORT_JOB_FOLDER, job_id)
+
+def params_key(kind, params):
+    return hashlib.sha256(json.dumps([kind, params], sort_keys=True).encode()).hexdigest()
+
+def data_version(cur, kind, params):
+    """Version of the data an export reads: the last report change, or 0 for a closed year"""
+    from admin import ensure_table
+    import report_analytics
+    
+    if kind in ('monthly_barangay', 'monthly_dispatch') and report_analytics.is_closed(params['year']):
+        return 0
+    if not ensure_table('report_changes', report_events.REPORT_CHANGES_DDL):
+        return None
+    cur.execute("SELECT COALESCE(MAX(seq), 0) as version FROM report_changes")
+    return int(cur.fetchone()['version'])
+
+def update_job(job_id, **fields):
+    """Set columns of a job on its own connection (workers hold theirs for reading)"""
+    from admin import get_db_connection
+    
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    try:
+        fields['updated_at'] = datetime.now()
+        cur = conn.cursor()
+        cur.execute(f"""
+            UPDATE export_jobs
+            SET {', '.join(f"{column} = %s" for column in fields)}
+            WHERE id = %s
+        """, list(fields.values()) + [job_id])
+        conn.commit()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Update export job error: {e}")
+        conn.close()
+
+def job_info(job):
+    """JSON-safe view of an export_jobs row"""
+    return {
+        'id': job['id'],
+        'kind': job['kind'],
+        'params': json.loads(job['params']),
+        'status': job['status'],
+        'rows_done': job['rows_done'],
+        'rows_total': job['rows_total'],
+        'progress': (round(min(job['rows_done'] / job['rows_total'], 1) * 100)
+                     if job['rows_total'] else (100 if job['status'] == 'done' else None)),
+        'filename': job['filename'],
+        'artifact_size': job['artifact_size'],
+        'error': job['error'],
+        'created_at': job['created_at'].isoformat() if job['created_at'] else None,
+        'finished_at': job['finished_at'].isoformat() if job['finished_at'] else None
+    }
+
+def reusable_job(cur, key, version):
+    """A finished or live job for the same export and data version, if any"""
+    cur.execute("""
+        SELECT * FROM export_jobs
+        WHERE params_key = %s AND data_version = %s
+            AND (status = 'done' OR (status IN ('queued', 'running') AND updated_at >= %s))
+        ORDER BY created_at DESC
+    """, (key, version, datetime.now() - EXPORT_JOB_STALE))
+    for job in cur.fetchall():
+        if job['status'] != 'done' or os.path.exists(artifact_path(job['id'])):
+            return job
+    return None
+
+def prune_jobs(cur):
+    """Delete jobs (and their files) older than EXPORT_JOB_RETENTION"""
+    cur.execute("SELECT id FROM export_jobs WHERE created_at < %s", (datetime.now() - EXPORT_JOB_RETENTION,))
+    job_ids = [row['id'] for row in cur.fetchall()]
+    for job_id in job_ids:
+        try:
+            os.remove(artifact_path(job_id))
+        except FileNotFoundError:
+            pass
+        cur.execute("DELETE FROM export_jobs WHERE id = %s", (job_id,))
+
+def submit_export(kind, params, requested_by=None):
+    """Queue an export, or return the job already holding it. Returns (job, reused) or (None, False)."""
+    from admin import get_db_connection
+    
+    if not ensure_export_jobs_table():
+        return None, False
+    
+    conn = get_db_connection()
+    if not conn:
+        return None, False
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        key = params_key(kind, params)
+        version = data_version(cur, kind, params)
+        if version is None:
+            conn.close()
+            return None, False
+        
+        job = reusable_job(cur, key, version)
+        if job:
+            cur.close()
+            conn.close()
+            return job_info(job), True
+        
+        prune_jobs(cur)
+        now = datetime.now()
+        job_id = uuid.uuid4().hex
+        cur.execute("""
+            INSERT INTO export_jobs (id, kind, params, params_key, data_version, requested_by, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (job_id, kind, json.dumps(params, sort_keys=True), key, version, requested_by, now, now))
+        conn.commit()
+        cur.execute("SELECT * FROM export_jobs WHERE id = %s", (job_id,))
+        job = cur.fetchone()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Submit export error: {e}")
+        conn.close()
+        return None, False
+    
+    with _live_jobs_lock:
+        _live_jobs.add(job_id)
+    get_executor().submit(run_export, job_id, kind, params)
+    return job_info(job), False
+
+def get_job(job_id):
+    """An export_jobs row, or None"""
+    from admin import get_db_connection
+    
+    if not ensure_export_jobs_table():
+        return None
+    
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("SELECT * FROM export_jobs WHERE id = %s", (job_id,))
+        job = cur.fetchone()
+        cur.close()
+        conn.close()
+        return job
+    except Exception as e:
+        print(f"Get export job error: {e}")
+        conn.close()
+        return None
+
+def export_source(kind, params):
+    """(rows, encode, filename, rows_total) of an export; encode(fmt, rows) gives its bytes.
+    
+    Report rows are read lazily from an unbuffered cursor.
+    """
+    from admin import get_db_connection, chart_export
+    
+    if kind in ('monthly_barangay', 'monthly_dispatch'):
+        header, rows, filename = chart_export(kind, params['year'])
+        if not rows:
+            # Empty matrices stand for analytics that could not be read, never a real year
+            raise RuntimeError('Yearly analytics unavailable')
+        encode = lambda fmt, rows: report_exports.encode_chart_export(fmt, header, rows)
+        return rows, encode, filename, len(rows)
+    
+    if kind == 'heatmap':
+        sql, sql_params = report_exports.HEATMAP_EXPORT_SQL, []
+        filename = 'emergency_heatmap_data.csv'
+    else:
+        sql, sql_params = report_exports.filtered_reports_query(params)
+        filename = 'emergency_reports.csv'
+    
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError('Database connection error')
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        # Same rows as the export, counted first so progress has a denominator
+        cur.execute(f"SELECT COUNT(*) as total FROM ({sql.replace('ORDER BY er.created_at DESC', '')}) export", sql_params)
+        rows_total = int(cur.fetchone()['total'])
+        cur.close()
+        
+        cur = conn.cursor(dictionary=True, buffered=False)
+        cur.execute(sql, sql_params)
+    except Exception:
+        conn.close()
+        raise
+    
+    return report_exports.cursor_rows(conn, cur), report_exports.encode_report_export, filename, rows_total
+
+def run_export(job_id, kind, params):
+    """Worker: write an export's file, reporting progress on the job"""
+    path = artifact_path(job_id)
+    partial = f"{path}.part"
+    update_job(job_id, status='running')
+    
+    try:
+        fmt = params.get('format', 'csv')
+        rows, encode, filename, rows_total = export_source(kind, params)
+        filename = report_exports.export_filename(filename, fmt)
+        
+        written = [0]
+        def counted(rows):
+            for row in rows:
+                yield row
+                written[0] += 1
+                if written[0] % EXPORT_PROGRESS_ROWS == 0:
+                    update_job(job_id, rows_done=written[0])
+        
+        chunks = encode(fmt, counted(rows))
+        if fmt not in report_exports.COLUMNAR_FORMATS:
+            chunks = report_exports.gzip_chunks(chunks)
+            filename = f"{filename}.gz"
+        update_job(job_id, rows_total=rows_total, filename=filename)
+        
+        os.makedirs(EXPORT_JOB_FOLDER, exist_ok=True)
+        with open(partial, 'wb') as artifact:
+            for chunk in chunks:
+                artifact.write(chunk)
+        os.replace(partial, path)
+        
+        update_job(job_id, status='done', rows_done=written[0], artifact_size=os.path.getsize(path),
+                   finished_at=datetime.now())
+    except Exception as e:
+        print(f"Export job {job_id} error: {e}")
+        if os.path.exists(partial):
+            os.remove(partial)
+        update_job(job_id, status='failed', error=str(e)[:255], finished_at=datetime.now())
+    finally:
+        with _live_jobs_lock:
+            _live_jobs.discard(job_id)
@@ -0,0 +1,276 @@
+"""Paged feedback browsing and rating rollups for the admin feedback pages.
+
+Feedback is listed newest first on (created_at, id) cursors, like the
+reports list, optionally narrowed to one feedback type and/or rating, so a
+page is an index range read instead of the whole table joined to users.
+
+feedback_rating_rollup keeps the number of feedbacks per (month, type,
+rating). The feedback route adds each new feedback to it in the same
+transaction, so the rating histogram, positive/negative counts and averages
+per type and month are a SUM over a few rows. The latest feedbacks shown on
+the dashboard are cached in-process for FEEDBACK_LATEST_TTL seconds and
+dropped when feedback is submitted.
+"""
+import threading
+import time
+
+FEEDBACK_PAGE_SIZE = 20
+FEEDBACK_RATINGS = (1, 2, 3, 4, 5)
+FEEDBACK_LATEST_TTL = 30
+
+FEEDBACK_RATING_ROLLUP_DDL = """
+    CREATE TABLE IF NOT EXISTS feedback_rating_rollup (
+        month DATE NOT NULL,
+        feedback_type VARCHAR(50) NOT NULL,
+        rating TINYINT NOT NULL,
+        count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (month, feedback_type, rating)
+    )
+"""
+
+_rollup_ready = False
+_latest = {'version': 0, 'entries': {}}
+_latest_lock = threading.Lock()
+
+def rebuild_feedback_rollup():
+    """Recount the rating rollup from feedback. Returns the number of rows.
+    
+    The feedback is read with shared locks held until commit, so feedback
+    submitted during the rebuild waits and is added to the new rollup.
+    """
+    from admin import get_db_connection, ensure_table
+    
+    if not ensure_table('feedback_rating_rollup', FEEDBACK_RATING_ROLLUP_DDL):
+        return None
+    
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT DATE_FORMAT(created_at, '%Y-%m-01') as month, COALESCE(feedback_type, ''), rating, COUNT(*)
+            FROM feedback
+            WHERE created_at IS NOT NULL
+            GROUP BY month, feedback_type, rating
+            LOCK IN SHARE MODE
+        """)
+        rows = cur.fetchall()
+        
+        cur.execute("DELETE FROM feedback_rating_rollup")
+        for start in range(0, len(rows), 1000):
+            cur.executemany("""
+                INSERT INTO feedback_rating_rollup (month, feedback_type, rating, count)
+                VALUES (%s, %s, %s, %s)
+            """, rows[start:start + 1000])
+        conn.commit()
+        cur.close()
+        conn.close()
+        return len(rows)
+    except Exception as e:
+        print(f"Rebuild feedback rollup error: {e}")
+        conn.close()
+        return None
+
+def ensure_feedback_rollup(build=False):
+    """Return True once feedback_rating_rollup exists and covers every feedback.
+    
+    Same contract as ensure_report_cube: the feedback route passes
+    build=False since it runs inside the feedback's transaction.
+    """
+    global _rollup_ready
+    from admin import get_db_connection, ensure_table
+    
+    if not ensure_table('feedback_rating_rollup', FEEDBACK_RATING_ROLLUP_DDL):
+        return False
+    if _rollup_ready:
+        return True
+    
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM feedback_rating_rollup LIMIT 1")
+        empty = cur.fetchone() is None
+        cur.execute("SELECT 1 FROM feedback LIMIT 1")
+        has_feedback = cur.fetchone() is not None
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Check feedback rollup error: {e}")
+        conn.close()
+        return False
+    
+    if empty and has_feedback:
+        if not build or rebuild_feedback_rollup() is None:
+            return False
+    _rollup_ready = True
+    return True
+
+def add_feedback_to_rollup(cur, feedback_id):
+    """Count a just-inserted feedback in the rollup, inside its transaction"""
+    if not ensure_feedback_rollup():
+        return
+    
+    cur.execute("""
+        INSERT INTO feedback_rating_rollup (month, feedback_type, rating, count)
+        SELECT DATE_FORMAT(created_at, '%Y-%m-01'), COALESCE(feedback_type, ''), rating, 1
+        FROM feedback
+        WHERE id = %s AND created_at IS NOT NULL
+        ON DUPLICATE KEY UPDATE count = count + 1
+    """, (feedback_id,))
+
+def feedback_added():
+    """Drop the cached latest feedbacks once a new feedback is committed"""
+    with _latest_lock:
+        _latest['version'] += 1
+        _latest['entries'].clear()
+
+def fetch_feedback_page(cur, per_page=FEEDBACK_PAGE_SIZE, after=None, feedback_type=None, rating=None):
+    """One page of feedback with its user, newest first, ordered by (created_at, id).
+    
+    after is a (created_at, id) position from decode_report_cursor. Returns
+    (feedbacks, next_cursor); next_cursor is None on the last page.
+    """
+    from admin import ensure_index, encode_report_cursor
+    
+    conditions = ["created_at IS NOT NULL"]
+    params = []
+    if feedback_type:
+        ensure_index('feedback', 'idx_feedback_type_created', 'feedback_type, created_at, id')
+        conditions.append("feedback_type = %s")
+        params.append(feedback_type)
+    if rating:
+        ensure_index('feedback', 'idx_feedback_rating_created', 'rating, created_at, id')
+        conditions.append("rating = %s")
+        params.append(rating)
+    if not feedback_type and not rating:
+        ensure_index('feedback', 'idx_feedback_created', 'created_at, id')
+    if after:
+        conditions.append("(created_at < %s OR (created_at = %s AND id < %s))")
+        params += [after[0], after[0], after[1]]
+    
+    # Page on feedback alone, then join the users of the page
+    cur.execute(f"""
+        SELECT f.*, u.fname, u.lname, u.email
+        FROM (
+            SELECT *
+            FROM feedback
+            WHERE {' AND '.join(conditions)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        ) f
+        JOIN users u ON f.user_id = u.id
+        ORDER BY f.created_at DESC, f.id DESC
+    """, params + [per_page + 1])
+    feedbacks = cur.fetchall()
+    
+    next_cursor = None
+    if len(feedbacks) > per_page:
+        feedbacks = feedbacks[:per_page]
+        next_cursor = encode_report_cursor(feedbacks[-1])
+    return feedbacks, next_cursor
+
+def latest_feedbacks(limit):
+    """The newest feedbacks with their users, cached for FEEDBACK_LATEST_TTL seconds"""
+    from admin import get_db_connection
+    
+    cached = _latest['entries'].get(limit)
+    if cached and time.monotonic() < cached[0]:
+        return cached[1]
+    
+    version = _latest['version']
+    conn = get_db_connection()
+    if not conn:
+        return []
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        feedbacks, _ = fetch_feedback_page(cur, limit)
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Latest feedbacks error: {e}")
+        conn.close()
+        return []
+    
+    with _latest_lock:
+        # Feedback committed while this was read may be missing from it
+        if _latest['version'] == version:
+            _latest['entries'][limit] = (time.monotonic() + FEEDBACK_LATEST_TTL, feedbacks)
+    return feedbacks
+
+def summarize_ratings(histogram):
+    """Totals, sentiment counts and average of a {rating: count} histogram"""
+    total = sum(histogram.values())
+    return {
+        'total': total,
+        'average': round(sum(rating * count for rating, count in histogram.items()) / total, 2) if total else None,
+        'histogram': {rating: histogram.get(rating, 0) for rating in FEEDBACK_RATINGS},
+        'positive': histogram.get(4, 0) + histogram.get(5, 0),
+        'neutral': histogram.get(3, 0),
+        'negative': histogram.get(1, 0) + histogram.get(2, 0)
+    }
+
+def feedback_overview(cur, feedback_type=None, since=None, until=None):
+    """Rating summary overall, per feedback type and per month.
+    
+    since/until are dates bounding the months (until exclusive). Returns
+    summarize_ratings() of all matching feedback plus 'by_type' {type:
+    summary} and 'by_month' [{'month': 'YYYY-MM', **summary}, ...] oldest
+    first. Read from the rollup; counts the feedback table only while the
+    rollup is unavailable.
+    """
+    conditions = []
+    params = []
+    if ensure_feedback_rollup(build=True):
+        month_column = "month"
+        source = "feedback_rating_rollup"
+        count = "SUM(count)"
+    else:
+        month_column = "DATE_FORMAT(created_at, '%Y-%m-01')"
+        source = "feedback"
+        count = "COUNT(*)"
+        conditions.append("created_at IS NOT NULL")
+    
+    if feedback_type:
+        conditions.append("feedback_type = %s")
+        params.append(feedback_type)
+    if since:
+        conditions.append(f"{month_column} >= %s")
+        params.append(since)
+    if until:
+        conditions.append(f"{month_column} < %s")
+        params.append(until)
+    
+    cur.execute(f"""
+        SELECT {month_column} as month, COALESCE(feedback_type, '') as feedback_type, rating, {count} as count
+        FROM {source}
+        WHERE {' AND '.join(conditions) or '1 = 1'}
+        GROUP BY month, feedback_type, rating
+        HAVING {count} > 0
+    """, params)
+    
+    overall = {}
+    by_type = {}
+    by_month = {}
+    for row in cur.fetchall():
+        rating = int(row['rating'])
+        count = int(row['count'])
+        month = row['month'] if isinstance(row['month'], str) else row['month'].strftime('%Y-%m-%d')
+        overall[rating] = overall.get(rating, 0) + count
+        histogram = by_type.setdefault(row['feedback_type'], {})
+        histogram[rating] = histogram.get(rating, 0) + count
+        histogram = by_month.setdefault(month[:7], {})
+        histogram[rating] = histogram.get(rating, 0) + count
+    
+    overview = summarize_ratings(overall)
+    overview['by_type'] = {ftype: summarize_ratings(histogram) for ftype, histogram in by_type.items()}
+    overview['by_month'] = [
+        dict(summarize_ratings(by_month[month]), month=month)
+        for month in sorted(by_month)
+    ]
+    return overview
@@ -0,0 +1,258 @@
+"""Grouping of near-duplicate reports into incidents.
+
+When a report is created, it is hashed into a geohash cell and a time
+bucket. Open incidents of the same type in that cell or its eight
+neighbours, in the current or previous bucket, are found with one indexed
+lookup; the report joins the nearest one within INCIDENT_RADIUS_METERS,
+otherwise it starts a new incident. Dispatch and the radio operator
+dashboard then work on incidents, so ten neighbours reporting the same
+flood need one dispatch instead of ten.
+
+Grouping runs after the report is committed, in its own transaction: the
+lookup locks the neighbourhood so that two reports of one event cannot
+both open an incident, and two such transactions can deadlock during a
+surge. Here that only costs a retry of the grouping, never the report.
+"""
+import math
+import time
+
+import report_events
+
+# Precision 6 cells are about 600 m x 1.2 km at Tigbauan's latitude, so the
+# 3x3 neighbourhood reaches at least 600 m around a report, past the radius
+# (precision 7 cells are about 150 m across, short of it)
+INCIDENT_GEOHASH_PRECISION = 6
+INCIDENT_BUCKET_MINUTES = 30
+INCIDENT_RADIUS_METERS = 250
+INCIDENT_GROUP_ATTEMPTS = 3
+# Deadlock, lock wait timeout
+INCIDENT_RETRY_ERRNOS = (1213, 1205)
+
+INCIDENTS_DDL = """
+    CREATE TABLE IF NOT EXISTS incidents (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        emergency_type VARCHAR(50) NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'open',
+        geohash VARCHAR(12) NOT NULL,
+        time_bucket INT NOT NULL,
+        latitude DECIMAL(10, 8) NOT NULL,
+        longitude DECIMAL(11, 8) NOT NULL,
+        report_count INT NOT NULL DEFAULT 1,
+        created_at DATETIME NOT NULL,
+        updated_at DATETIME NOT NULL,
+        INDEX idx_incidents_cell (geohash, time_bucket)
+    )
+"""
+
+INCIDENT_REPORTS_DDL = """
+    CREATE TABLE IF NOT EXISTS incident_reports (
+        report_id INT PRIMARY KEY,
+        incident_id INT NOT NULL,
+        INDEX idx_incident_reports_incident (incident_id)
+    )
+"""
+
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+def geohash_encode(lat, lng, precision=INCIDENT_GEOHASH_PRECISION):
+    """Standard geohash of a point"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = bit_count = 0
+    even = True
+    
+    while len(chars) < precision:
+        value_range, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            value_range[0] = mid
+        else:
+            bits = bits * 2
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits = bit_count = 0
+    
+    return ''.join(chars)
+
+def geohash_neighbourhood(lat, lng, precision=INCIDENT_GEOHASH_PRECISION):
+    """The geohash cell of a point and its eight neighbours"""
+    lng_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    cell_height = 180.0 / 2 ** lat_bits
+    cell_width = 360.0 / 2 ** lng_bits
+    
+    return sorted({
+        geohash_encode(lat + d_lat * cell_height, lng + d_lng * cell_width, precision)
+        for d_lat in (-1, 0, 1)
+        for d_lng in (-1, 0, 1)
+    })
+
+def time_bucket(moment):
+    return int(moment.timestamp()) // (INCIDENT_BUCKET_MINUTES * 60)
+
+def distance_meters(lat1, lng1, lat2, lng2):
+    """Haversine distance between two points"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 6371000 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def ensure_incident_tables():
+    from admin import ensure_table
+    
+    return (ensure_table('incidents', INCIDENTS_DDL)
+            and ensure_table('incident_reports', INCIDENT_REPORTS_DDL))
+
+@report_events.subscribe
+def group_new_report(event):
+    """Group a committed report, retrying when the grouping transaction deadlocks"""
+    from admin import get_db_connection
+    
+    if event['kind'] != 'created' or not event['latitude'] or not event['longitude']:
+        return
+    if not ensure_incident_tables():
+        return
+    
+    for attempt in range(1, INCIDENT_GROUP_ATTEMPTS + 1):
+        conn = get_db_connection()
+        if not conn:
+            return
+        try:
+            cur = conn.cursor(dictionary=True)
+            group_report(cur, event)
+            conn.commit()
+            cur.close()
+            conn.close()
+            return
+        except Exception as e:
+            conn.rollback()
+            conn.close()
+            if getattr(e, 'errno', None) not in INCIDENT_RETRY_ERRNOS or attempt == INCIDENT_GROUP_ATTEMPTS:
+                print(f"Group report {event['report_id']} error: {e}")
+                return
+            time.sleep(0.05 * attempt)
+
+def group_report(cur, event):
+    """Attach a report to a matching open incident, or open a new one (in the caller's transaction)"""
+    lat, lng = event['latitude'], event['longitude']
+    bucket = time_bucket(event['changed_at'])
+    cells = geohash_neighbourhood(lat, lng)
+    
+    cur.execute(f"""
+        SELECT id, latitude, longitude
+        FROM incidents
+        WHERE geohash IN ({', '.join(['%s'] * len(cells))})
+        AND time_bucket IN (%s, %s)
+        AND emergency_type = %s
+        AND status = 'open'
+        FOR UPDATE
+    """, cells + [bucket - 1, bucket, event['emergency_type']])
+    candidates = cur.fetchall()
+    
+    nearest, nearest_distance = None, INCIDENT_RADIUS_METERS
+    for candidate in candidates:
+        incident_id, incident_lat, incident_lng = (
+            (candidate['id'], candidate['latitude'], candidate['longitude'])
+            if isinstance(candidate, dict) else candidate
+        )
+        distance = distance_meters(lat, lng, float(incident_lat), float(incident_lng))
+        if distance <= nearest_distance:
+            nearest, nearest_distance = incident_id, distance
+    
+    if nearest is None:
+        cur.execute("""
+            INSERT INTO incidents
+            (emergency_type, status, geohash, time_bucket, latitude, longitude, report_count, created_at, updated_at)
+            VALUES (%s, 'open', %s, %s, %s, %s, 1, %s, %s)
+        """, (event['emergency_type'], geohash_encode(lat, lng), bucket, lat, lng,
+              event['changed_at'], event['changed_at']))
+        nearest = cur.lastrowid
+    else:
+        # Moving the bucket forward keeps an ongoing incident open to new reports
+        cur.execute("""
+            UPDATE incidents
+            SET report_count = report_count + 1,
+                time_bucket = GREATEST(time_bucket, %s),
+                updated_at = %s
+            WHERE id = %s
+        """, (bucket, event['changed_at'], nearest))
+    
+    cur.execute("""
+        INSERT INTO incident_reports (report_id, incident_id)
+        VALUES (%s, %s)
+    """, (event['report_id'], nearest))
+
+@report_events.subscribe(transactional=True)
+def update_incident_status(cur, event):
+    """An incident stays open while any of its reports is unresolved"""
+    if event['kind'] != 'status_changed' or event['old_status'] == event['new_status']:
+        return
+    if not ensure_incident_tables():
+        return
+    
+    cur.execute("SELECT incident_id FROM incident_reports WHERE report_id = %s", (event['report_id'],))
+    row = cur.fetchone()
+    if not row:
+        return
+    incident_id = row['incident_id'] if isinstance(row, dict) else row[0]
+    
+    # Reads this transaction's own status update, so the new status counts
+    open_reports = open_incident_report_ids(cur, incident_id)
+    cur.execute("""
+        UPDATE incidents
+        SET status = %s, updated_at = %s
+        WHERE id = %s
+    """, ('open' if open_reports else 'resolved', event['changed_at'], incident_id))
+
+def open_incident_report_ids(cur, incident_id):
+    """Ids of the unresolved reports in an incident"""
+    cur.execute("""
+        SELECT er.id
+        FROM incident_reports ir
+        JOIN emergency_reports er ON er.id = ir.report_id
+        WHERE ir.incident_id = %s
+        AND er.status != 'resolved'
+        ORDER BY er.created_at
+    """, (incident_id,))
+    return [row['id'] if isinstance(row, dict) else row[0] for row in cur.fetchall()]
+
+def pending_incident_report_ids(cur, incident_id):
+    """Ids of the reports in an incident still waiting for a dispatch"""
+    cur.execute("""
+        SELECT er.id
+        FROM incident_reports ir
+        JOIN emergency_reports er ON er.id = ir.report_id
+        WHERE ir.incident_id = %s
+        AND er.status = 'pending'
+        ORDER BY er.created_at
+    """, (incident_id,))
+    return [row['id'] if isinstance(row, dict) else row[0] for row in cur.fetchall()]
+
+def group_reports_by_incident(reports):
+    """Collapse report rows (with an incident_id column) into one entry per incident.
+    
+    Keeps the order of the rows: each entry is the first report of its
+    incident with the others under 'related_reports'. Reports without an
+    incident stand alone.
+    """
+    grouped = []
+    leads = {}
+    
+    for report in reports:
+        report['related_reports'] = []
+        incident_id = report.get('incident_id')
+        if incident_id is None:
+            grouped.append(report)
+        elif incident_id in leads:
+            leads[incident_id]['related_reports'].append(report)
+        else:
+            leads[incident_id] = report
+            grouped.append(report)
+    
+    return grouped
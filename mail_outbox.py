@@ -0,0 +1,354 @@
+"""Durable outbox for outgoing email.
+
+Routes no longer talk to SMTP: enqueue_mail() writes the message to
+mail_outbox and returns, and a pool of MAIL_WORKERS threads sends it in the
+background. Each worker keeps its SMTP session open and sends message after
+message over it, reconnecting only when the server drops it or it has been
+idle for MAIL_SMTP_IDLE_SECONDS, so the TLS handshake and login happen once
+per worker instead of once per message.
+
+Workers claim messages with an UPDATE, so several processes can share the
+outbox. A failed send is retried up to MAIL_MAX_ATTEMPTS times with
+exponential backoff; permanent rejections of the message itself (refused
+recipients, 5xx to its content) fail at once. When the server cannot be
+reached or refuses the login, the message goes back to the queue without
+using up an attempt and the worker backs off: a bad or rotated credential
+delays mail rather than failing every queued OTP. A message left in 'sending' by a process that died is claimed again
+after MAIL_CLAIM_TIMEOUT. Each sent message records its queue and send times.
+Bodies carry OTPs and passwords, so they are blanked once a message is sent
+or has failed for good.
+
+Point MAIL_SERVER/MAIL_PORT at a local sink to try the pipeline, e.g.
+python -m aiosmtpd -n -l localhost:8025 with MAIL_PORT=8025 and
+MAIL_USE_TLS=false.
+"""
+import json
+import os
+import random
+import smtplib
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS', 2))
+MAIL_MAX_ATTEMPTS = 5
+MAIL_RETRY_BASE_SECONDS = 30
+MAIL_RETRY_MAX_SECONDS = 3600
+MAIL_POLL_SECONDS = 5
+MAIL_SMTP_IDLE_SECONDS = 60
+MAIL_SMTP_TIMEOUT = 30
+MAIL_CLAIM_TIMEOUT = timedelta(minutes=5)
+MAIL_METRICS_SAMPLES = 1000
+
+MAIL_OUTBOX_DDL = """
+    CREATE TABLE IF NOT EXISTS mail_outbox (
+        id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        category VARCHAR(30) NOT NULL DEFAULT '',
+        sender VARCHAR(255) NOT NULL,
+        recipients TEXT NOT NULL,
+        subject VARCHAR(255) NOT NULL,
+        body MEDIUMTEXT NOT NULL,
+        status VARCHAR(10) NOT NULL DEFAULT 'queued',
+        attempts INT NOT NULL DEFAULT 0,
+        next_attempt_at DATETIME NOT NULL,
+        claimed_by CHAR(32) NULL,
+        claimed_at DATETIME NULL,
+        last_error VARCHAR(255) NULL,
+        created_at DATETIME NOT NULL,
+        sent_at DATETIME NULL,
+        queue_ms INT NULL,
+        send_ms INT NULL,
+        INDEX idx_mail_outbox_due (status, next_attempt_at)
+    )
+"""
+
+_config = {}
+_workers = []
+_workers_lock = threading.Lock()
+_wake = threading.Event()
+_metrics = {'sent': 0, 'retried': 0, 'failed': 0, 'connections': 0, 'connect_errors': 0}
+_send_ms = deque(maxlen=MAIL_METRICS_SAMPLES)
+_queue_ms = deque(maxlen=MAIL_METRICS_SAMPLES)
+_metrics_lock = threading.Lock()
+
+def ensure_outbox_table():
+    from admin import ensure_table
+    
+    return ensure_table('mail_outbox', MAIL_OUTBOX_DDL)
+
+def insert_mail(cur, subject, recipients, body, sender=None, category=''):
+    now = datetime.now()
+    cur.execute("""
+        INSERT INTO mail_outbox (category, sender, recipients, subject, body, next_attempt_at, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, (category, sender or _config.get('MAIL_DEFAULT_SENDER') or _config.get('MAIL_USERNAME', ''),
+          json.dumps(list(recipients)), subject, body, now, now))
+
+def enqueue_mail(subject, recipients, body, sender=None, category=''):
+    """Queue a plain-text email. Returns True once it is stored for sending."""
+    from admin import get_db_connection
+    
+    if not ensure_outbox_table():
+        return False
+    
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
+    try:
+        cur = conn.cursor()
+        insert_mail(cur, subject, recipients, body, sender, category)
+        conn.commit()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Enqueue mail error: {e}")
+        conn.close()
+        return False
+    
+    wake_workers()
+    return True
+
+def wake_workers():
+    """Have the workers look for due messages now instead of at their next poll"""
+    start_workers()
+    _wake.set()
+
+class MailConnectionError(Exception):
+    """The SMTP server could not be reached or did not accept the login"""
+
+class SmtpSession:
+    """One SMTP connection, opened on first use and kept open between messages"""
+    def __init__(self, config):
+        self.config = config
+        self.smtp = None
+        self.last_used = 0.0
+    
+    def connect(self):
+        config = self.config
+        smtp = None
+        try:
+            if config.get('MAIL_USE_SSL'):
+                smtp = smtplib.SMTP_SSL(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=MAIL_SMTP_TIMEOUT)
+            else:
+                smtp = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=MAIL_SMTP_TIMEOUT)
+                if config.get('MAIL_USE_TLS'):
+                    smtp.starttls()
+            if config.get('MAIL_USERNAME') and config.get('MAIL_PASSWORD'):
+                smtp.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+        except (smtplib.SMTPException, OSError) as e:
+            if smtp is not None:
+                smtp.close()
+            with _metrics_lock:
+                _metrics['connect_errors'] += 1
+            raise MailConnectionError(f"{type(e).__name__}: {e}") from e
+        self.smtp = smtp
+        with _metrics_lock:
+            _metrics['connections'] += 1
+    
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+    
+    def send(self, message):
+        """Send over the open session, reconnecting once if the server dropped it"""
+        if self.smtp is not None and time.monotonic() - self.last_used > MAIL_SMTP_IDLE_SECONDS:
+            self.close()
+        
+        for attempt in (1, 2):
+            if self.smtp is None:
+                self.connect()
+            try:
+                self.smtp.send_message(message)
+                self.last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout):
+                self.close()
+                if attempt == 2:
+                    raise
+
+def build_message(row):
+    message = EmailMessage()
+    message['Subject'] = row['subject']
+    message['From'] = row['sender']
+    message['To'] = ', '.join(json.loads(row['recipients']))
+    message.set_content(row['body'])
+    return message
+
+def is_permanent(error):
+    """True for rejections of a message's recipients or content, which a retry would not fix"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPDataError) and 500 <= error.smtp_code < 600
+
+def retry_delay(attempts):
+    """Backoff before attempt attempts + 1: doubling from MAIL_RETRY_BASE_SECONDS, with jitter"""
+    delay = min(MAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), MAIL_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+def claim_message(cur, worker_id):
+    """Claim the oldest due message for a worker and return it, or None"""
+    now = datetime.now()
+    cur.execute("""
+        UPDATE mail_outbox
+        SET status = 'sending', claimed_by = %s, claimed_at = %s
+        WHERE (status = 'queued' AND next_attempt_at <= %s)
+            OR (status = 'sending' AND claimed_at < %s)
+        ORDER BY id
+        LIMIT 1
+    """, (worker_id, now, now, now - MAIL_CLAIM_TIMEOUT))
+    if cur.rowcount != 1:
+        return None
+    
+    cur.execute("""
+        SELECT * FROM mail_outbox
+        WHERE claimed_by = %s AND status = 'sending'
+        ORDER BY claimed_at DESC
+        LIMIT 1
+    """, (worker_id,))
+    return cur.fetchone()
+
+def deliver(session, cur, row):
+    """Send a claimed message and record the outcome on its row.
+    
+    Returns False if the server could not be reached; the message is then
+    queued again as it was.
+    """
+    if _config.get('MAIL_SUPPRESS_SEND'):
+        error = None
+        send_ms = 0
+    else:
+        started = time.monotonic()
+        try:
+            session.send(build_message(row))
+            error = None
+        except Exception as e:
+            error = e
+            if not is_permanent(e):
+                # The session may be mid-transaction; start the next message on a fresh one
+                session.close()
+        send_ms = int((time.monotonic() - started) * 1000)
+    
+    now = datetime.now()
+    attempts = row['attempts'] + 1
+    if error is None:
+        queue_ms = int((now - row['created_at']).total_seconds() * 1000)
+        cur.execute("""
+            UPDATE mail_outbox
+            SET status = 'sent', attempts = %s, sent_at = %s, queue_ms = %s, send_ms = %s, last_error = NULL, body = ''
+            WHERE id = %s
+        """, (attempts, now, queue_ms, send_ms, row['id']))
+        with _metrics_lock:
+            _metrics['sent'] += 1
+            _send_ms.append(send_ms)
+            _queue_ms.append(queue_ms)
+        return True
+    
+    print(f"Send mail {row['id']} error: {error}")
+    if isinstance(error, MailConnectionError):
+        cur.execute("""
+            UPDATE mail_outbox
+            SET status = 'queued', last_error = %s, claimed_by = NULL
+            WHERE id = %s
+        """, (str(error)[:255], row['id']))
+        return False
+    
+    if is_permanent(error) or attempts >= MAIL_MAX_ATTEMPTS:
+        status, next_attempt_at, counter = 'failed', row['next_attempt_at'], 'failed'
+    else:
+        status, next_attempt_at, counter = 'queued', now + retry_delay(attempts), 'retried'
+    cur.execute("""
+        UPDATE mail_outbox
+        SET status = %s, attempts = %s, next_attempt_at = %s, last_error = %s, claimed_by = NULL,
+            body = IF(%s = 'failed', '', body)
+        WHERE id = %s
+    """, (status, attempts, next_attempt_at, str(error)[:255], status, row['id']))
+    with _metrics_lock:
+        _metrics[counter] += 1
+    return True
+
+def worker_loop():
+    """Send due messages until there are none, then wait for a wake-up or the next poll"""
+    from admin import get_db_connection
+    
+    worker_id = uuid.uuid4().hex
+    session = SmtpSession(_config)
+    connect_failures = 0
+    
+    while True:
+        conn = get_db_connection() if ensure_outbox_table() else None
+        if conn:
+            try:
+                conn.autocommit = True
+                cur = conn.cursor(dictionary=True)
+                while True:
+                    row = claim_message(cur, worker_id)
+                    if row is None:
+                        break
+                    if not deliver(session, cur, row):
+                        connect_failures += 1
+                        break
+                    connect_failures = 0
+                cur.close()
+                conn.close()
+            except Exception as e:
+                print(f"Mail worker error: {e}")
+                conn.close()
+        
+        if connect_failures:
+            # The server is down or rejects the login; wake-ups would only fail again
+            time.sleep(retry_delay(connect_failures).total_seconds())
+            continue
+        
+        if session.smtp is not None and time.monotonic() - session.last_used > MAIL_SMTP_IDLE_SECONDS:
+            session.close()
+        _wake.wait(MAIL_POLL_SECONDS)
+        _wake.clear()
+
+def configure(config):
+    """Take the SMTP settings (MAIL_* keys) from the app config"""
+    _config.update({key: value for key, value in config.items() if key.startswith('MAIL_')})
+
+def start_workers():
+    """Start the worker pool once per process"""
+    if _workers:
+        return
+    
+    with _workers_lock:
+        if _workers or not _config:
+            return
+        for number in range(MAIL_WORKERS):
+            worker = threading.Thread(target=worker_loop, name=f"mail-{number}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+def mail_metrics():
+    """Counters since start, plus p50/p95 send and queue times (ms) of recent messages"""
+    with _metrics_lock:
+        metrics = dict(_metrics)
+        send_ms = list(_send_ms)
+        queue_ms = list(_queue_ms)
+    metrics['workers'] = len(_workers)
+    for name, samples in (('send_ms', send_ms), ('queue_ms', queue_ms)):
+        metrics[f"{name}_p50"] = percentile(samples, 50)
+        metrics[f"{name}_p95"] = percentile(samples, 95)
+    return metrics
+
+def outbox_counts(cur):
+    """Messages per status in the outbox"""
+    cur.execute("SELECT status, COUNT(*) as count FROM mail_outbox GROUP BY status")
+    return {row['status']: int(row['count']) for row in cur.fetchall()}
@@ -0,0 +1,671 @@
+from flask import Blueprint, Response, jsonify, request, session
+from functools import wraps
+from datetime import datetime, timedelta
+import json
+import math
+import os
+import struct
+import tempfile
+import time
+import numpy as np
+
+import change_feed
+import report_events
+from report_clusters import cluster_index
+from report_cube import cube_frames, cell_center, ensure_report_cube, rebuild_report_cube, CUBE_BOUNDS, CUBE_GRID
+from report_hotspots import get_hotspot_surface, HOTSPOT_BOUNDS, HOTSPOT_GRID, HOTSPOT_SEASONS
+from admin import get_db_connection, ensure_table, fetch_map_reports, cacheable_json, parse_map_window, TIGBAUAN_BOUNDS
+
+maps_bp = Blueprint('maps', __name__)
+
+# Pre-aggregated report tiles are cached on disk as {z}/{x}/{y}.json
+TILE_CACHE_FOLDER = os.environ.get('TILE_CACHE_FOLDER', 'cache/tiles')
+TILE_MIN_ZOOM = 0
+TILE_MAX_ZOOM = 19
+# From this zoom up tiles carry individual points instead of grid cells
+TILE_POINT_ZOOM = 15
+# Low-zoom tiles are summarised on a TILE_GRID x TILE_GRID grid
+TILE_GRID = 16
+# Only non-empty tiles over the municipality are cached, at most this many
+TILE_CACHE_MAX_FILES = 20000
+# A tile written after the invalidation it raced with is rebuilt after this long
+TILE_CACHE_MAX_AGE_SECONDS = 300
+TILE_PRUNE_SECONDS = 60
+
+# Report times are stored as Manila local time, which is UTC+8 all year
+MANILA_UTC_OFFSET = 8 * 3600
+MAX_DETAIL_IDS = 50
+_last_tile_prune = {'at': 0.0}
+# Clients further behind than this many changed reports reload from scratch
+MAX_DELTA_REPORTS = 500
+# Playback covers at most this many hourly (or daily) frames per request
+PLAYBACK_MAX_HOURS = 31 * 24
+PLAYBACK_MAX_DAYS = 3 * 366
+PLAYBACK_DEFAULT_HOURS = 72
+
+@maps_bp.app_context_processor
+def map_template_globals():
+    """Bounds of the hotspot overlay, for templates that draw it"""
+    return {'hotspot_bounds': HOTSPOT_BOUNDS}
+
+def map_viewer_required(f):
+    """Allow verified citizens and logged-in admins"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        citizen = 'user_id' in session and session.get('otp_verified') == True
+        if not citizen and 'admin_id' not in session:
+            return jsonify({'success': False, 'message': 'Not logged in'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+def lnglat_to_tile(lng, lat, z):
+    """Return the XYZ (slippy map) tile containing a point at zoom z"""
+    n = 2 ** z
+    lat_rad = math.radians(lat)
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def tile_bounds(z, x, y):
+    """Return (west, south, east, north) of an XYZ tile"""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+def tile_path(z, x, y):
+    return os.path.join(TILE_CACHE_FOLDER, str(z), str(x), f"{y}.json")
+
+def build_report_tile(z, x, y):
+    """Aggregate the reports inside one tile into a compact JSON document"""
+    west, south, east, north = tile_bounds(z, x, y)
+    
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        # Half-open bounds so a point on a tile edge belongs to exactly one tile
+        cur.execute("""
+            SELECT id, emergency_type, status, latitude, longitude
+            FROM emergency_reports
+            WHERE latitude >= %s AND latitude < %s
+            AND longitude >= %s AND longitude < %s
+            AND latitude != 0
+            AND longitude != 0
+        """, (south, north, west, east))
+        reports = cur.fetchall()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Build report tile error: {e}")
+        conn.close()
+        return None
+    
+    tile = {'z': z, 'x': x, 'y': y, 'count': len(reports)}
+    
+    if z >= TILE_POINT_ZOOM:
+        tile['points'] = [
+            [r['id'], float(r['latitude']), float(r['longitude']), r['emergency_type'], r['status']]
+            for r in reports
+        ]
+        return tile
+    
+    cells = {}
+    for r in reports:
+        lat = float(r['latitude'])
+        lng = float(r['longitude'])
+        col = min(int((lng - west) / (east - west) * TILE_GRID), TILE_GRID - 1)
+        row = min(int((north - lat) / (north - south) * TILE_GRID), TILE_GRID - 1)
+        
+        cell = cells.setdefault((row, col), {'lat': 0.0, 'lng': 0.0, 'count': 0, 'active': 0, 'types': {}})
+        cell['lat'] += lat
+        cell['lng'] += lng
+        cell['count'] += 1
+        if r['status'] != 'resolved':
+            cell['active'] += 1
+        cell['types'][r['emergency_type']] = cell['types'].get(r['emergency_type'], 0) + 1
+    
+    # Each cell is drawn at the centroid of its reports
+    for cell in cells.values():
+        cell['lat'] = round(cell['lat'] / cell['count'], 6)
+        cell['lng'] = round(cell['lng'] / cell['count'], 6)
+    
+    tile['cells'] = list(cells.values())
+    return tile
+
+def tile_in_municipality(z, x, y):
+    west, south, east, north = tile_bounds(z, x, y)
+    return (west < TIGBAUAN_BOUNDS['east'] and east > TIGBAUAN_BOUNDS['west']
+            and south < TIGBAUAN_BOUNDS['north'] and north > TIGBAUAN_BOUNDS['south'])
+
+def prune_tile_cache():
+    """Delete the oldest cached tiles past TILE_CACHE_MAX_FILES (at most once a minute)"""
+    now = time.monotonic()
+    if now - _last_tile_prune['at'] < TILE_PRUNE_SECONDS:
+        return
+    _last_tile_prune['at'] = now
+    
+    tiles = []
+    for folder, _, filenames in os.walk(TILE_CACHE_FOLDER):
+        for filename in filenames:
+            path = os.path.join(folder, filename)
+            try:
+                tiles.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+    if len(tiles) <= TILE_CACHE_MAX_FILES:
+        return
+    
+    tiles.sort()
+    for _, path in tiles[:len(tiles) - TILE_CACHE_MAX_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def read_cached_tile(path):
+    """A cached tile's bytes, or None if it is missing or past TILE_CACHE_MAX_AGE_SECONDS"""
+    try:
+        if time.time() - os.path.getmtime(path) > TILE_CACHE_MAX_AGE_SECONDS:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def write_cached_tile(path, body):
+    # Write to a temporary file of this call first so readers never see a partial tile
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp', delete=False) as f:
+            tmp_path = f.name
+            f.write(body)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Cache report tile error: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    prune_tile_cache()
+
+def get_report_tile(z, x, y):
+    """Return the encoded tile, building and caching it on a miss"""
+    path = tile_path(z, x, y)
+    body = read_cached_tile(path)
+    if body is not None:
+        return body
+    
+    tile = build_report_tile(z, x, y)
+    if tile is None:
+        return None
+    
+    body = json.dumps(tile, separators=(',', ':')).encode()
+    # Empty tiles and tiles away from Tigbauan are cheap to build and would only fill the disk
+    if tile['count'] and tile_in_municipality(z, x, y):
+        write_cached_tile(path, body)
+    return body
+
+def invalidate_point_tiles(lat, lng):
+    """Drop the cached tile containing a point at every zoom level"""
+    for z in range(TILE_MIN_ZOOM, TILE_MAX_ZOOM + 1):
+        x, y = lnglat_to_tile(lng, lat, z)
+        try:
+            os.remove(tile_path(z, x, y))
+        except FileNotFoundError:
+            pass
+
+@report_events.subscribe
+def invalidate_report_tiles(event):
+    if event['latitude'] and event['longitude']:
+        invalidate_point_tiles(event['latitude'], event['longitude'])
+
+@maps_bp.route('/tiles/reports/<int:z>/<int:x>/<int:y>')
+@map_viewer_required
+def report_tile(z, x, y):
+    """Serve a pre-aggregated report tile"""
+    if not TILE_MIN_ZOOM <= z <= TILE_MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'success': False, 'message': 'Tile out of range'}), 404
+    
+    body = get_report_tile(z, x, y)
+    if body is None:
+        return jsonify({'success': False, 'message': 'Error loading tile'}), 503
+    
+    response = Response(body, mimetype='application/json')
+    response.cache_control.private = True
+    response.cache_control.max_age = 30
+    response.add_etag()
+    return response.make_conditional(request)
+
+def build_report_columns(reports, viewer_id=None):
+    """Turn compact report rows into parallel NumPy arrays.
+    
+    Returns (columns, dictionaries): columns is a list of (name, array)
+    pairs and dictionaries maps the uint8 'type'/'status' codes to strings.
+    """
+    count = len(reports)
+    ids = np.fromiter((r['id'] for r in reports), dtype=np.uint32, count=count)
+    lat = np.fromiter((float(r['latitude']) for r in reports), dtype=np.float32, count=count)
+    lng = np.fromiter((float(r['longitude']) for r in reports), dtype=np.float32, count=count)
+    
+    created = np.array([r['created_at'] for r in reports], dtype='datetime64[s]')
+    epoch = created.astype(np.int64) - MANILA_UTC_OFFSET
+    time = np.where(np.isnat(created), 0, epoch).astype(np.uint32)
+    
+    # Dictionary-encode the repeated strings
+    types, type_codes = np.unique(
+        np.array([r['emergency_type'] or 'other' for r in reports], dtype=object), return_inverse=True)
+    statuses, status_codes = np.unique(
+        np.array([r['status'] or 'pending' for r in reports], dtype=object), return_inverse=True)
+    
+    columns = [
+        ('id', ids),
+        ('lat', lat),
+        ('lng', lng),
+        ('time', time),
+        ('type', type_codes.astype(np.uint8)),
+        ('status', status_codes.astype(np.uint8))
+    ]
+    if viewer_id is not None:
+        mine = np.fromiter((r['user_id'] == viewer_id for r in reports), dtype=np.uint8, count=count)
+        columns.append(('mine', mine))
+    
+    return columns, {'types': types.tolist(), 'statuses': statuses.tolist()}
+
+def encode_columns_binary(columns, header):
+    """Pack columns as a typed-array payload.
+    
+    Layout: uint32 header length, JSON header (lists column names/dtypes),
+    then each column little-endian, every section padded to 4 bytes so the
+    browser can view it directly with Float32Array/Uint32Array/Uint8Array.
+    """
+    header = dict(header, columns=[[name, str(values.dtype)] for name, values in columns])
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+    header_bytes += b' ' * (-len(header_bytes) % 4)
+    
+    parts = [struct.pack('<I', len(header_bytes)), header_bytes]
+    for name, values in columns:
+        data = values.astype(values.dtype.newbyteorder('<'), copy=False).tobytes()
+        parts.append(data + b'\0' * (-len(data) % 4))
+    return b''.join(parts)
+
+def columnar_map_response(window, fmt, emergency_type=None, viewer_id=None):
+    """Map points as parallel arrays, either dictionary-encoded JSON or binary"""
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'Database connection error'})
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        reports, next_cursor = fetch_map_reports(cur, window, emergency_type, compact=True)
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Columnar map data error: {e}")
+        conn.close()
+        return jsonify({'success': False, 'message': 'Error loading map data'})
+    
+    columns, dictionaries = build_report_columns(reports, viewer_id)
+    header = dict(dictionaries, count=len(reports), next_cursor=next_cursor)
+    
+    if fmt == 'binary':
+        response = Response(encode_columns_binary(columns, header), mimetype='application/octet-stream')
+        response.cache_control.private = True
+        response.cache_control.max_age = 30
+        response.add_etag()
+        return response.make_conditional(request)
+    
+    payload = dict(header, success=True, format='columns')
+    for name, values in columns:
+        if values.dtype == np.float32:
+            # float32 keeps ~1m precision; round so JSON doesn't print float64 noise
+            values = np.round(values.astype(np.float64), 5)
+        payload[name] = values.tolist()
+    return cacheable_json(payload)
+
+@maps_bp.route('/map/reports/details')
+@map_viewer_required
+def map_report_details():
+    """Popup details for map points, loaded lazily by id (?ids=1,2,3)"""
+    try:
+        ids = [int(report_id) for report_id in request.args.get('ids', '').split(',') if report_id]
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid report ids'}), 400
+    
+    ids = ids[:MAX_DETAIL_IDS]
+    if not ids:
+        return jsonify({'success': True, 'reports': {}})
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'Database connection error'})
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        placeholders = ', '.join(['%s'] * len(ids))
+        cur.execute(f"""
+            SELECT 
+                er.id,
+                er.user_id,
+                er.emergency_type,
+                er.status,
+                er.location,
+                er.description,
+                er.created_at,
+                er.e_img,
+                CONCAT(COALESCE(u.fname, ''), ' ', COALESCE(u.lname, '')) as user_name
+            FROM emergency_reports er
+            LEFT JOIN users u ON er.user_id = u.id
+            WHERE er.id IN ({placeholders})
+        """, ids)
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
+        
+        details = {}
+        for row in rows:
+            details[row['id']] = {
+                'id': row['id'],
+                'type': row['emergency_type'],
+                'status': row['status'],
+                'location': row['location'] or 'Unknown location',
+                'description': row['description'] or '',
+                'user_name': row['user_name'].strip() or 'Anonymous',
+                'image': row['e_img'],
+                'ownership': 'my_report' if row['user_id'] == session.get('user_id') else 'other_report',
+                'time': row['created_at'].strftime('%Y-%m-%d %H:%M') if isinstance(row['created_at'], datetime) else 'Unknown'
+            }
+        
+        return cacheable_json({'success': True, 'reports': details})
+    
+    except Exception as e:
+        print(f"Map report details error: {e}")
+        conn.close()
+        return jsonify({'success': False, 'message': 'Error loading report details'})
+
+@maps_bp.route('/map/changes')
+@map_viewer_required
+def map_changes():
+    """Map points changed since a change cursor (?since=<seq>, plus bbox/type).
+    
+    Without since, only the current cursor is returned; clients take it
+    before their initial load. Replies hold 'added' (new to the client),
+    'changed' and 'removed' ids, or reset=true when the client is too far
+    behind and should reload. The cursor never passes a change that may
+    still commit (see change_feed.committed_seq); changes above it are sent
+    and then sent again on the next poll, so clients apply them
+    idempotently (upsert by id).
+    """
+    since = request.args.get('since', type=int)
+    emergency_type = request.args.get('type')
+    try:
+        window = parse_map_window(request.args)
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid map parameters'}), 400
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'Database connection error'})
+    
+    try:
+        if not ensure_table('report_changes', report_events.REPORT_CHANGES_DDL):
+            conn.close()
+            return jsonify({'success': False, 'message': 'Change log unavailable'})
+        
+        cur = conn.cursor(dictionary=True)
+        
+        if since is None:
+            cursor = change_feed.committed_seq(cur, None)
+            cur.close()
+            conn.close()
+            return jsonify({'success': True, 'cursor': cursor})
+        
+        cur.execute("""
+            SELECT 
+                report_id,
+                MAX(seq) as last_seq,
+                MAX(change_type = 'created') as was_created
+            FROM report_changes
+            WHERE seq > %s
+            GROUP BY report_id
+            ORDER BY last_seq
+            LIMIT %s
+        """, (since, MAX_DELTA_REPORTS + 1))
+        changes = cur.fetchall()
+        
+        if len(changes) > MAX_DELTA_REPORTS:
+            cur.close()
+            conn.close()
+            return jsonify({'success': True, 'reset': True})
+        
+        added, changed, removed = [], [], []
+        cursor = change_feed.committed_seq(cur, since)
+        
+        if changes:
+            report_ids = [row['report_id'] for row in changes]
+            placeholders = ', '.join(['%s'] * len(report_ids))
+            cur.execute(f"""
+                SELECT 
+                    er.id,
+                    er.user_id,
+                    er.emergency_type,
+                    er.status,
+                    er.latitude,
+                    er.longitude,
+                    er.location,
+                    er.description,
+                    er.created_at,
+                    er.e_img,
+                    CONCAT(COALESCE(u.fname, ''), ' ', COALESCE(u.lname, '')) as user_name
+                FROM emergency_reports er
+                LEFT JOIN users u ON er.user_id = u.id
+                WHERE er.id IN ({placeholders})
+            """, report_ids)
+            reports = {row['id']: row for row in cur.fetchall()}
+            
+            for change in changes:
+                report = reports.get(change['report_id'])
+                if not report:
+                    removed.append(change['report_id'])
+                    continue
+                
+                try:
+                    lat = float(report['latitude'] or 0)
+                    lng = float(report['longitude'] or 0)
+                except (TypeError, ValueError):
+                    continue
+                
+                # Points outside the client's window or filter are none of its business
+                if not lat or not lng:
+                    continue
+                if not (window['south'] <= lat <= window['north'] and window['west'] <= lng <= window['east']):
+                    continue
+                if emergency_type and emergency_type != 'all' and report['emergency_type'] != emergency_type:
+                    continue
+                
+                point = {
+                    'id': report['id'],
+                    'emergency_type': report['emergency_type'],
+                    'status': report['status'],
+                    'latitude': lat,
+                    'longitude': lng,
+                    'location': report['location'],
+                    'description': report['description'],
+                    'created_at': report['created_at'].isoformat() if report['created_at'] else None,
+                    'user_name': report['user_name'].strip() or 'Anonymous',
+                    'image': report['e_img'],
+                    'mine': report['user_id'] == session.get('user_id')
+                }
+                (added if change['was_created'] else changed).append(point)
+        
+        cur.close()
+        conn.close()
+        
+        return jsonify({
+            'success': True,
+            'cursor': cursor,
+            'added': added,
+            'changed': changed,
+            'removed': removed
+        })
+    
+    except Exception as e:
+        print(f"Map changes error: {e}")
+        conn.close()
+        return jsonify({'success': False, 'message': 'Error loading map changes'})
+
+@maps_bp.route('/map/clusters')
+@map_viewer_required
+def map_clusters():
+    """Report clusters for a map view (?bbox=west,south,east,north&zoom=z, optional type).
+    
+    Clusters come from the shared in-process index rather than the browser;
+    features with cluster=false are single reports whose popup details are
+    loaded through /map/reports/details.
+    """
+    try:
+        window = parse_map_window(request.args)
+        zoom = int(request.args.get('zoom', 13))
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid map parameters'}), 400
+    
+    if not cluster_index.sync():
+        return jsonify({'success': False, 'message': 'Error loading clusters'}), 503
+    
+    features = cluster_index.query(window, zoom, request.args.get('type'))
+    return cacheable_json({'success': True, 'zoom': zoom, 'features': features}, max_age=5)
+
+@maps_bp.route('/map/clusters/<int:cluster_id>')
+@map_viewer_required
+def expand_map_cluster(cluster_id):
+    """Children of one cluster and the zoom at which it splits apart"""
+    if not cluster_index.sync():
+        return jsonify({'success': False, 'message': 'Error loading clusters'}), 503
+    
+    expansion = cluster_index.expand(cluster_id, request.args.get('type'))
+    if expansion is None:
+        # Clusters change as reports arrive; the client should reload the view
+        return jsonify({'success': False, 'message': 'Cluster not found'}), 404
+    
+    expansion_zoom, children = expansion
+    return jsonify({'success': True, 'expansion_zoom': expansion_zoom, 'children': children})
+
+@maps_bp.route('/map/hotspots')
+@map_viewer_required
+def map_hotspots():
+    """Kernel density surface of reports over the municipality.
+    
+    Optional type, since/until (ISO dates, widened to whole days) and season
+    (wet or dry) select the reports; format=png (default) is an overlay for L.imageOverlay over
+    'bounds', format=array is the float16 grid in reports per km2 using the
+    typed-array layout of the map columns.
+    """
+    emergency_type = request.args.get('type')
+    if emergency_type == 'all':
+        emergency_type = None
+    season = request.args.get('season') or None
+    fmt = request.args.get('format', 'png')
+    
+    try:
+        window = parse_map_window(request.args)
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid map parameters'}), 400
+    if season and season not in HOTSPOT_SEASONS or fmt not in ('png', 'array'):
+        return jsonify({'success': False, 'message': 'Invalid map parameters'}), 400
+    if emergency_type and not emergency_type.isalpha():
+        return jsonify({'success': False, 'message': 'Invalid map parameters'}), 400
+    
+    body = get_hotspot_surface(emergency_type, window['since'], window['until'], season, fmt)
+    if body is None:
+        return jsonify({'success': False, 'message': 'Error loading hotspots'}), 503
+    
+    if fmt == 'png':
+        response = Response(body, mimetype='image/png')
+    else:
+        density = np.frombuffer(body, dtype='<f2')
+        header = {'shape': [HOTSPOT_GRID, HOTSPOT_GRID], 'bounds': HOTSPOT_BOUNDS, 'units': 'reports/km2'}
+        response = Response(encode_columns_binary([('density', density)], header), mimetype='application/octet-stream')
+    
+    response.cache_control.private = True
+    response.cache_control.max_age = 30
+    response.add_etag()
+    return response.make_conditional(request)
+
+@maps_bp.route('/map/playback')
+@map_viewer_required
+def map_playback():
+    """Report counts per grid cell for each hour (or day) of a time range.
+    
+    Reads the pre-aggregated report_cube, so any range is a single index
+    range scan. Parameters: since/until (ISO, default the last 72 hours),
+    step=hour|day, optional type and status. Cells are listed once with
+    their centres; frames refer to them by index.
+    """
+    step = request.args.get('step', 'hour')
+    emergency_type = request.args.get('type')
+    if emergency_type == 'all':
+        emergency_type = None
+    status = request.args.get('status') or None
+    
+    try:
+        window = parse_map_window(request.args)
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid map parameters'}), 400
+    if step not in ('hour', 'day'):
+        return jsonify({'success': False, 'message': 'Invalid map parameters'}), 400
+    
+    until = window['until'] or datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    since = window['since'] or until - timedelta(hours=PLAYBACK_DEFAULT_HOURS)
+    span = timedelta(hours=PLAYBACK_MAX_HOURS) if step == 'hour' else timedelta(days=PLAYBACK_MAX_DAYS)
+    if since >= until or until - since > span:
+        return jsonify({'success': False, 'message': 'Time range too long for this step'}), 400
+    
+    if not ensure_report_cube(build=True):
+        return jsonify({'success': False, 'message': 'Error loading playback'}), 503
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'Database connection error'})
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        frames = cube_frames(cur, since, until, emergency_type, status, step)
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Map playback error: {e}")
+        conn.close()
+        return jsonify({'success': False, 'message': 'Error loading playback'})
+    
+    # List each cell once and let the frames refer to it by index
+    cells = sorted({cell for frame in frames for cell, _ in frame['cells']})
+    index = {cell: i for i, cell in enumerate(cells)}
+    
+    return cacheable_json({
+        'success': True,
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'step': step,
+        'grid': {'size': CUBE_GRID, 'bounds': CUBE_BOUNDS},
+        'cells': [cell_center(cell) for cell in cells],
+        'frames': [
+            {
+                'time': frame['time'].isoformat(),
+                'counts': [[index[cell], count] for cell, count in frame['cells']]
+            }
+            for frame in frames
+        ]
+    }, max_age=30)
+
+@maps_bp.cli.command('rebuild-report-cube')
+def rebuild_report_cube_command():
+    """Recount the playback cube from emergency_reports"""
+    buckets = rebuild_report_cube()
+    if buckets is None:
+        print("Report cube rebuild failed")
+    else:
+        print(f"Report cube rebuilt: {buckets} buckets")
@@ -0,0 +1,283 @@
+"""Monthly dispatch and barangay matrices, partitioned by year.
+
+Reports are stamped with the time they are created or dispatched, so once a
+year is over its matrices no longer change. A closed year is computed once,
+stored in analytics_years and then served from there (and from memory)
+forever; only the current year is recomputed. analytics_years also has a
+row for every closed year with its report count, which is where the list of
+available years comes from instead of a DISTINCT YEAR() scan of all reports.
+"""
+import json
+import threading
+from datetime import datetime, timedelta
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+DISPATCH_TYPES = ['fire', 'medical', 'natural', 'accident', 'other']
+
+# Reports still commit (and get dispatched) a little after midnight on New Year
+ANALYTICS_CLOSE_GRACE = timedelta(days=1)
+
+ANALYTICS_YEARS_DDL = """
+    CREATE TABLE IF NOT EXISTS analytics_years (
+        year SMALLINT PRIMARY KEY,
+        report_count INT NOT NULL DEFAULT 0,
+        monthly_dispatch MEDIUMTEXT NULL,
+        monthly_barangay MEDIUMTEXT NULL,
+        materialized_at DATETIME NULL
+    )
+"""
+
+_closed_years = {}
+_indexed_through = {'year': None}
+_index_lock = threading.Lock()
+
+def is_closed(year):
+    """True once a year ended and can no longer gain reports or dispatches"""
+    return datetime.now() >= datetime(year + 1, 1, 1) + ANALYTICS_CLOSE_GRACE
+
+def last_closed_year():
+    year = datetime.now().year
+    return year - 1 if is_closed(year - 1) else year - 2
+
+def year_range(year):
+    return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+def monthly_dispatch_matrix(cur, year):
+    """Dispatches per month and emergency type in a year"""
+    cur.execute("""
+        SELECT
+            MONTH(dispatched_at) as month,
+            COUNT(*) as dispatch_count,
+            emergency_type
+        FROM emergency_reports
+        WHERE dispatched_at >= %s AND dispatched_at < %s
+        GROUP BY MONTH(dispatched_at), emergency_type
+        ORDER BY month ASC
+    """, year_range(year))
+    
+    monthly_stats = {etype: [0] * 12 for etype in DISPATCH_TYPES}
+    total_dispatches = [0] * 12
+    
+    for record in cur.fetchall():
+        month_idx = record['month'] - 1
+        etype = record['emergency_type']
+        count = int(record['dispatch_count'])
+        
+        if etype in monthly_stats:
+            monthly_stats[etype][month_idx] = count
+            total_dispatches[month_idx] += count
+    
+    return {
+        'months': MONTHS,
+        'emergency_types': monthly_stats,
+        'total_dispatches': total_dispatches,
+        'year': year
+    }
+
+def monthly_barangay_matrix(cur, year):
+    """Reports per month and barangay in a year (known barangays only)"""
+    from admin import ensure_daily_rollup, BARANGAY_CASE_SQL
+    
+    if ensure_daily_rollup(build=True):
+        cur.execute("""
+            SELECT
+                MONTH(date) as month,
+                barangay,
+                SUM(count) as count
+            FROM report_daily_rollup
+            WHERE date >= %s AND date < %s
+                AND barangay != 'Other Areas'
+            GROUP BY MONTH(date), barangay
+            HAVING SUM(count) > 0
+            ORDER BY month ASC, count DESC
+        """, year_range(year))
+    else:
+        cur.execute(f"""
+            SELECT
+                MONTH(created_at) as month,
+                {BARANGAY_CASE_SQL} as barangay,
+                COUNT(*) as count
+            FROM emergency_reports
+            WHERE created_at >= %s AND created_at < %s
+                AND location IS NOT NULL
+                AND location != ''
+            GROUP BY MONTH(created_at), barangay
+            HAVING barangay != 'Other Areas'
+            ORDER BY month ASC, count DESC
+        """, year_range(year))
+    monthly_data = cur.fetchall()
+    
+    # Barangays with reports this year, alphabetically
+    barangays = sorted({record['barangay'] for record in monthly_data})
+    monthly_stats = {brgy: [0] * 12 for brgy in barangays}
+    total_reports = [0] * 12
+    
+    for record in monthly_data:
+        month_idx = record['month'] - 1
+        count = int(record['count'])
+        monthly_stats[record['barangay']][month_idx] = count
+        total_reports[month_idx] += count
+    
+    return {
+        'months': MONTHS,
+        'barangays': barangays,
+        'monthly_stats': monthly_stats,
+        'total_reports': total_reports,
+        'year': year
+    }
+
+def compute_year(cur, year):
+    return {
+        'monthly_dispatch': monthly_dispatch_matrix(cur, year),
+        'monthly_barangay': monthly_barangay_matrix(cur, year)
+    }
+
+def index_closed_years(conn, cur):
+    """Add an analytics_years row for every closed year not indexed yet"""
+    through = last_closed_year()
+    if _indexed_through['year'] == through:
+        return
+    
+    with _index_lock:
+        if _indexed_through['year'] == through:
+            return
+        
+        cur.execute("SELECT MAX(year) as year FROM analytics_years")
+        row = cur.fetchone()
+        first = row['year'] + 1 if row and row['year'] is not None else None
+        
+        if first is None:
+            cur.execute("SELECT MIN(created_at) as first_report FROM emergency_reports")
+            row = cur.fetchone()
+            first = row['first_report'].year if row and row['first_report'] else through + 1
+        
+        for year in range(first, through + 1):
+            cur.execute("""
+                SELECT COUNT(*) as report_count
+                FROM emergency_reports
+                WHERE created_at >= %s AND created_at < %s
+            """, year_range(year))
+            cur.execute("""
+                INSERT IGNORE INTO analytics_years (year, report_count)
+                VALUES (%s, %s)
+            """, (year, cur.fetchone()['report_count']))
+        conn.commit()
+        _indexed_through['year'] = through
+
+def get_year_analytics(year):
+    """Monthly dispatch and barangay matrices of a year, or None if unavailable.
+    
+    Closed years are read from analytics_years, computed and stored there
+    the first time; the current year is always computed.
+    """
+    from admin import get_db_connection, ensure_table
+    
+    if year in _closed_years:
+        return _closed_years[year]
+    
+    closed = is_closed(year)
+    if closed and not ensure_table('analytics_years', ANALYTICS_YEARS_DDL):
+        closed = False
+    
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        analytics = None
+        
+        if closed:
+            index_closed_years(conn, cur)
+            cur.execute("""
+                SELECT monthly_dispatch, monthly_barangay
+                FROM analytics_years
+                WHERE year = %s AND materialized_at IS NOT NULL
+            """, (year,))
+            row = cur.fetchone()
+            if row:
+                analytics = {
+                    'monthly_dispatch': json.loads(row['monthly_dispatch']),
+                    'monthly_barangay': json.loads(row['monthly_barangay'])
+                }
+        
+        if analytics is None:
+            analytics = compute_year(cur, year)
+            if closed:
+                cur.execute("""
+                    UPDATE analytics_years
+                    SET monthly_dispatch = %s, monthly_barangay = %s, materialized_at = %s
+                    WHERE year = %s
+                """, (json.dumps(analytics['monthly_dispatch']), json.dumps(analytics['monthly_barangay']),
+                      datetime.now(), year))
+                conn.commit()
+        
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Year analytics error: {e}")
+        conn.close()
+        return None
+    
+    if closed:
+        _closed_years[year] = analytics
+    return analytics
+
+def available_years():
+    """Years with reports, newest first; the current year is always included"""
+    from admin import get_db_connection, ensure_table
+    
+    current = datetime.now().year
+    
+    if not ensure_table('analytics_years', ANALYTICS_YEARS_DDL):
+        return None
+    
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        index_closed_years(conn, cur)
+        cur.execute("""
+            SELECT year FROM analytics_years
+            WHERE report_count > 0
+            ORDER BY year DESC
+        """)
+        years = [row['year'] for row in cur.fetchall()]
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Available years error: {e}")
+        conn.close()
+        return None
+    
+    # Open years are not indexed yet: the current one, and the last one during the grace period
+    return list(range(current, last_closed_year(), -1)) + years
+
+def clear_materialized_years():
+    """Drop the stored matrices and year index so they are computed again"""
+    from admin import get_db_connection, ensure_table
+    
+    if not ensure_table('analytics_years', ANALYTICS_YEARS_DDL):
+        return False
+    
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM analytics_years")
+        conn.commit()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Clear analytics years error: {e}")
+        conn.close()
+        return False
+    
+    _closed_years.clear()
+    _indexed_through['year'] = None
+    return True
@@ -0,0 +1,437 @@
+"""Server-side clustering of report points for the maps.
+
+One ReportClusterIndex per process holds every mapped report in a cluster
+tree, supercluster style: at the highest zoom a point joins the nearest
+cluster within CLUSTER_RADIUS pixels or starts a new one, and each new
+cluster is in turn placed in the nearest cluster one zoom lower. Clusters
+nest, so expanding one yields exactly its own reports. Each level keeps a
+grid hash of cluster centroids (cell size = cluster radius), so a
+neighbour search only looks at the 3x3 cells around a point.
+
+A full build inserts reports in id order; afterwards the index follows the
+report_changes log and inserts, updates or removes only the reports that
+changed, so a new report costs one neighbour search per zoom level instead
+of a rebuild.
+"""
+import math
+import threading
+import time
+
+import change_feed
+import report_events
+from admin import get_db_connection, ensure_table
+
+CLUSTER_MIN_ZOOM = 0
+# Above this zoom the index returns individual reports
+CLUSTER_MAX_ZOOM = 16
+# Cluster radius in screen pixels, measured on 256px map tiles
+CLUSTER_RADIUS = 50
+CLUSTER_EXTENT = 256
+# How often a process checks the change log for reports it has not seen
+CLUSTER_SYNC_SECONDS = 2
+# Cluster ids carry their zoom in the low bits
+ZOOM_BITS = 5
+
+def project(lat, lng):
+    """Web mercator position of a point, scaled to [0, 1]"""
+    sin_lat = math.sin(math.radians(max(min(lat, 85.0511), -85.0511)))
+    x = lng / 360.0 + 0.5
+    y = 0.5 - 0.25 * math.log((1 + sin_lat) / (1 - sin_lat)) / math.pi
+    return x, y
+
+def unproject(x, y):
+    """Inverse of project(): return (lat, lng)"""
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+    return lat, (x - 0.5) * 360.0
+
+def is_active(status):
+    return status != 'resolved'
+
+class ClusterLevel:
+    """The clusters of one zoom level and the grid hash over their centroids"""
+    
+    def __init__(self, zoom):
+        self.zoom = zoom
+        self.radius = CLUSTER_RADIUS / (CLUSTER_EXTENT * 2 ** zoom)
+        self.clusters = {}
+        self.grid = {}
+    
+    def cell(self, x, y):
+        return int(x / self.radius), int(y / self.radius)
+    
+    def nearest(self, x, y):
+        """Return the cluster whose centroid is nearest to (x, y) within the radius"""
+        cx, cy = self.cell(x, y)
+        best, best_dist = None, self.radius * self.radius
+        
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for cluster_id in self.grid.get((gx, gy), ()):
+                    cluster = self.clusters[cluster_id]
+                    dx = cluster['x'] - x
+                    dy = cluster['y'] - y
+                    dist = dx * dx + dy * dy
+                    if dist <= best_dist:
+                        best, best_dist = cluster, dist
+        return best
+    
+    def place(self, cluster):
+        """Move a cluster to the grid cell of its (possibly shifted) centroid"""
+        cell = self.cell(cluster['x'], cluster['y'])
+        if cell == cluster['cell']:
+            return
+        
+        if cluster['cell'] is not None:
+            ids = self.grid[cluster['cell']]
+            ids.discard(cluster['id'])
+            if not ids:
+                del self.grid[cluster['cell']]
+        self.grid.setdefault(cell, set()).add(cluster['id'])
+        cluster['cell'] = cell
+    
+    def drop(self, cluster):
+        ids = self.grid[cluster['cell']]
+        ids.discard(cluster['id'])
+        if not ids:
+            del self.grid[cluster['cell']]
+        del self.clusters[cluster['id']]
+    
+    def within(self, west_x, north_y, east_x, south_y):
+        """Yield the clusters whose centroid lies inside a projected box"""
+        x0, y0 = self.cell(west_x, north_y)
+        x1, y1 = self.cell(east_x, south_y)
+        
+        # Walk the grid for small views, the cluster list for large ones
+        if (x1 - x0 + 1) * (y1 - y0 + 1) < len(self.clusters):
+            candidates = (
+                self.clusters[cluster_id]
+                for gx in range(x0, x1 + 1)
+                for gy in range(y0, y1 + 1)
+                for cluster_id in self.grid.get((gx, gy), ())
+            )
+        else:
+            candidates = self.clusters.values()
+        
+        for cluster in candidates:
+            if west_x <= cluster['x'] <= east_x and north_y <= cluster['y'] <= south_y:
+                yield cluster
+
+class ReportClusterIndex:
+    """Hierarchical clusters of every mapped report, shared by all viewers"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.levels = [ClusterLevel(z) for z in range(CLUSTER_MIN_ZOOM, CLUSTER_MAX_ZOOM + 1)]
+        self.points = {}
+        self.next_id = 0
+        self.cursor = None
+        self.last_sync = 0.0
+    
+    def level(self, zoom):
+        return self.levels[zoom - CLUSTER_MIN_ZOOM]
+    
+    def new_cluster(self, level, x, y):
+        self.next_id += 1
+        cluster = {
+            'id': (self.next_id << ZOOM_BITS) | level.zoom,
+            'x_sum': 0.0,
+            'y_sum': 0.0,
+            'x': x,
+            'y': y,
+            'cell': None,
+            'count': 0,
+            'active': 0,
+            'types': {},
+            'members': set(),
+            'parent': None,
+            'children': set()
+        }
+        level.clusters[cluster['id']] = cluster
+        return cluster
+    
+    def insert(self, report):
+        x, y = project(report['latitude'], report['longitude'])
+        point = {
+            'id': report['id'],
+            'x': x,
+            'y': y,
+            'latitude': report['latitude'],
+            'longitude': report['longitude'],
+            'emergency_type': report['emergency_type'],
+            'status': report['status'],
+            'clusters': {}
+        }
+        self.points[point['id']] = point
+        
+        child, child_is_new = None, True
+        for level in reversed(self.levels):
+            # Once the point lands in an existing cluster, the lower levels follow its parents
+            if child_is_new:
+                cluster = level.nearest(x, y)
+                is_new = cluster is None
+                if is_new:
+                    cluster = self.new_cluster(level, x, y)
+                if child is not None:
+                    child['parent'] = cluster['id']
+                    cluster['children'].add(child['id'])
+            else:
+                cluster = level.clusters[child['parent']]
+                is_new = False
+            
+            cluster['members'].add(point['id'])
+            cluster['count'] += 1
+            cluster['x_sum'] += x
+            cluster['y_sum'] += y
+            cluster['x'] = cluster['x_sum'] / cluster['count']
+            cluster['y'] = cluster['y_sum'] / cluster['count']
+            if is_active(point['status']):
+                cluster['active'] += 1
+            cluster['types'][point['emergency_type']] = cluster['types'].get(point['emergency_type'], 0) + 1
+            level.place(cluster)
+            point['clusters'][level.zoom] = cluster['id']
+            child, child_is_new = cluster, is_new
+    
+    def remove(self, report_id):
+        point = self.points.pop(report_id, None)
+        if point is None:
+            return
+        
+        for zoom, cluster_id in point['clusters'].items():
+            level = self.level(zoom)
+            cluster = level.clusters[cluster_id]
+            cluster['members'].discard(report_id)
+            cluster['count'] -= 1
+            if cluster['count'] == 0:
+                level.drop(cluster)
+                if cluster['parent'] is not None:
+                    parent = self.level(zoom - 1).clusters.get(cluster['parent'])
+                    if parent:
+                        parent['children'].discard(cluster_id)
+                continue
+            
+            cluster['x_sum'] -= point['x']
+            cluster['y_sum'] -= point['y']
+            cluster['x'] = cluster['x_sum'] / cluster['count']
+            cluster['y'] = cluster['y_sum'] / cluster['count']
+            if is_active(point['status']):
+                cluster['active'] -= 1
+            cluster['types'][point['emergency_type']] -= 1
+            if not cluster['types'][point['emergency_type']]:
+                del cluster['types'][point['emergency_type']]
+            level.place(cluster)
+    
+    def upsert(self, report):
+        """Apply a report row; repeated calls with the same row change nothing"""
+        point = self.points.get(report['id'])
+        if point is None:
+            self.insert(report)
+            return
+        
+        if point['latitude'] != report['latitude'] or point['longitude'] != report['longitude'] \
+                or point['emergency_type'] != report['emergency_type']:
+            self.remove(report['id'])
+            self.insert(report)
+            return
+        
+        if is_active(point['status']) != is_active(report['status']):
+            delta = 1 if is_active(report['status']) else -1
+            for zoom, cluster_id in point['clusters'].items():
+                self.level(zoom).clusters[cluster_id]['active'] += delta
+        point['status'] = report['status']
+    
+    def point_feature(self, point):
+        return {
+            'id': point['id'],
+            'cluster': False,
+            'emergency_type': point['emergency_type'],
+            'status': point['status'],
+            'latitude': point['latitude'],
+            'longitude': point['longitude']
+        }
+    
+    def cluster_feature(self, cluster, emergency_type=None):
+        """Feature for a cluster, or for its only report when it holds just one"""
+        if emergency_type:
+            count = cluster['types'].get(emergency_type, 0)
+        else:
+            count = cluster['count']
+        if count == 0:
+            return None
+        
+        if count == 1:
+            for report_id in cluster['members']:
+                point = self.points[report_id]
+                if not emergency_type or point['emergency_type'] == emergency_type:
+                    return self.point_feature(point)
+        
+        lat, lng = unproject(cluster['x'], cluster['y'])
+        return {
+            'id': cluster['id'],
+            'cluster': True,
+            'count': count,
+            'active': cluster['active'],
+            'types': cluster['types'],
+            'latitude': round(lat, 6),
+            'longitude': round(lng, 6)
+        }
+    
+    def query(self, window, zoom, emergency_type=None):
+        """Clusters and single reports inside a map window at a zoom level"""
+        if emergency_type == 'all':
+            emergency_type = None
+        west_x, north_y = project(window['north'], window['west'])
+        east_x, south_y = project(window['south'], window['east'])
+        
+        with self.lock:
+            if zoom > CLUSTER_MAX_ZOOM:
+                # Past the last cluster level every report is drawn on its own
+                features = []
+                for cluster in self.level(CLUSTER_MAX_ZOOM).within(west_x, north_y, east_x, south_y):
+                    for report_id in cluster['members']:
+                        point = self.points[report_id]
+                        if emergency_type and point['emergency_type'] != emergency_type:
+                            continue
+                        features.append(self.point_feature(point))
+                return features
+            
+            level = self.level(max(zoom, CLUSTER_MIN_ZOOM))
+            features = [
+                self.cluster_feature(cluster, emergency_type)
+                for cluster in level.within(west_x, north_y, east_x, south_y)
+            ]
+            return [feature for feature in features if feature]
+    
+    def expand(self, cluster_id, emergency_type=None):
+        """Return (expansion_zoom, children) for a cluster, or None if it no longer exists.
+        
+        children are the features the cluster splits into at the next zoom;
+        expansion_zoom is the first zoom at which it splits at all, so a
+        click can jump straight there.
+        """
+        if emergency_type == 'all':
+            emergency_type = None
+        zoom = cluster_id & ((1 << ZOOM_BITS) - 1)
+        
+        with self.lock:
+            if not CLUSTER_MIN_ZOOM <= zoom <= CLUSTER_MAX_ZOOM:
+                return None
+            cluster = self.level(zoom).clusters.get(cluster_id)
+            if cluster is None:
+                return None
+            
+            def matches(child):
+                return not emergency_type or child['types'].get(emergency_type, 0) > 0
+            
+            # Follow single-child chains down to the first zoom where the cluster splits
+            expansion_zoom = CLUSTER_MAX_ZOOM + 1
+            current = cluster
+            for child_zoom in range(zoom + 1, CLUSTER_MAX_ZOOM + 1):
+                child_level = self.level(child_zoom)
+                kids = [child_level.clusters[child_id] for child_id in current['children']]
+                kids = [child for child in kids if matches(child)]
+                if len(kids) != 1:
+                    expansion_zoom = child_zoom
+                    break
+                current = kids[0]
+            
+            if zoom == CLUSTER_MAX_ZOOM:
+                children = [
+                    self.point_feature(self.points[report_id]) for report_id in cluster['members']
+                    if not emergency_type or self.points[report_id]['emergency_type'] == emergency_type
+                ]
+            else:
+                child_level = self.level(zoom + 1)
+                children = [
+                    self.cluster_feature(child_level.clusters[child_id], emergency_type)
+                    for child_id in cluster['children']
+                ]
+            return expansion_zoom, [child for child in children if child]
+    
+    def sync(self):
+        """Bring the index up to date with the change log (at most every few seconds).
+        
+        The first call builds the index from emergency_reports. Returns False
+        if the database or the change log is unavailable.
+        """
+        with self.lock:
+            if self.cursor is not None and time.monotonic() - self.last_sync < CLUSTER_SYNC_SECONDS:
+                return True
+            
+            if not ensure_table('report_changes', report_events.REPORT_CHANGES_DDL):
+                return False
+            
+            conn = get_db_connection()
+            if not conn:
+                return False
+            
+            try:
+                cur = conn.cursor(dictionary=True)
+                
+                if self.cursor is None:
+                    # Take the cursor first so reports committed during the build are replayed
+                    cursor = change_feed.committed_seq(cur, None)
+                    
+                    for report in self.fetch_reports(cur):
+                        self.insert(report)
+                else:
+                    cur.execute("""
+                        SELECT report_id, MAX(seq) as last_seq
+                        FROM report_changes
+                        WHERE seq > %s
+                        GROUP BY report_id
+                    """, (self.cursor,))
+                    changes = cur.fetchall()
+                    # Changes past a gap are applied now and again once the gap closes
+                    cursor = change_feed.committed_seq(cur, self.cursor)
+                    
+                    if changes:
+                        report_ids = [row['report_id'] for row in changes]
+                        reports = {report['id']: report for report in self.fetch_reports(cur, report_ids)}
+                        for report_id in report_ids:
+                            if report_id in reports:
+                                self.upsert(reports[report_id])
+                            else:
+                                self.remove(report_id)
+                
+                cur.close()
+                conn.close()
+                
+                self.cursor = cursor
+                self.last_sync = time.monotonic()
+                return True
+            
+            except Exception as e:
+                print(f"Cluster index sync error: {e}")
+                conn.close()
+                return False
+    
+    def fetch_reports(self, cur, report_ids=None):
+        """Mapped reports in id order, optionally only the given ids"""
+        query = """
+            SELECT id, emergency_type, status, latitude, longitude
+            FROM emergency_reports
+            WHERE latitude != 0
+            AND longitude != 0
+        """
+        params = []
+        if report_ids is not None:
+            query += f" AND id IN ({', '.join(['%s'] * len(report_ids))})"
+            params = report_ids
+        cur.execute(query + " ORDER BY id", params)
+        
+        reports = []
+        for row in cur.fetchall():
+            try:
+                row['latitude'] = float(row['latitude'])
+                row['longitude'] = float(row['longitude'])
+            except (TypeError, ValueError):
+                continue
+            reports.append(row)
+        return reports
+
+cluster_index = ReportClusterIndex()
+
+@report_events.subscribe
+def refresh_cluster_index(event):
+    """Pick up this process's own changes on the next query instead of waiting"""
+    cluster_index.last_sync = 0.0
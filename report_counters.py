@@ -0,0 +1,177 @@
+"""Live report counts per status and emergency type.
+
+report_status_counters has one row per (status, emergency type). A
+transactional report listener adjusts it with every new report and status
+transition, so dashboard badges and totals are a read of a few rows instead
+of a COUNT/SUM over emergency_reports. The counters are reconciled against
+the reports every COUNTERS_RECONCILE_SECONDS in the background, which
+repairs any drift (reports changed outside the app, a failed listener).
+"""
+import threading
+import time
+
+import report_events
+
+COUNTERS_RECONCILE_SECONDS = 900
+COUNTER_STATUSES = ('pending', 'in_progress', 'resolved')
+
+REPORT_STATUS_COUNTERS_DDL = """
+    CREATE TABLE IF NOT EXISTS report_status_counters (
+        status VARCHAR(20) NOT NULL,
+        emergency_type VARCHAR(50) NOT NULL,
+        count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (status, emergency_type)
+    )
+"""
+
+_counters_ready = False
+_reconcile = {'last': 0.0, 'running': False}
+_reconcile_lock = threading.Lock()
+
+def reconcile_status_counters():
+    """Recount report_status_counters from emergency_reports. Returns the number of rows.
+    
+    Locks every counter row (and the gaps between them) first, so report
+    transactions that would change a counter wait until the recount is
+    written instead of being overwritten by it. The reports themselves are
+    read without locks.
+    """
+    from admin import get_db_connection, ensure_table
+    
+    if not ensure_table('report_status_counters', REPORT_STATUS_COUNTERS_DDL):
+        return None
+    
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT status, emergency_type FROM report_status_counters FOR UPDATE")
+        cur.fetchall()
+        cur.execute("""
+            SELECT status, COALESCE(emergency_type, ''), COUNT(*)
+            FROM emergency_reports
+            GROUP BY status, emergency_type
+        """)
+        counts = cur.fetchall()
+        
+        cur.execute("DELETE FROM report_status_counters")
+        if counts:
+            cur.executemany("""
+                INSERT INTO report_status_counters (status, emergency_type, count)
+                VALUES (%s, %s, %s)
+            """, counts)
+        conn.commit()
+        cur.close()
+        conn.close()
+        _reconcile['last'] = time.monotonic()
+        return len(counts)
+    except Exception as e:
+        print(f"Reconcile status counters error: {e}")
+        conn.rollback()
+        conn.close()
+        return None
+
+def ensure_status_counters(build=False):
+    """Return True once report_status_counters exists and has been counted.
+    
+    Same contract as ensure_report_cube: listeners pass build=False.
+    """
+    global _counters_ready
+    from admin import get_db_connection, ensure_table
+    
+    if not ensure_table('report_status_counters', REPORT_STATUS_COUNTERS_DDL):
+        return False
+    if _counters_ready:
+        return True
+    
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM report_status_counters LIMIT 1")
+        empty = cur.fetchone() is None
+        cur.execute("SELECT 1 FROM emergency_reports LIMIT 1")
+        has_reports = cur.fetchone() is not None
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Check status counters error: {e}")
+        conn.close()
+        return False
+    
+    if empty and has_reports:
+        if not build or reconcile_status_counters() is None:
+            return False
+    _counters_ready = True
+    return True
+
+def add_to_counter(cur, status, emergency_type, delta):
+    cur.execute("""
+        INSERT INTO report_status_counters (status, emergency_type, count)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+    """, (status, emergency_type or '', delta))
+
+@report_events.subscribe(transactional=True)
+def update_status_counters(cur, event):
+    if not ensure_status_counters():
+        return
+    
+    if event['kind'] == 'created':
+        add_to_counter(cur, event['new_status'], event['emergency_type'], 1)
+    elif event['old_status'] != event['new_status']:
+        add_to_counter(cur, event['old_status'], event['emergency_type'], -1)
+        add_to_counter(cur, event['new_status'], event['emergency_type'], 1)
+
+def schedule_reconcile():
+    """Start a background reconcile if the last one is older than COUNTERS_RECONCILE_SECONDS"""
+    with _reconcile_lock:
+        if _reconcile['running'] or time.monotonic() - _reconcile['last'] < COUNTERS_RECONCILE_SECONDS:
+            return
+        _reconcile['running'] = True
+    
+    def run():
+        try:
+            reconcile_status_counters()
+        finally:
+            # A failed reconcile also waits out the interval before retrying
+            _reconcile['last'] = time.monotonic()
+            _reconcile['running'] = False
+    
+    threading.Thread(target=run, daemon=True).start()
+
+def status_counts(cur):
+    """Report totals as {'total_reports', 'pending_reports', ..., 'by_type': {type: count}}.
+    
+    Read from the counters; counts emergency_reports directly only while
+    the counters are unavailable.
+    """
+    if ensure_status_counters(build=True):
+        cur.execute("SELECT status, emergency_type, count FROM report_status_counters WHERE count != 0")
+        schedule_reconcile()
+    else:
+        cur.execute("""
+            SELECT status, COALESCE(emergency_type, '') as emergency_type, COUNT(*) as count
+            FROM emergency_reports
+            GROUP BY status, emergency_type
+        """)
+    rows = cur.fetchall()
+    
+    stats = {'total_reports': 0, 'by_type': {}}
+    stats.update({f"{status}_reports": 0 for status in COUNTER_STATUSES})
+    for row in rows:
+        status, emergency_type, count = (
+            (row['status'], row['emergency_type'], row['count'])
+            if isinstance(row, dict) else row
+        )
+        count = int(count)
+        stats['total_reports'] += count
+        if status in COUNTER_STATUSES:
+            stats[f"{status}_reports"] += count
+        stats['by_type'][emergency_type] = stats['by_type'].get(emergency_type, 0) + count
+    
+    return stats
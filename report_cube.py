@@ -0,0 +1,179 @@
+"""Hour x grid cell x type x status counts of reports, for map playback.
+
+report_cube holds one row per (hour the report was created, grid cell,
+emergency type, current status). A transactional report listener keeps it
+current: a new report adds one to its bucket, a status change moves one
+from the old status to the new. Cells are computed by the same SQL
+expression in the listener and in the rebuild, so both always agree.
+"""
+import report_events
+from admin import get_db_connection, ensure_table, TIGBAUAN_BOUNDS
+
+CUBE_BOUNDS = TIGBAUAN_BOUNDS
+# Cells per side (about 350 m over Tigbauan); cell = row * CUBE_GRID + col, row 0 in the north
+CUBE_GRID = 64
+
+REPORT_CUBE_DDL = """
+    CREATE TABLE IF NOT EXISTS report_cube (
+        hour DATETIME NOT NULL,
+        cell SMALLINT UNSIGNED NOT NULL,
+        emergency_type VARCHAR(50) NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, cell, emergency_type, status)
+    )
+"""
+
+# Bucket columns for rows of emergency_reports; %s placeholders are filled by CUBE_PARAMS
+CUBE_BUCKET_SQL = """
+    DATE_FORMAT(created_at, '%Y-%m-%d %H:00:00') as hour,
+    LEAST(%s - 1, FLOOR((%s - latitude) / %s * %s)) * %s
+        + LEAST(%s - 1, FLOOR((longitude - %s) / %s * %s)) as cell
+"""
+CUBE_PARAMS = (
+    CUBE_GRID, CUBE_BOUNDS['north'], CUBE_BOUNDS['north'] - CUBE_BOUNDS['south'], CUBE_GRID, CUBE_GRID,
+    CUBE_GRID, CUBE_BOUNDS['west'], CUBE_BOUNDS['east'] - CUBE_BOUNDS['west'], CUBE_GRID
+)
+CUBE_WHERE_SQL = """
+    latitude BETWEEN %s AND %s
+    AND longitude BETWEEN %s AND %s
+    AND created_at IS NOT NULL
+"""
+CUBE_WHERE_PARAMS = (CUBE_BOUNDS['south'], CUBE_BOUNDS['north'], CUBE_BOUNDS['west'], CUBE_BOUNDS['east'])
+
+_cube_ready = False
+
+def cell_center(cell):
+    """Return (lat, lng) of the centre of a cube cell"""
+    row, col = divmod(cell, CUBE_GRID)
+    lat = CUBE_BOUNDS['north'] - (row + 0.5) * (CUBE_BOUNDS['north'] - CUBE_BOUNDS['south']) / CUBE_GRID
+    lng = CUBE_BOUNDS['west'] + (col + 0.5) * (CUBE_BOUNDS['east'] - CUBE_BOUNDS['west']) / CUBE_GRID
+    return round(lat, 6), round(lng, 6)
+
+def rebuild_report_cube():
+    """Recount report_cube from emergency_reports. Returns the number of buckets.
+    
+    Reads the reports with shared locks, like rebuild_daily_rollup, so no
+    report change can land between the count and the new buckets; report
+    writes wait for the rebuild to commit.
+    """
+    if not ensure_table('report_cube', REPORT_CUBE_DDL):
+        return None
+    
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {CUBE_BUCKET_SQL}, emergency_type, status, COUNT(*)
+            FROM emergency_reports
+            WHERE {CUBE_WHERE_SQL}
+            GROUP BY hour, cell, emergency_type, status
+            LOCK IN SHARE MODE
+        """, CUBE_PARAMS + CUBE_WHERE_PARAMS)
+        buckets = cur.fetchall()
+        
+        cur.execute("DELETE FROM report_cube")
+        for start in range(0, len(buckets), 1000):
+            cur.executemany("""
+                INSERT INTO report_cube (hour, cell, emergency_type, status, count)
+                VALUES (%s, %s, %s, %s, %s)
+            """, buckets[start:start + 1000])
+        conn.commit()
+        cur.close()
+        conn.close()
+        return len(buckets)
+    except Exception as e:
+        print(f"Rebuild report cube error: {e}")
+        conn.close()
+        return None
+
+def ensure_report_cube(build=False):
+    """Return True once report_cube exists and holds every report.
+    
+    An empty cube while reports exist has never been built; with build=True
+    it is filled now, otherwise False is returned. Report listeners pass
+    build=False, since they run inside a report's transaction.
+    """
+    global _cube_ready
+    if not ensure_table('report_cube', REPORT_CUBE_DDL):
+        return False
+    if _cube_ready:
+        return True
+    
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM report_cube LIMIT 1")
+        empty = cur.fetchone() is None
+        cur.execute("SELECT 1 FROM emergency_reports LIMIT 1")
+        has_reports = cur.fetchone() is not None
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Check report cube error: {e}")
+        conn.close()
+        return False
+    
+    if empty and has_reports:
+        if not build or rebuild_report_cube() is None:
+            return False
+    _cube_ready = True
+    return True
+
+def add_to_cube(cur, report_id, status, delta):
+    cur.execute(f"""
+        INSERT INTO report_cube (hour, cell, emergency_type, status, count)
+        SELECT {CUBE_BUCKET_SQL}, emergency_type, %s, %s
+        FROM emergency_reports
+        WHERE id = %s AND {CUBE_WHERE_SQL}
+        ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+    """, CUBE_PARAMS + (status, delta, report_id) + CUBE_WHERE_PARAMS)
+
+@report_events.subscribe(transactional=True)
+def update_report_cube(cur, event):
+    if not ensure_report_cube():
+        return
+    
+    if event['kind'] == 'created':
+        add_to_cube(cur, event['report_id'], event['new_status'], 1)
+    elif event['old_status'] != event['new_status']:
+        add_to_cube(cur, event['report_id'], event['old_status'], -1)
+        add_to_cube(cur, event['report_id'], event['new_status'], 1)
+
+def cube_frames(cur, since, until, emergency_type=None, status=None, step='hour'):
+    """Non-empty cells per time bucket between since and until, oldest first.
+    
+    Returns a list of {'time': bucket start, 'cells': [[cell, count], ...]}.
+    """
+    bucket = "hour" if step == 'hour' else "DATE(hour)"
+    conditions = ["hour >= %s", "hour < %s"]
+    params = [since, until]
+    
+    if emergency_type:
+        conditions.append("emergency_type = %s")
+        params.append(emergency_type)
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    
+    cur.execute(f"""
+        SELECT {bucket} as bucket, cell, SUM(count) as count
+        FROM report_cube
+        WHERE {' AND '.join(conditions)}
+        GROUP BY bucket, cell
+        HAVING SUM(count) > 0
+        ORDER BY bucket, cell
+    """, params)
+    
+    frames = []
+    for row in cur.fetchall():
+        if not frames or frames[-1]['time'] != row['bucket']:
+            frames.append({'time': row['bucket'], 'cells': []})
+        frames[-1]['cells'].append([row['cell'], int(row['count'])])
+    return frames
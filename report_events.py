@@ -0,0 +1,119 @@
+"""Report lifecycle hooks.
+
+Routes that create a report or change its status call record() with their
+open cursor before committing, then publish() once the commit succeeded.
+record() appends the change to the report_changes log (a monotonically
+increasing sequence that map clients poll for deltas) and runs listeners
+that must stay in the same transaction; publish() notifies caches and other
+derived data so they can update without rescanning emergency_reports.
+
+Each step of record() runs inside a savepoint, so a failing listener only
+undoes its own writes and the report still commits. Errors that have
+already rolled back the whole transaction (a deadlock, a lost connection)
+are raised instead, so the route reports the failure and the user can
+retry rather than being told a lost report was saved.
+"""
+from datetime import datetime
+
+REPORT_CHANGES_DDL = """
+    CREATE TABLE IF NOT EXISTS report_changes (
+        seq BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        report_id INT NOT NULL,
+        change_type VARCHAR(20) NOT NULL,
+        changed_at DATETIME NOT NULL,
+        INDEX idx_report_changes_report (report_id),
+        INDEX idx_report_changes_time (changed_at)
+    )
+"""
+
+# Deadlock, lock wait timeout, server gone away, lost connection (client side)
+TRANSACTION_ABORTING_ERRNOS = (1213, 1205, 2006, 2013, 2055)
+
+_listeners = []
+_transactional_listeners = []
+
+def subscribe(listener=None, transactional=False):
+    """Register a listener (usable as @subscribe or @subscribe(transactional=True)).
+    
+    Regular listeners are called with the event after commit. Transactional
+    listeners are called with (cur, event) inside the report's transaction.
+    """
+    def register(func):
+        if transactional:
+            _transactional_listeners.append(func)
+        else:
+            _listeners.append(func)
+        return func
+    
+    if listener is not None:
+        return register(listener)
+    return register
+
+def report_event(kind, report, old_status=None):
+    """Build an event dict from a report row.
+    
+    kind is 'created' or 'status_changed'; report must carry id, latitude,
+    longitude, emergency_type, status and user_id.
+    """
+    try:
+        latitude = float(report.get('latitude') or 0)
+        longitude = float(report.get('longitude') or 0)
+    except (TypeError, ValueError):
+        latitude = longitude = 0.0
+    
+    return {
+        'kind': kind,
+        'report_id': report.get('id'),
+        'user_id': report.get('user_id'),
+        'emergency_type': report.get('emergency_type'),
+        'latitude': latitude,
+        'longitude': longitude,
+        'old_status': old_status,
+        'new_status': report.get('status'),
+        'changed_at': datetime.now()
+    }
+
+def in_savepoint(cur, name, step, *args):
+    """Run step(*args) so that a failure rolls back only its own writes.
+    
+    Errors that aborted the transaction are raised; others are printed.
+    """
+    cur.execute(f"SAVEPOINT {name}")
+    try:
+        step(*args)
+    except Exception as e:
+        if getattr(e, 'errno', None) in TRANSACTION_ABORTING_ERRNOS:
+            raise
+        print(f"Report event error ({name}): {e}")
+        cur.execute(f"ROLLBACK TO SAVEPOINT {name}")
+    else:
+        cur.execute(f"RELEASE SAVEPOINT {name}")
+
+def log_change(cur, event):
+    from admin import ensure_table
+    
+    if ensure_table('report_changes', REPORT_CHANGES_DDL):
+        cur.execute("""
+            INSERT INTO report_changes (report_id, change_type, changed_at)
+            VALUES (%s, %s, %s)
+        """, (event['report_id'], event['kind'], event['changed_at']))
+
+def record(cur, event):
+    """Log a change inside the report's transaction (call before commit).
+    
+    A failing listener is rolled back to its savepoint and printed: a
+    report must never be lost because derived data could not be updated.
+    Errors that already aborted the transaction propagate to the route.
+    """
+    in_savepoint(cur, 'report_change_log', log_change, cur, event)
+    
+    for listener in _transactional_listeners:
+        in_savepoint(cur, f"report_listener_{listener.__name__}", listener, cur, event)
+
+def publish(event):
+    """Notify subscribers of a committed report change"""
+    for listener in _listeners:
+        try:
+            listener(event)
+        except Exception as e:
+            print(f"Report event listener error ({listener.__name__}): {e}")
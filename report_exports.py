@@ -0,0 +1,295 @@
+"""Streaming exports in CSV, NDJSON, Parquet and Arrow.
+
+Exports are written while they are read: the query runs on an unbuffered
+cursor, rows are fetched EXPORT_CHUNK_ROWS at a time, and every chunk is
+encoded (CSV and NDJSON gzip-compressed on the fly if asked for) and sent
+before the next one is fetched. Memory stays at about one chunk whatever the
+size of the table, and the download starts as soon as the first rows arrive.
+
+Parquet and Arrow (IPC stream) exports keep their column types: ids and
+counts as integers, coordinates as floats, report times as timestamps, and
+emergency type and status dictionary-encoded. They are written in record
+batches of EXPORT_BATCH_ROWS rows, each flushed to the client as it is
+done. Both need pyarrow; without it only CSV and NDJSON are offered.
+"""
+import csv
+import io
+import json
+import zlib
+
+from flask import Response
+
+import report_search
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_BATCH_ROWS = 50000
+EXPORT_GZIP_LEVEL = 6
+
+# format: (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows')
+}
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+
+REPORT_EXPORT_SELECT = """
+    SELECT
+        er.id,
+        er.emergency_type,
+        er.status,
+        er.latitude,
+        er.longitude,
+        er.location,
+        er.description,
+        er.created_at,
+        CONCAT(COALESCE(u.fname, ''), ' ', COALESCE(u.lname, '')) as user_name,
+        u.phone_num
+    FROM emergency_reports er
+    LEFT JOIN users u ON er.user_id = u.id
+"""
+
+HEATMAP_EXPORT_SQL = REPORT_EXPORT_SELECT + """
+    WHERE er.latitude IS NOT NULL
+    AND er.longitude IS NOT NULL
+    AND er.latitude != 0
+    AND er.longitude != 0
+    ORDER BY er.created_at DESC
+"""
+
+HEATMAP_EXPORT_HEADER = [
+    'ID', 'Emergency Type', 'Status', 'Latitude', 'Longitude',
+    'Location', 'Description', 'Created At', 'User Name', 'Phone Number'
+]
+
+def heatmap_export_row(report):
+    return [
+        report['id'],
+        report['emergency_type'],
+        report['status'],
+        report['latitude'],
+        report['longitude'],
+        report['location'] or '',
+        report['description'] or '',
+        report['created_at'].strftime('%Y-%m-%d %H:%M:%S') if report['created_at'] else '',
+        report['user_name'].strip() if report['user_name'] else 'Anonymous',
+        report['phone_num'] or ''
+    ]
+
+def report_export_record(report):
+    """A report row with typed values for NDJSON, Parquet and Arrow exports"""
+    user_name = report['user_name'].strip() if report['user_name'] else ''
+    return {
+        'id': report['id'],
+        'emergency_type': report['emergency_type'],
+        'status': report['status'],
+        'latitude': float(report['latitude']) if report['latitude'] is not None else None,
+        'longitude': float(report['longitude']) if report['longitude'] is not None else None,
+        'location': report['location'],
+        'description': report['description'],
+        'created_at': report['created_at'],
+        'user_name': user_name or None,
+        'phone_num': report['phone_num']
+    }
+
+def report_export_schema():
+    category = pa.dictionary(pa.int16(), pa.string())
+    return pa.schema([
+        ('id', pa.int32()),
+        ('emergency_type', category),
+        ('status', category),
+        ('latitude', pa.float64()),
+        ('longitude', pa.float64()),
+        ('location', pa.string()),
+        ('description', pa.string()),
+        ('created_at', pa.timestamp('s')),
+        ('user_name', pa.string()),
+        ('phone_num', pa.string())
+    ])
+
+def chart_export_schema(header):
+    """Chart export columns: a label (month or barangay), then counts"""
+    return pa.schema([(header[0], pa.string())] + [(name, pa.int64()) for name in header[1:]])
+
+def format_available(fmt):
+    return fmt in EXPORT_FORMATS and (fmt not in COLUMNAR_FORMATS or pa is not None)
+
+def export_filename(filename, fmt):
+    """filename (a .csv name) with the extension of an export format"""
+    return f"{filename.rsplit('.', 1)[0]}.{EXPORT_FORMATS[fmt][1]}"
+
+def filtered_reports_query(filters):
+    """(sql, params) exporting the reports matching report search filters, newest first"""
+    from admin import BARANGAY_CASE_SQL
+    
+    q = (filters.get('q') or '').strip()
+    conditions, params = report_search.text_conditions(q) if q else ([], [])
+    more_conditions, more_params = report_search.filter_conditions(filters, BARANGAY_CASE_SQL)
+    conditions = ["created_at IS NOT NULL"] + conditions + more_conditions
+    
+    # The filters name emergency_reports columns unqualified, so filter before the join
+    sql = REPORT_EXPORT_SELECT.replace(
+        "FROM emergency_reports er",
+        f"FROM (SELECT * FROM emergency_reports WHERE {' AND '.join(conditions)}) er"
+    ) + """
+    ORDER BY er.created_at DESC
+"""
+    return sql, params + more_params
+
+def cursor_rows(conn, cur, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Rows of a query executed on an unbuffered cursor, fetched a chunk at a time.
+    
+    Closes the connection once the rows are read or the reader stops early
+    (a cancelled download). A read error is raised, not turned into the end
+    of the rows, so a download is aborted and a job fails instead of
+    delivering a well-formed but truncated file.
+    """
+    try:
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        # Closing the connection also drops the rows an aborted export left unread
+        conn.close()
+
+def csv_chunks(header, rows, chunk_rows=EXPORT_CHUNK_ROWS):
+    """UTF-8 CSV of header and rows, yielded every chunk_rows rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    pending = 0
+    
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode('utf-8')
+
+def gzip_chunks(chunks, level=EXPORT_GZIP_LEVEL):
+    """Compress a stream of byte chunks into one gzip stream"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def ndjson_chunks(records, chunk_rows=EXPORT_CHUNK_ROWS):
+    """One JSON object per line, yielded every chunk_rows records"""
+    lines = []
+    for record in records:
+        lines.append(json.dumps(record, default=lambda value: value.isoformat() if hasattr(value, 'isoformat') else str(value)))
+        if len(lines) >= chunk_rows:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+def record_batches(records, schema=None, batch_rows=EXPORT_BATCH_ROWS):
+    """Arrow record batches of batch_rows records (schema inferred from the first batch if not given)"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_rows:
+            yield pa.RecordBatch.from_pylist(batch, schema=schema)
+            batch = []
+    if batch or schema is not None:
+        yield pa.RecordBatch.from_pylist(batch, schema=schema)
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file collecting what pyarrow writes until it is drained"""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self):
+        # Parquet records offsets in its footer, so this counts everything ever written
+        return self.position
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def columnar_chunks(fmt, batches):
+    """Parquet file or Arrow IPC stream of record batches, yielded batch by batch"""
+    batches = iter(batches)
+    first = next(batches, None)
+    if first is None:
+        # A 0-byte file is not a valid Parquet or Arrow file; record_batches
+        # yields an empty batch whenever it has a schema
+        raise ValueError('An empty columnar export needs a schema')
+    
+    sink = ChunkSink()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), first.schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode='w'), first.schema,
+                                   options=pa.ipc.IpcWriteOptions(compression='zstd'))
+    
+    batch = first
+    while batch is not None:
+        writer.write_batch(batch)
+        yield sink.drain()
+        batch = next(batches, None)
+    writer.close()
+    yield sink.drain()
+
+def encode_export(fmt, header, rows, csv_row=None, typed_record=None, schema=None):
+    """Byte chunks of rows in an export format.
+    
+    CSV writes csv_row(row) (or the row itself) under header; the other
+    formats write typed_record(row) (or header zipped with the row).
+    """
+    if fmt == 'csv':
+        return csv_chunks(header, map(csv_row, rows) if csv_row else rows)
+    
+    records = map(typed_record, rows) if typed_record else (dict(zip(header, row)) for row in rows)
+    if fmt == 'ndjson':
+        return ndjson_chunks(records)
+    return columnar_chunks(fmt, record_batches(records, schema))
+
+def encode_chart_export(fmt, header, rows):
+    """Byte chunks of chart export rows (chart_export) in an export format"""
+    return encode_export(fmt, header, rows,
+                         schema=chart_export_schema(header) if fmt in COLUMNAR_FORMATS else None)
+
+def encode_report_export(fmt, reports):
+    """Byte chunks of report rows (REPORT_EXPORT_SELECT) in an export format"""
+    return encode_export(fmt, HEATMAP_EXPORT_HEADER, reports, csv_row=heatmap_export_row,
+                         typed_record=report_export_record,
+                         schema=report_export_schema() if fmt in COLUMNAR_FORMATS else None)
+
+def stream_download(chunks, filename, mimetype='text/csv', compress=False):
+    """Attachment response sending chunks as they are produced (as filename.gz if compress)"""
+    if compress:
+        chunks = gzip_chunks(chunks)
+        filename = f"{filename}.gz"
+        mimetype = 'application/gzip'
+    
+    return Response(
+        chunks,
+        mimetype=mimetype,
+        headers={"Content-disposition": f"attachment; filename={filename}"}
+    )
@@ -0,0 +1,313 @@
+"""Kernel density hotspot surfaces for the maps.
+
+Reports are binned onto a fixed grid over the municipality and smoothed
+with a Gaussian kernel by FFT convolution, giving a density in reports per
+km2 instead of one blob per raw point. Each (type, time window, season)
+keeps its grid of counts on disk together with the time up to which it is
+complete (its horizon); a refresh only reads the reports created since the
+horizon, so new reports never trigger a rescan of the whole history.
+Windows that ended are rendered once and then served from disk as-is.
+
+Windows are widened to whole days, so the cache holds one grid per day
+range rather than one per minute a client can name, and the folder is
+kept to HOTSPOT_CACHE_MAX_FILES files, oldest first. Ended windows are
+recomputed once they are HOTSPOT_CLOSED_MAX_AGE old, so corrections to
+past reports reach their surfaces.
+"""
+import hashlib
+import os
+import struct
+import time
+import zlib
+from datetime import datetime, timedelta
+import numpy as np
+
+import report_events
+from admin import get_db_connection, TIGBAUAN_BOUNDS
+
+HOTSPOT_CACHE_FOLDER = os.environ.get('HOTSPOT_CACHE_FOLDER', 'cache/hotspots')
+HOTSPOT_BOUNDS = TIGBAUAN_BOUNDS
+# Grid cells per side (about 85 m cells over Tigbauan)
+HOTSPOT_GRID = 256
+HOTSPOT_BANDWIDTH_METERS = 250
+# Reports commit a little after their created_at, so the last minute stays out of the stored counts
+HOTSPOT_SETTLE_SECONDS = 60
+# How long a process reuses a rendered surface for a still-open window
+HOTSPOT_REFRESH_SECONDS = 30
+HOTSPOT_MAX_RENDERED = 64
+HOTSPOT_CACHE_MAX_FILES = 2000
+HOTSPOT_CLOSED_MAX_AGE = timedelta(days=1)
+HOTSPOT_PRUNE_SECONDS = 60
+
+# Philippine seasons by month
+HOTSPOT_SEASONS = {
+    'wet': (6, 7, 8, 9, 10, 11),
+    'dry': (12, 1, 2, 3, 4, 5)
+}
+
+# Same gradient as the Leaflet heat layers
+HOTSPOT_GRADIENT = [
+    (0.2, (0, 0, 255)),
+    (0.4, (0, 255, 255)),
+    (0.6, (0, 255, 0)),
+    (0.8, (255, 255, 0)),
+    (1.0, (255, 0, 0))
+]
+
+_rendered = {}
+_last_prune = {'at': 0.0}
+
+def cell_size_km():
+    """Height and width of one grid cell in km"""
+    mid_lat = (HOTSPOT_BOUNDS['south'] + HOTSPOT_BOUNDS['north']) / 2
+    height = (HOTSPOT_BOUNDS['north'] - HOTSPOT_BOUNDS['south']) * 111.32 / HOTSPOT_GRID
+    width = (HOTSPOT_BOUNDS['east'] - HOTSPOT_BOUNDS['west']) * 111.32 * np.cos(np.radians(mid_lat)) / HOTSPOT_GRID
+    return height, width
+
+def rasterize(latitudes, longitudes):
+    """Count reports per grid cell; row 0 is the northern edge"""
+    counts, _, _ = np.histogram2d(
+        latitudes, longitudes,
+        bins=HOTSPOT_GRID,
+        range=[[HOTSPOT_BOUNDS['south'], HOTSPOT_BOUNDS['north']],
+               [HOTSPOT_BOUNDS['west'], HOTSPOT_BOUNDS['east']]]
+    )
+    return counts[::-1].astype(np.float32)
+
+def gaussian_kde(counts):
+    """Smooth a count grid into reports per km2 by FFT convolution"""
+    height, width = cell_size_km()
+    sigma_rows = HOTSPOT_BANDWIDTH_METERS / 1000 / height
+    sigma_cols = HOTSPOT_BANDWIDTH_METERS / 1000 / width
+    pad = int(np.ceil(4 * max(sigma_rows, sigma_cols)))
+    shape = (counts.shape[0] + 2 * pad, counts.shape[1] + 2 * pad)
+    
+    # Kernel centred on (0, 0) with wrap-around offsets; the padding keeps
+    # the circular convolution from bleeding across opposite edges
+    rows = np.fft.fftfreq(shape[0], 1 / shape[0])[:, None]
+    cols = np.fft.fftfreq(shape[1], 1 / shape[1])[None, :]
+    kernel = np.exp(-0.5 * ((rows / sigma_rows) ** 2 + (cols / sigma_cols) ** 2))
+    kernel /= kernel.sum() * height * width
+    
+    density = np.fft.irfft2(np.fft.rfft2(counts, s=shape) * np.fft.rfft2(kernel), s=shape)
+    density = density[:counts.shape[0], :counts.shape[1]]
+    return np.maximum(density, 0).astype(np.float32)
+
+def render_png(density):
+    """Colour a density grid into an RGBA PNG (transparent where there is nothing)"""
+    peak = float(density.max())
+    scaled = density / peak if peak > 0 else density
+    
+    stops = [0.0] + [stop for stop, _ in HOTSPOT_GRADIENT]
+    colours = np.array([HOTSPOT_GRADIENT[0][1]] + [colour for _, colour in HOTSPOT_GRADIENT], dtype=np.float32)
+    rgba = np.zeros(density.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        rgba[..., channel] = np.interp(scaled, stops, colours[:, channel])
+    rgba[..., 3] = np.where(scaled < 0.05, 0, np.clip(80 + scaled * 150, 0, 230))
+    
+    height, width = density.shape
+    # Every PNG scanline starts with a filter byte (0 = none)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)]).tobytes()
+    
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6))
+            + chunk(b'IEND', b''))
+
+def day_window(since, until):
+    """Widen a window to whole days: since down to midnight, until up to the next one"""
+    if since:
+        since = since.replace(hour=0, minute=0, second=0, microsecond=0)
+    if until:
+        day = until.replace(hour=0, minute=0, second=0, microsecond=0)
+        until = day if day == until else day + timedelta(days=1)
+    return since, until
+
+def is_expired(path):
+    """True if a cached file is missing or older than HOTSPOT_CLOSED_MAX_AGE"""
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        return True
+    return age > HOTSPOT_CLOSED_MAX_AGE.total_seconds()
+
+def prune_cache():
+    """Delete the oldest cached files past HOTSPOT_CACHE_MAX_FILES (at most once a minute)"""
+    now = time.monotonic()
+    if now - _last_prune['at'] < HOTSPOT_PRUNE_SECONDS:
+        return
+    _last_prune['at'] = now
+    
+    try:
+        entries = [entry for entry in os.scandir(HOTSPOT_CACHE_FOLDER) if entry.is_file()]
+    except OSError:
+        return
+    if len(entries) <= HOTSPOT_CACHE_MAX_FILES:
+        return
+    
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - HOTSPOT_CACHE_MAX_FILES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def hotspot_key(emergency_type, since, until, season):
+    parts = [
+        emergency_type or 'all',
+        since.strftime('%Y%m%d%H%M') if since else 'start',
+        until.strftime('%Y%m%d%H%M') if until else 'now',
+        season or 'all',
+        f"{HOTSPOT_GRID}-{HOTSPOT_BANDWIDTH_METERS}"
+    ]
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:20]
+
+def fetch_points(cur, emergency_type, since, until, season):
+    """Latitudes, longitudes and creation times of the matching reports"""
+    conditions = [
+        "latitude BETWEEN %s AND %s",
+        "longitude BETWEEN %s AND %s",
+        "latitude != 0",
+        "longitude != 0"
+    ]
+    params = [HOTSPOT_BOUNDS['south'], HOTSPOT_BOUNDS['north'], HOTSPOT_BOUNDS['west'], HOTSPOT_BOUNDS['east']]
+    
+    if emergency_type:
+        conditions.append("emergency_type = %s")
+        params.append(emergency_type)
+    if since:
+        conditions.append("created_at >= %s")
+        params.append(since)
+    if until:
+        conditions.append("created_at < %s")
+        params.append(until)
+    if season:
+        months = HOTSPOT_SEASONS[season]
+        conditions.append(f"MONTH(created_at) IN ({', '.join(['%s'] * len(months))})")
+        params.extend(months)
+    
+    cur.execute(f"""
+        SELECT latitude, longitude, created_at
+        FROM emergency_reports
+        WHERE {' AND '.join(conditions)}
+    """, params)
+    rows = cur.fetchall()
+    
+    latitudes = np.array([float(row[0]) for row in rows], dtype=np.float64)
+    longitudes = np.array([float(row[1]) for row in rows], dtype=np.float64)
+    created = [row[2] for row in rows]
+    return latitudes, longitudes, created
+
+def load_counts(path):
+    try:
+        with np.load(path) as stored:
+            return stored['counts'], datetime.fromtimestamp(float(stored['horizon']))
+    except (FileNotFoundError, OSError, KeyError, ValueError):
+        return None, None
+
+def save_counts(path, counts, horizon):
+    # Write to a temporary file first so readers never see a partial grid
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp_path, counts=counts, horizon=np.float64(horizon.timestamp()))
+    os.replace(tmp_path, path)
+    prune_cache()
+
+def hotspot_counts(emergency_type, since, until, season):
+    """Current count grid for a window, updated from the reports since its horizon.
+    
+    Returns (counts, closed) or (None, False) if the database is unavailable;
+    closed means the window has ended and the grid will not change again.
+    """
+    os.makedirs(HOTSPOT_CACHE_FOLDER, exist_ok=True)
+    path = os.path.join(HOTSPOT_CACHE_FOLDER, hotspot_key(emergency_type, since, until, season) + '.npz')
+    counts, horizon = load_counts(path)
+    
+    settled = datetime.now() - timedelta(seconds=HOTSPOT_SETTLE_SECONDS)
+    if counts is not None and until and horizon >= until:
+        if not is_expired(path):
+            return counts, True
+        # Count an ended window again from scratch
+        counts = horizon = None
+    
+    conn = get_db_connection()
+    if not conn:
+        return None, False
+    
+    try:
+        cur = conn.cursor()
+        if counts is None:
+            tail_since = since
+            counts = np.zeros((HOTSPOT_GRID, HOTSPOT_GRID), dtype=np.float32)
+        else:
+            tail_since = max(horizon, since) if since else horizon
+        
+        latitudes, longitudes, created = fetch_points(cur, emergency_type, tail_since, until, season)
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Hotspot counts error: {e}")
+        conn.close()
+        return None, False
+    
+    # Fold settled reports into the stored grid; the last minute is only added on top
+    new_horizon = min(settled, until) if until else settled
+    is_settled = np.array([created_at is not None and created_at < new_horizon for created_at in created], dtype=bool)
+    
+    if horizon is None or new_horizon > horizon:
+        counts = counts + rasterize(latitudes[is_settled], longitudes[is_settled])
+        save_counts(path, counts, new_horizon)
+    
+    closed = bool(until) and new_horizon >= until
+    if (~is_settled).any():
+        counts = counts + rasterize(latitudes[~is_settled], longitudes[~is_settled])
+    return counts, closed
+
+def get_hotspot_surface(emergency_type=None, since=None, until=None, season=None, fmt='png'):
+    """Return the rendered surface ('png' bytes, or float16 'array' with its peak) or None"""
+    since, until = day_window(since, until)
+    key = hotspot_key(emergency_type, since, until, season)
+    suffix = '.png' if fmt == 'png' else '.f16'
+    path = os.path.join(HOTSPOT_CACHE_FOLDER, key + suffix)
+    
+    # Ended windows do not change: their surface is a plain file read
+    if not is_expired(path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+    
+    cached = _rendered.get((key, fmt))
+    if cached and time.monotonic() - cached[0] < HOTSPOT_REFRESH_SECONDS:
+        return cached[1]
+    
+    counts, closed = hotspot_counts(emergency_type, since, until, season)
+    if counts is None:
+        return None
+    
+    density = gaussian_kde(counts)
+    if fmt == 'png':
+        body = render_png(density)
+    else:
+        body = density.astype('<f2').tobytes()
+    
+    if closed:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        prune_cache()
+    else:
+        if len(_rendered) >= HOTSPOT_MAX_RENDERED:
+            _rendered.clear()
+        _rendered[(key, fmt)] = (time.monotonic(), body)
+    return body
+
+@report_events.subscribe
+def invalidate_rendered_hotspots(event):
+    """Let the next request fold a new report in instead of waiting out the refresh interval"""
+    if event['kind'] == 'created':
+        _rendered.clear()
@@ -0,0 +1,269 @@
+"""Response time percentiles from persisted log-bucketed histograms.
+
+Each latency (time to dispatch: dispatched_at - created_at, time to
+response: response_time - created_at) falls into a bucket whose bounds grow
+by LATENCY_GAMMA, so any value read back from a bucket is within
+LATENCY_ACCURACY of the true one. latency_sketch_buckets keeps the count of
+every bucket per (metric, month, emergency type, barangay). Buckets of the
+same metric simply add up, so the sketch of any combination of months,
+types and barangays is a SUM(count) GROUP BY bucket over its rows, and
+percentiles come from walking that merged histogram instead of the reports.
+
+A transactional report listener adds each report's latencies the first time
+they are known; latency_samples remembers which ones were counted so a
+report is never counted twice.
+"""
+import math
+
+import report_events
+
+LATENCY_METRICS = {
+    'dispatch': 'dispatched_at',
+    'response': 'response_time'
+}
+LATENCY_GROUPS = ('emergency_type', 'barangay', 'month')
+LATENCY_PERCENTILES = (50, 90, 99)
+# Relative error of a value read back from its bucket
+LATENCY_ACCURACY = 0.01
+LATENCY_GAMMA = (1 + LATENCY_ACCURACY) / (1 - LATENCY_ACCURACY)
+
+LATENCY_SKETCH_DDL = """
+    CREATE TABLE IF NOT EXISTS latency_sketch_buckets (
+        metric VARCHAR(20) NOT NULL,
+        month DATE NOT NULL,
+        emergency_type VARCHAR(50) NOT NULL,
+        barangay VARCHAR(50) NOT NULL,
+        bucket SMALLINT UNSIGNED NOT NULL,
+        count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (metric, month, emergency_type, barangay, bucket)
+    )
+"""
+
+LATENCY_SAMPLES_DDL = """
+    CREATE TABLE IF NOT EXISTS latency_samples (
+        report_id INT NOT NULL,
+        metric VARCHAR(20) NOT NULL,
+        PRIMARY KEY (report_id, metric)
+    )
+"""
+
+_sketches_ready = False
+
+def latency_bucket(seconds):
+    """Bucket of a latency; bucket 0 holds everything under a second"""
+    if seconds < 1:
+        return 0
+    return int(math.ceil(math.log(seconds) / math.log(LATENCY_GAMMA))) + 1
+
+def bucket_value(bucket):
+    """Representative latency (seconds) of a bucket"""
+    if bucket == 0:
+        return 0.0
+    upper = LATENCY_GAMMA ** (bucket - 1)
+    return 2 * upper / (LATENCY_GAMMA + 1)
+
+def ensure_latency_tables():
+    from admin import ensure_table
+    
+    return (ensure_table('latency_sketch_buckets', LATENCY_SKETCH_DDL)
+            and ensure_table('latency_samples', LATENCY_SAMPLES_DDL))
+
+def latency_rows_sql(where):
+    """Rows (id, month, type, barangay, created_at, <metric columns>) of the matching reports"""
+    from admin import BARANGAY_CASE_SQL
+    
+    return f"""
+        SELECT
+            id,
+            DATE_FORMAT(created_at, '%Y-%m-01') as month,
+            emergency_type,
+            {BARANGAY_CASE_SQL} as barangay,
+            created_at,
+            {', '.join(LATENCY_METRICS.values())}
+        FROM emergency_reports
+        WHERE created_at IS NOT NULL AND ({where})
+    """
+
+def report_samples(row):
+    """(metric, month, type, barangay, bucket) of each latency known for a report row"""
+    report_id, month, emergency_type, barangay, created_at = row[:5]
+    samples = []
+    for metric, moment in zip(LATENCY_METRICS, row[5:]):
+        if moment is None:
+            continue
+        seconds = max((moment - created_at).total_seconds(), 0)
+        samples.append((metric, month, emergency_type or 'other', barangay, latency_bucket(seconds)))
+    return samples
+
+def rebuild_latency_sketches():
+    """Recount every sketch from emergency_reports. Returns the number of samples.
+    
+    Like the other rebuilds, holds shared locks on the reports it reads
+    until the sketches are replaced, so a dispatch or resolution made
+    meanwhile is recorded after the rebuild rather than lost.
+    """
+    from admin import get_db_connection
+    
+    if not ensure_latency_tables():
+        return None
+    
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        cur = conn.cursor()
+        cur.execute(latency_rows_sql(' OR '.join(f"{column} IS NOT NULL" for column in LATENCY_METRICS.values()))
+                    + " LOCK IN SHARE MODE")
+        rows = cur.fetchall()
+        
+        buckets = {}
+        samples = []
+        for row in rows:
+            for sample in report_samples(row):
+                buckets[sample] = buckets.get(sample, 0) + 1
+                samples.append((row[0], sample[0]))
+        
+        cur.execute("DELETE FROM latency_sketch_buckets")
+        cur.execute("DELETE FROM latency_samples")
+        bucket_rows = [key + (count,) for key, count in buckets.items()]
+        for start in range(0, len(bucket_rows), 1000):
+            cur.executemany("""
+                INSERT INTO latency_sketch_buckets (metric, month, emergency_type, barangay, bucket, count)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, bucket_rows[start:start + 1000])
+        for start in range(0, len(samples), 1000):
+            cur.executemany("""
+                INSERT INTO latency_samples (report_id, metric)
+                VALUES (%s, %s)
+            """, samples[start:start + 1000])
+        conn.commit()
+        cur.close()
+        conn.close()
+        return len(samples)
+    except Exception as e:
+        print(f"Rebuild latency sketches error: {e}")
+        conn.close()
+        return None
+
+def ensure_latency_sketches(build=False):
+    """Return True once the sketches exist and have been built.
+    
+    Same contract as ensure_report_cube: listeners pass build=False.
+    """
+    global _sketches_ready
+    from admin import get_db_connection
+    
+    if not ensure_latency_tables():
+        return False
+    if _sketches_ready:
+        return True
+    
+    conn = get_db_connection()
+    if not conn:
+        return False
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM latency_samples LIMIT 1")
+        empty = cur.fetchone() is None
+        cur.execute(f"""
+            SELECT 1 FROM emergency_reports
+            WHERE {' OR '.join(f"{column} IS NOT NULL" for column in LATENCY_METRICS.values())}
+            LIMIT 1
+        """)
+        has_samples = cur.fetchone() is not None
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Check latency sketches error: {e}")
+        conn.close()
+        return False
+    
+    if empty and has_samples:
+        if not build or rebuild_latency_sketches() is None:
+            return False
+    _sketches_ready = True
+    return True
+
+@report_events.subscribe(transactional=True)
+def record_latencies(cur, event):
+    """Add the latencies a report transition made known to the sketches"""
+    if event['kind'] != 'status_changed':
+        return
+    if not ensure_latency_sketches():
+        return
+    
+    cur.execute(latency_rows_sql("id = %s"), (event['report_id'],))
+    row = cur.fetchone()
+    if not row:
+        return
+    if isinstance(row, dict):
+        row = tuple(row.values())
+    
+    for metric, month, emergency_type, barangay, bucket in report_samples(row):
+        # Counted once per report, whichever transition first sees the value
+        cur.execute("""
+            INSERT IGNORE INTO latency_samples (report_id, metric)
+            VALUES (%s, %s)
+        """, (event['report_id'], metric))
+        if cur.rowcount != 1:
+            continue
+        cur.execute("""
+            INSERT INTO latency_sketch_buckets (metric, month, emergency_type, barangay, bucket, count)
+            VALUES (%s, %s, %s, %s, %s, 1)
+            ON DUPLICATE KEY UPDATE count = count + 1
+        """, (metric, month, emergency_type, barangay, bucket))
+
+def histogram_percentiles(histogram, percentiles=LATENCY_PERCENTILES):
+    """Percentile latencies in minutes from [(bucket, count), ...] sorted by bucket"""
+    total = sum(count for _, count in histogram)
+    result = {'count': total}
+    for percentile in percentiles:
+        result[f"p{percentile}"] = None
+    if not total:
+        return result
+    
+    for percentile in percentiles:
+        rank = math.ceil(percentile / 100 * total)
+        seen = 0
+        for bucket, count in histogram:
+            seen += count
+            if seen >= rank:
+                result[f"p{percentile}"] = round(bucket_value(bucket) / 60, 1)
+                break
+    return result
+
+def latency_percentiles(cur, metric, group, since, until, emergency_type=None, barangay=None):
+    """Percentiles of a metric per group (one of LATENCY_GROUPS) for the months in [since, until).
+    
+    Returns [{'group': value, 'count': n, 'p50': minutes, ...}, ...]; months
+    are grouped as 'YYYY-MM'.
+    """
+    conditions = ["metric = %s", "month >= %s", "month < %s"]
+    params = [metric, since, until]
+    if emergency_type:
+        conditions.append("emergency_type = %s")
+        params.append(emergency_type)
+    if barangay:
+        conditions.append("barangay = %s")
+        params.append(barangay)
+    
+    cur.execute(f"""
+        SELECT {group} as grp, bucket, SUM(count) as count
+        FROM latency_sketch_buckets
+        WHERE {' AND '.join(conditions)}
+        GROUP BY grp, bucket
+        HAVING SUM(count) > 0
+        ORDER BY grp, bucket
+    """, params)
+    
+    histograms = {}
+    for row in cur.fetchall():
+        grp = row['grp'].strftime('%Y-%m') if group == 'month' else row['grp']
+        histograms.setdefault(grp, []).append((row['bucket'], int(row['count'])))
+    
+    return [
+        dict(histogram_percentiles(histogram), group=grp)
+        for grp, histogram in histograms.items()
+    ]
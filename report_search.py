@@ -0,0 +1,129 @@
+"""Report search with facet counts for the admin reports page.
+
+Text is matched through a FULLTEXT index on (description, location) in
+boolean mode; words shorter than the index's minimum token size fall back
+to LIKE on the rows the other conditions already narrowed. Results are
+paged newest first on (created_at, id) cursors like the reports list.
+
+Facet counts (type, status, barangay, month) come from one grouped query
+per search. Without a text query they are read from report_daily_rollup,
+which holds exactly those dimensions per day.
+"""
+import re
+
+SEARCH_PAGE_SIZE = 25
+# InnoDB's default innodb_ft_min_token_size
+SEARCH_MIN_TOKEN = 3
+SEARCH_FACETS = ('emergency_type', 'status', 'barangay', 'month')
+
+def text_conditions(q):
+    """SQL conditions and params matching every word of q"""
+    words = re.findall(r'\w+', q.lower())
+    long_words = [word for word in words if len(word) >= SEARCH_MIN_TOKEN]
+    conditions = []
+    params = []
+    
+    if long_words:
+        conditions.append("MATCH(description, location) AGAINST (%s IN BOOLEAN MODE)")
+        params.append(' '.join(f"+{word}*" for word in long_words))
+    for word in words:
+        if len(word) < SEARCH_MIN_TOKEN:
+            conditions.append("(description LIKE %s OR location LIKE %s)")
+            params.extend([f"%{word}%", f"%{word}%"])
+    return conditions, params
+
+def filter_conditions(filters, barangay_sql, date_column='created_at'):
+    """SQL conditions and params for the type/status/barangay/date filters"""
+    conditions = []
+    params = []
+    
+    if filters.get('emergency_type'):
+        conditions.append("emergency_type = %s")
+        params.append(filters['emergency_type'])
+    if filters.get('status'):
+        conditions.append("status = %s")
+        params.append(filters['status'])
+    if filters.get('barangay'):
+        conditions.append(f"{barangay_sql} = %s")
+        params.append(filters['barangay'])
+    if filters.get('since'):
+        conditions.append(f"{date_column} >= %s")
+        params.append(filters['since'])
+    if filters.get('until'):
+        conditions.append(f"{date_column} < %s")
+        params.append(filters['until'])
+    return conditions, params
+
+def search_reports(cur, filters, after=None, per_page=SEARCH_PAGE_SIZE):
+    """One page of matching reports plus facet counts over all matches.
+    
+    filters may hold q, emergency_type, status, barangay, since and until
+    (dates, until exclusive). after is a (created_at, id) position. Returns
+    (reports, next_cursor, facets, total); facets and total are only
+    counted for the first page (later pages get empty facets and None).
+    """
+    from admin import BARANGAY_CASE_SQL, ensure_index, ensure_daily_rollup, encode_report_cursor
+    
+    ensure_index('emergency_reports', 'idx_reports_created', 'created_at, id')
+    q = (filters.get('q') or '').strip()
+    if q:
+        ensure_index('emergency_reports', 'ft_reports_text', 'description, location', fulltext=True)
+    
+    conditions, params = text_conditions(q) if q else ([], [])
+    more_conditions, more_params = filter_conditions(filters, BARANGAY_CASE_SQL)
+    conditions = ["created_at IS NOT NULL"] + conditions + more_conditions
+    params = params + more_params
+    
+    page_conditions = list(conditions)
+    page_params = list(params)
+    if after:
+        page_conditions.append("(created_at < %s OR (created_at = %s AND id < %s))")
+        page_params += [after[0], after[0], after[1]]
+    
+    # Filter and page on emergency_reports alone, then join the reporters of the page
+    cur.execute(f"""
+        SELECT r.*, u.fname, u.lname, u.phone_num, u.email
+        FROM (
+            SELECT *
+            FROM emergency_reports
+            WHERE {' AND '.join(page_conditions)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        ) r
+        LEFT JOIN users u ON r.user_id = u.id
+        ORDER BY r.created_at DESC, r.id DESC
+    """, page_params + [per_page + 1])
+    reports = cur.fetchall()
+    
+    next_cursor = None
+    if len(reports) > per_page:
+        reports = reports[:per_page]
+        next_cursor = encode_report_cursor(reports[-1])
+    
+    facets = {facet: {} for facet in SEARCH_FACETS}
+    if after is None:
+        if not q and ensure_daily_rollup(build=True):
+            rollup_conditions, rollup_params = filter_conditions(filters, 'barangay', date_column='date')
+            cur.execute(f"""
+                SELECT emergency_type, status, barangay, DATE_FORMAT(date, '%Y-%m') as month, SUM(count) as count
+                FROM report_daily_rollup
+                WHERE {' AND '.join(rollup_conditions) or '1 = 1'}
+                GROUP BY emergency_type, status, barangay, month
+                HAVING SUM(count) > 0
+            """, rollup_params)
+        else:
+            cur.execute(f"""
+                SELECT emergency_type, status, {BARANGAY_CASE_SQL} as barangay,
+                       DATE_FORMAT(created_at, '%Y-%m') as month, COUNT(*) as count
+                FROM emergency_reports
+                WHERE {' AND '.join(conditions)}
+                GROUP BY emergency_type, status, barangay, month
+            """, params)
+        
+        for row in cur.fetchall():
+            for facet in SEARCH_FACETS:
+                value = row[facet] or ''
+                facets[facet][value] = facets[facet].get(value, 0) + int(row['count'])
+    
+    total = sum(facets['status'].values()) if after is None else None
+    return reports, next_cursor, facets, total
@@ -10,9 +10,10 @@ class HeatmapManager {
         this.showMarkers = true;
         this.showClusters = false;
         this.heatmapIntensity = 5;
+        this.heatmapTiles = [];
     }
 
-    init(mapElementId, initialData = []) {
+    init(mapElementId, dataUrl, detailsUrl, changesUrl, initialData = []) {
         // Initialize map centered on Tigbauan, Iloilo
         this.map = L.map(mapElementId).setView([10.6747, 122.3964], 13);
         
@@ -24,12 +25,171 @@ class HeatmapManager {
         // Add scale control
         L.control.scale({ imperial: false }).addTo(this.map);
         
+        this.dataUrl = dataUrl;
+        this.detailsUrl = detailsUrl;
+        this.changesUrl = changesUrl;
+        this.changeCursor = null;
         this.heatmapData = initialData;
         this.setupEventHandlers();
         this.updateLayers();
         this.updateStatistics();
         this.renderEmergencyList();
         this.addUserLocation();
+        
+        // Load points for the visible area, and again whenever the view changes
+        this.loadData();
+        this.map.on('moveend', () => this.loadData());
+    }
+
+    // Decode the typed-array payload from heatmaps_data?format=binary
+    decodeReports(buffer) {
+        const view = new DataView(buffer);
+        const headerLength = view.getUint32(0, true);
+        const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+        const arrayTypes = { uint8: Uint8Array, uint32: Uint32Array, float32: Float32Array };
+        
+        const columns = {};
+        let offset = 4 + headerLength;
+        header.columns.forEach(([name, dtype]) => {
+            const ArrayType = arrayTypes[dtype];
+            columns[name] = new ArrayType(buffer, offset, header.count);
+            offset += Math.ceil(header.count * ArrayType.BYTES_PER_ELEMENT / 4) * 4;
+        });
+        
+        const reports = [];
+        for (let i = 0; i < header.count; i++) {
+            const created = new Date(columns.time[i] * 1000);
+            reports.push({
+                id: columns.id[i],
+                type: header.types[columns.type[i]],
+                status: header.statuses[columns.status[i]],
+                lat: columns.lat[i],
+                lng: columns.lng[i],
+                ownership: columns.mine && columns.mine[i] ? 'my_report' : 'other_report',
+                time: columns.time[i] ? this.formatTime(created) : 'Unknown'
+            });
+        }
+        return { reports: reports, nextCursor: header.next_cursor };
+    }
+
+    formatTime(date) {
+        const pad = value => String(value).padStart(2, '0');
+        return `${date.getFullYear()}-${pad(date.getMonth() + 1)}-${pad(date.getDate())} ${pad(date.getHours())}:${pad(date.getMinutes())}`;
+    }
+
+    // Popup and list details (description, location, reporter, image) are loaded on demand
+    async loadDetails(reports) {
+        const missing = reports.filter(report => !report.detailsLoaded);
+        if (missing.length === 0) return;
+        
+        const response = await fetch(`${this.detailsUrl}?ids=${missing.map(report => report.id).join(',')}`);
+        const data = await response.json();
+        if (!data.success) return;
+        
+        missing.forEach(report => {
+            const details = data.reports[report.id];
+            if (details) {
+                Object.assign(report, details, { detailsLoaded: true });
+            }
+        });
+    }
+
+    async loadData() {
+        const params = new URLSearchParams({
+            bbox: this.map.getBounds().toBBoxString(),
+            limit: 1000,
+            format: 'binary'
+        });
+        const requestId = (this.loadRequestId || 0) + 1;
+        this.loadRequestId = requestId;
+        
+        const reports = [];
+        let cursor = null;
+        let changeCursor = null;
+        const tilesRequest = loadReportTiles(this.map);
+        
+        try {
+            // Take the change cursor first so nothing committed during the load is missed
+            const changes = await fetch(this.changesUrl).then(response => response.json());
+            changeCursor = changes.success ? changes.cursor : null;
+            
+            // Follow the keyset cursor until the window is exhausted (capped at 5 pages)
+            for (let page = 0; page < 5; page++) {
+                if (cursor) params.set('cursor', cursor);
+                const response = await fetch(`${this.dataUrl}?${params.toString()}`);
+                if (!response.ok) break;
+                const data = this.decodeReports(await response.arrayBuffer());
+                
+                reports.push(...data.reports);
+                cursor = data.nextCursor;
+                if (!cursor) break;
+            }
+            this.heatmapTiles = await tilesRequest;
+        } catch (error) {
+            console.error('Error loading heatmap data:', error);
+            return;
+        }
+        
+        // Ignore responses for a view the user has already moved away from
+        if (requestId === this.loadRequestId) {
+            this.changeCursor = changeCursor;
+            this.updateData(reports);
+        }
+    }
+
+    // Apply only the points added, changed or removed since the last change cursor
+    async refreshChanges() {
+        if (this.changeCursor === null) return;
+        
+        const params = new URLSearchParams({
+            since: this.changeCursor,
+            bbox: this.map.getBounds().toBBoxString()
+        });
+        const requestId = this.loadRequestId;
+        
+        let data;
+        try {
+            data = await fetch(`${this.changesUrl}?${params.toString()}`).then(response => response.json());
+        } catch (error) {
+            console.error('Error refreshing heatmap data:', error);
+            return;
+        }
+        
+        if (!data.success || requestId !== this.loadRequestId) return;
+        if (data.reset) {
+            this.loadData();
+            return;
+        }
+        
+        this.changeCursor = data.cursor;
+        const updates = [...data.added, ...data.changed];
+        if (updates.length === 0 && data.removed.length === 0) return;
+        
+        const reportsById = new Map(this.heatmapData.map(report => [report.id, report]));
+        data.removed.forEach(id => reportsById.delete(id));
+        updates.forEach(point => {
+            reportsById.set(point.id, {
+                id: point.id,
+                type: point.emergency_type,
+                status: point.status,
+                lat: point.latitude,
+                lng: point.longitude,
+                ownership: point.mine ? 'my_report' : 'other_report',
+                time: point.created_at ? point.created_at.slice(0, 16).replace('T', ' ') : 'Unknown',
+                location: point.location,
+                description: point.description,
+                user_name: point.user_name,
+                image: point.image,
+                detailsLoaded: true
+            });
+        });
+        
+        // Keep newest first, like the server orders them
+        const reports = Array.from(reportsById.values())
+            .sort((a, b) => (a.time < b.time) - (a.time > b.time) || b.id - a.id);
+        
+        this.heatmapTiles = await loadReportTiles(this.map);
+        this.updateData(reports);
     }
 
     setupEventHandlers() {
@@ -90,10 +250,15 @@ class HeatmapManager {
             this.map.removeLayer(this.heatmapLayer);
         }
         
-        const filteredData = this.getFilteredData();
-        const heatmapPoints = filteredData
-            .filter(report => report.lat && report.lng)
-            .map(report => [report.lat, report.lng, 1]);
+        // Density comes from the pre-aggregated tiles; "my reports" is per-user so it uses the loaded points
+        let heatmapPoints;
+        if (this.currentFilter === 'my_reports') {
+            heatmapPoints = this.getFilteredData()
+                .filter(report => report.lat && report.lng)
+                .map(report => [report.lat, report.lng, 1]);
+        } else {
+            heatmapPoints = reportTilesToHeatPoints(this.heatmapTiles, this.currentFilter);
+        }
         
         // Calculate intensity based on slider
         const radius = 15 + (this.heatmapIntensity * 2);
@@ -126,40 +291,46 @@ class HeatmapManager {
             this.map.removeLayer(this.clusterLayer);
         }
         
-        const filteredData = this.getFilteredData();
+        const layer = L.layerGroup();
+        this.clusterLayer = layer;
+        if (!this.showClusters) return;
+        layer.addTo(this.map);
         
-        // Create marker cluster group
-        this.clusterLayer = L.markerClusterGroup({
-            chunkedLoading: true,
-            maxClusterRadius: 50,
-            spiderfyOnMaxZoom: true,
-            showCoverageOnHover: true,
-            zoomToBoundsOnClick: true,
-            iconCreateFunction: function (cluster) {
-                const count = cluster.getChildCount();
-                let size = 'small';
-                
-                if (count > 10) size = 'large';
-                else if (count > 5) size = 'medium';
+        // "My reports" are few and per-user, so they are drawn from the loaded points
+        if (this.currentFilter === 'my_reports') {
+            this.getFilteredData().forEach(report => {
+                if (report.lat && report.lng) {
+                    layer.addLayer(this.createMarker(report));
+                }
+            });
+            return;
+        }
+        
+        // Everything else is clustered once on the server and shared by all viewers
+        loadReportClusters(this.map, this.currentFilter)
+            .then(features => {
+                if (layer !== this.clusterLayer) return;
                 
-                return L.divIcon({
-                    html: '<div><span>' + count + '</span></div>',
-                    className: 'marker-cluster marker-cluster-' + size,
-                    iconSize: L.point(40, 40)
+                const reportsById = new Map(this.heatmapData.map(report => [report.id, report]));
+                features.forEach(feature => {
+                    if (feature.cluster) {
+                        layer.addLayer(createClusterMarker(feature, this.map, this.currentFilter));
+                        return;
+                    }
+                    
+                    const report = reportsById.get(feature.id) || {
+                        id: feature.id,
+                        type: feature.emergency_type,
+                        status: feature.status,
+                        lat: feature.latitude,
+                        lng: feature.longitude,
+                        ownership: 'other_report',
+                        time: 'Unknown'
+                    };
+                    layer.addLayer(this.createMarker(report));
                 });
-            }
-        });
-        
-        filteredData.forEach(report => {
-            if (report.lat && report.lng) {
-                const marker = this.createMarker(report);
-                this.clusterLayer.addLayer(marker);
-            }
-        });
-        
-        if (this.showClusters && filteredData.length > 0) {
-            this.map.addLayer(this.clusterLayer);
-        }
+            })
+            .catch(error => console.error('Error loading clusters:', error));
     }
 
     addIndividualMarkers() {
@@ -212,7 +383,15 @@ class HeatmapManager {
         });
         
         const marker = L.marker([report.lat, report.lng], { icon: markerIcon })
-            .bindPopup(this.createPopupContent(report));
+            .bindPopup(report.detailsLoaded ? this.createPopupContent(report) : 'Loading...');
+        
+        if (!report.detailsLoaded) {
+            marker.on('popupopen', () => {
+                this.loadDetails([report])
+                    .then(() => marker.setPopupContent(this.createPopupContent(report)))
+                    .catch(error => console.error('Error loading report details:', error));
+            });
+        }
         
         return marker;
     }
@@ -237,7 +416,7 @@ class HeatmapManager {
                 <div class="popup-meta">
                     <div><strong>Reported by:</strong> ${report.user_name || 'Anonymous'}</div>
                     <div><strong>Time:</strong> ${report.time} (${timeAgo})</div>
-                    <div><strong>Location:</strong> ${report.location}</div>
+                    <div><strong>Location:</strong> ${report.location || 'Unknown location'}</div>
                     <div><strong>Status:</strong> <span class="status-badge ${statusClass}">${statusText}</span></div>
                 </div>
                 
@@ -333,10 +512,16 @@ class HeatmapManager {
         document.getElementById('resolvedEmergencies').textContent = resolved;
     }
 
-    renderEmergencyList() {
+    async renderEmergencyList() {
         const emergenciesList = document.getElementById('emergenciesList');
         const filteredData = this.getFilteredData().slice(0, 15); // Show latest 15
         
+        try {
+            await this.loadDetails(filteredData);
+        } catch (error) {
+            console.error('Error loading report details:', error);
+        }
+        
         if (filteredData.length > 0) {
             emergenciesList.innerHTML = filteredData.map(report => {
                 const isMyReport = report.ownership === 'my_report';
@@ -359,7 +544,7 @@ class HeatmapManager {
                                 }
                             </div>
                             <div class="report-meta">
-                                ${report.location} • ${report.time} • Reported by: ${report.user_name || 'Anonymous'}
+                                ${report.location || 'Unknown location'} • ${report.time} • Reported by: ${report.user_name || 'Anonymous'}
                             </div>
                             ${report.description ? `
                                 <div class="report-description">
@@ -392,16 +577,12 @@ class HeatmapManager {
 document.addEventListener('DOMContentLoaded', function() {
     if (document.getElementById('heatmap')) {
         const heatmapManager = new HeatmapManager();
-        heatmapManager.init('heatmap', heatmapData);
+        heatmapManager.init('heatmap', heatmapDataUrl, heatmapDetailsUrl, heatmapChangesUrl);
         
         // Make heatmapManager available globally for updates
         window.heatmapManager = heatmapManager;
         
-        // Auto-refresh data every 30 seconds
-        setInterval(() => {
-            // In a real application, you would fetch new data from the server
-            // For now, we'll just use the initial data
-            console.log('Heatmap data refresh triggered');
-        }, 30000);
+        // Pull only what changed every 30 seconds
+        setInterval(() => heatmapManager.refreshChanges(), 30000);
     }
 });
\ No newline at end of file
@@ -0,0 +1,42 @@
+// Server-side report clusters for 1TERA maps (served from /map/clusters)
+
+// Fetch clusters and single reports for the current view of a Leaflet map
+function loadReportClusters(map, emergencyType = 'all') {
+    const params = new URLSearchParams({
+        bbox: map.getBounds().pad(0.2).toBBoxString(),
+        zoom: Math.round(map.getZoom()),
+        type: emergencyType
+    });
+
+    return fetch(`/map/clusters?${params.toString()}`)
+        .then(response => response.json())
+        .then(data => data.success ? data.features : []);
+}
+
+// Cluster bubble with the markercluster look; clicking zooms to where it splits
+function createClusterMarker(feature, map, emergencyType = 'all') {
+    let size = 'small';
+    if (feature.count > 10) size = 'large';
+    else if (feature.count > 5) size = 'medium';
+
+    const marker = L.marker([feature.latitude, feature.longitude], {
+        icon: L.divIcon({
+            html: '<div><span>' + feature.count + '</span></div>',
+            className: 'marker-cluster marker-cluster-' + size,
+            iconSize: L.point(40, 40)
+        })
+    });
+
+    marker.on('click', () => {
+        const params = new URLSearchParams({ type: emergencyType });
+        fetch(`/map/clusters/${feature.id}?${params.toString()}`)
+            .then(response => response.json())
+            .then(data => {
+                const zoom = data.success ? data.expansion_zoom : map.getZoom() + 1;
+                map.setView([feature.latitude, feature.longitude], Math.min(zoom, map.getMaxZoom()));
+            })
+            .catch(error => console.error('Error expanding cluster:', error));
+    });
+
+    return marker;
+}
@@ -0,0 +1,49 @@
+// Pre-aggregated report tiles for 1TERA maps (served from /tiles/reports/{z}/{x}/{y})
+
+function reportTileFor(latlng, zoom) {
+    const n = Math.pow(2, zoom);
+    const latRad = latlng.lat * Math.PI / 180;
+    return {
+        x: Math.min(n - 1, Math.max(0, Math.floor((latlng.lng + 180) / 360 * n))),
+        y: Math.min(n - 1, Math.max(0, Math.floor((1 - Math.asinh(Math.tan(latRad)) / Math.PI) / 2 * n)))
+    };
+}
+
+// Fetch every tile covering the current view of a Leaflet map
+function loadReportTiles(map) {
+    const zoom = Math.min(19, Math.max(0, Math.round(map.getZoom())));
+    const bounds = map.getBounds();
+    const topLeft = reportTileFor(bounds.getNorthWest(), zoom);
+    const bottomRight = reportTileFor(bounds.getSouthEast(), zoom);
+
+    const requests = [];
+    for (let x = topLeft.x; x <= bottomRight.x; x++) {
+        for (let y = topLeft.y; y <= bottomRight.y; y++) {
+            requests.push(
+                fetch(`/tiles/reports/${zoom}/${x}/${y}`)
+                    .then(response => response.ok ? response.json() : null)
+                    .catch(() => null)
+            );
+        }
+    }
+
+    return Promise.all(requests).then(tiles => tiles.filter(tile => tile && tile.count > 0));
+}
+
+// Turn tiles into [lat, lng, weight] points for L.heatLayer, optionally for one emergency type
+function reportTilesToHeatPoints(tiles, emergencyType = 'all') {
+    const heatPoints = [];
+
+    tiles.forEach(tile => {
+        (tile.cells || []).forEach(cell => {
+            const weight = emergencyType === 'all' ? cell.count : (cell.types[emergencyType] || 0);
+            if (weight > 0) heatPoints.push([cell.lat, cell.lng, weight]);
+        });
+
+        (tile.points || []).forEach(([id, lat, lng, type]) => {
+            if (emergencyType === 'all' || type === emergencyType) heatPoints.push([lat, lng, 1]);
+        });
+    });
+
+    return heatPoints;
+}
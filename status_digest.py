@@ -0,0 +1,156 @@
+"""Coalesced status-update emails for citizens.
+
+Citizens were only ever told about status changes in the app
+(user_notifications); emailing them is a new outbound stream to every
+reporter, so it is off unless the deployment turns it on with
+STATUS_DIGEST_EMAILS=true. Without it nothing is buffered or sent.
+
+When enabled, status routes buffer the message they show a citizen in status_digest_items,
+in the same transaction as the status change. Instead of one email per
+change, a flusher thread waits until a user's oldest buffered message is
+STATUS_DIGEST_WINDOW_SECONDS old and then sends every message buffered for
+that user as one digest, so a report that changes state several times in a
+few minutes costs one email. The digest is written to the mail outbox in
+the same transaction that removes its items, so it is neither lost nor sent
+twice if the flush fails halfway.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import mail_outbox
+
+STATUS_DIGEST_EMAILS = os.environ.get('STATUS_DIGEST_EMAILS', 'false').lower() == 'true'
+STATUS_DIGEST_WINDOW_SECONDS = int(os.environ.get('STATUS_DIGEST_WINDOW_SECONDS', 120))
+STATUS_DIGEST_POLL_SECONDS = 15
+# Users flushed per poll; the rest wait for the next one during surges
+STATUS_DIGEST_MAX_USERS = 200
+
+STATUS_DIGEST_ITEMS_DDL = """
+    CREATE TABLE IF NOT EXISTS status_digest_items (
+        id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        report_id INT NULL,
+        title VARCHAR(255) NOT NULL,
+        message TEXT NOT NULL,
+        created_at DATETIME NOT NULL,
+        INDEX idx_status_digest_user (user_id, created_at)
+    )
+"""
+
+_flusher = {'thread': None}
+_flusher_lock = threading.Lock()
+
+def ensure_digest_table():
+    from admin import ensure_table
+    
+    return ensure_table('status_digest_items', STATUS_DIGEST_ITEMS_DDL)
+
+def buffer_status_message(cur, user_id, report_id, title, message):
+    """Buffer a citizen's status message for their next digest (inside the caller's transaction)"""
+    if not STATUS_DIGEST_EMAILS or not user_id or not ensure_digest_table():
+        return
+    
+    cur.execute("""
+        INSERT INTO status_digest_items (user_id, report_id, title, message, created_at)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (user_id, report_id, title, message, datetime.now()))
+
+def digest_body(name, items):
+    lines = [f"Hello {name}," if name else "Hello,", "", "Here are the latest updates on your emergency reports:", ""]
+    for item in items:
+        report = f"Report #{item['report_id']}" if item['report_id'] else "Your report"
+        lines.append(f"- {item['created_at'].strftime('%I:%M %p')} {report}: {item['title']}")
+        lines.append(f"  {item['message']}")
+    lines += ["", "Stay safe,", "1TERA Team"]
+    return '\n'.join(lines)
+
+def flush_user(conn, user_id):
+    """Send one digest of a user's buffered messages. Returns the number of messages."""
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute("""
+            SELECT id, report_id, title, message, created_at
+            FROM status_digest_items
+            WHERE user_id = %s
+            ORDER BY created_at, id
+            FOR UPDATE
+        """, (user_id,))
+        items = cur.fetchall()
+        if not items:
+            conn.rollback()
+            return 0
+        
+        cur.execute("SELECT fname, lname, email FROM users WHERE id = %s", (user_id,))
+        user = cur.fetchone()
+        if user and user['email']:
+            subject = ("1TERA - Report Status Update" if len(items) == 1
+                       else f"1TERA - {len(items)} Report Status Updates")
+            name = f"{user['fname'] or ''} {user['lname'] or ''}".strip()
+            mail_outbox.insert_mail(cur, subject, [user['email']], digest_body(name, items),
+                                    category='status_digest')
+        
+        placeholders = ', '.join(['%s'] * len(items))
+        cur.execute(f"DELETE FROM status_digest_items WHERE id IN ({placeholders})",
+                    [item['id'] for item in items])
+        conn.commit()
+        return len(items)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+def flush_due_digests(window=None):
+    """Send the digests of every user whose oldest buffered message has waited out the window"""
+    from admin import get_db_connection
+    
+    if not (ensure_digest_table() and mail_outbox.ensure_outbox_table()):
+        return None
+    
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    window = STATUS_DIGEST_WINDOW_SECONDS if window is None else window
+    sent = 0
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+            SELECT user_id
+            FROM status_digest_items
+            GROUP BY user_id
+            HAVING MIN(created_at) <= %s
+            ORDER BY MIN(created_at)
+            LIMIT %s
+        """, (datetime.now() - timedelta(seconds=window), STATUS_DIGEST_MAX_USERS))
+        user_ids = [row['user_id'] for row in cur.fetchall()]
+        cur.close()
+        
+        for user_id in user_ids:
+            if flush_user(conn, user_id):
+                sent += 1
+        conn.close()
+    except Exception as e:
+        print(f"Flush status digests error: {e}")
+        conn.close()
+    
+    if sent:
+        mail_outbox.wake_workers()
+    return sent
+
+def flusher_loop():
+    while True:
+        time.sleep(STATUS_DIGEST_POLL_SECONDS)
+        flush_due_digests()
+
+def start_flusher():
+    """Start the digest flusher thread once per process (if digest emails are enabled)"""
+    if not STATUS_DIGEST_EMAILS or _flusher['thread'] is not None:
+        return
+    
+    with _flusher_lock:
+        if _flusher['thread'] is None:
+            _flusher['thread'] = threading.Thread(target=flusher_loop, name='status-digest', daemon=True)
+            _flusher['thread'].start()
@@ -0,0 +1,147 @@
+"""Per-user report counts for the profile and home pages.
+
+user_report_stats keeps one row per reporting user: how many reports they
+sent, how many are pending, in progress and resolved, and when they last
+reported. A transactional report listener adjusts the row on every new
+report and status transition, so a page needs one primary key lookup
+instead of counting the user's reports. Rows are created on first read;
+reads are cached in-process for USER_STATS_TTL seconds and dropped when one
+of the user's reports changes.
+"""
+import threading
+import time
+
+import report_events
+
+USER_STATS_TTL = 15
+USER_STATS_STATUSES = ('pending', 'in_progress', 'resolved')
+USER_STATS_MAX_CACHED = 1024
+
+USER_REPORT_STATS_DDL = """
+    CREATE TABLE IF NOT EXISTS user_report_stats (
+        user_id INT PRIMARY KEY,
+        total INT NOT NULL DEFAULT 0,
+        pending INT NOT NULL DEFAULT 0,
+        in_progress INT NOT NULL DEFAULT 0,
+        resolved INT NOT NULL DEFAULT 0,
+        last_report_at DATETIME NULL
+    )
+"""
+
+EMPTY_USER_STATS = {
+    'total': 0,
+    'pending': 0,
+    'in_progress': 0,
+    'resolved': 0,
+    'last_report_at': None
+}
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def ensure_user_stats_table():
+    from admin import ensure_table
+    
+    return ensure_table('user_report_stats', USER_REPORT_STATS_DDL)
+
+@report_events.subscribe(transactional=True)
+def update_user_report_stats(cur, event):
+    """Apply a report change to its user's row (rows that don't exist yet are built on read)"""
+    if not event['user_id'] or not ensure_user_stats_table():
+        return
+    
+    assignments = []
+    params = []
+    if event['kind'] == 'created':
+        assignments.append("total = total + 1")
+        assignments.append("last_report_at = GREATEST(COALESCE(last_report_at, %s), %s)")
+        params.extend([event['changed_at'], event['changed_at']])
+    elif event['old_status'] == event['new_status']:
+        return
+    elif event['old_status'] in USER_STATS_STATUSES:
+        assignments.append(f"{event['old_status']} = {event['old_status']} - 1")
+    
+    if event['new_status'] in USER_STATS_STATUSES:
+        assignments.append(f"{event['new_status']} = {event['new_status']} + 1")
+    if not assignments:
+        return
+    
+    cur.execute(f"""
+        UPDATE user_report_stats
+        SET {', '.join(assignments)}
+        WHERE user_id = %s
+    """, params + [event['user_id']])
+
+@report_events.subscribe
+def invalidate_user_report_stats(event):
+    with _cache_lock:
+        _cache.pop(event['user_id'], None)
+
+def build_user_report_stats(conn, user_id):
+    """Count a user's reports into a new row and return it.
+    
+    The reports are read with shared locks, so a report of this user still
+    being written is waited for and counted here (its listener found no row
+    to update), and reports written after this wait for the new row.
+    """
+    cur = conn.cursor(dictionary=True)
+    cur.execute("""
+        SELECT
+            COUNT(*) as total,
+            COALESCE(SUM(status = 'pending'), 0) as pending,
+            COALESCE(SUM(status = 'in_progress'), 0) as in_progress,
+            COALESCE(SUM(status = 'resolved'), 0) as resolved,
+            MAX(created_at) as last_report_at
+        FROM emergency_reports
+        WHERE user_id = %s
+        LOCK IN SHARE MODE
+    """, (user_id,))
+    stats = cur.fetchone()
+    
+    cur.execute("""
+        INSERT IGNORE INTO user_report_stats (user_id, total, pending, in_progress, resolved, last_report_at)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, (user_id, stats['total'], stats['pending'], stats['in_progress'], stats['resolved'],
+          stats['last_report_at']))
+    conn.commit()
+    cur.close()
+    return {key: int(value) if key != 'last_report_at' else value for key, value in stats.items()}
+
+def get_user_report_stats(user_id):
+    """{'total', 'pending', 'in_progress', 'resolved', 'last_report_at'} of a user's reports"""
+    from admin import get_db_connection
+    
+    cached = _cache.get(user_id)
+    if cached and time.monotonic() < cached[0]:
+        return cached[1]
+    
+    if not ensure_user_stats_table():
+        return dict(EMPTY_USER_STATS)
+    
+    conn = get_db_connection()
+    if not conn:
+        return dict(EMPTY_USER_STATS)
+    
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+            SELECT total, pending, in_progress, resolved, last_report_at
+            FROM user_report_stats
+            WHERE user_id = %s
+        """, (user_id,))
+        stats = cur.fetchone()
+        cur.close()
+        
+        if stats is None:
+            stats = build_user_report_stats(conn, user_id)
+        conn.close()
+    except Exception as e:
+        print(f"User report stats error: {e}")
+        conn.close()
+        return dict(EMPTY_USER_STATS)
+    
+    with _cache_lock:
+        if len(_cache) >= USER_STATS_MAX_CACHED:
+            _cache.clear()
+        _cache[user_id] = (time.monotonic() + USER_STATS_TTL, stats)
+    return stats